@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Per-activity storage.
+
+Every Garmin activity and manual entry is one row in the activities table
+(source 'garmin' or 'manual', keyed by its Garmin activity ID or manual_data
+ID). Triggers keep activity_daily_totals - TRIMP sum, activity count and names
+per day - up to date. Changing one activity is one insert, update or delete,
+and a day's total is one read instead of re-merging comma-joined strings.
+
+Days stored before the table existed carry one 'legacy' row with the Garmin
+part of their total. A writer that has fetched every Garmin activity of a day
+passes it in complete_days, which replaces the legacy row with the activities.
+
+recompute_daily_metrics hands a whole recompute to the recompute_training_metrics
+database function, which reads the totals, runs the ATL/CTL recurrence and
+writes garmin_data in one statement.
+"""
+
+import os
+from supabase_client import supabase
+from garmin_data_store import PAGE_SIZE
+
+REST_DAY = 'Rest day'
+WRITE_CHUNK_SIZE = 500
+# Set to 0 to compute metrics in Python instead of recompute_training_metrics
+DB_METRICS_RECOMPUTE = os.getenv('DB_METRICS_RECOMPUTE', '1') != '0'
+
+def garmin_activity_row(activity, trimp):
+    """activities row for a Garmin activity list entry and its TRIMP"""
+    start_time = activity.get('startTimeLocal') or activity.get('startTimeGMT')
+    return {
+        'activity_date': start_time.split(' ')[0],
+        'source': 'garmin',
+        'source_id': str(activity['activityId']),
+        'name': activity.get('activityName', 'Unknown'),
+        'trimp': float(trimp or 0),
+        'started_at': start_time
+    }
+
+def record_activities(user_id, rows, complete_days=()):
+    """
+    Insert or update a user's activities.
+
+    Args:
+        user_id (str): The user's ID
+        rows (list): Rows from garmin_activity_row()
+        complete_days (iterable): YYYY-MM-DD days whose Garmin activities are all in rows
+
+    Returns:
+        int: Number of activities written
+    """
+    rows = [dict(row, user_id=user_id) for row in rows]
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        supabase.table('activities') \
+            .upsert(rows[i:i + WRITE_CHUNK_SIZE], on_conflict='user_id,source,source_id') \
+            .execute()
+
+    complete_days = sorted(set(complete_days))
+    for i in range(0, len(complete_days), WRITE_CHUNK_SIZE):
+        supabase.table('activities') \
+            .delete() \
+            .eq('user_id', user_id) \
+            .eq('source', 'legacy') \
+            .in_('source_id', complete_days[i:i + WRITE_CHUNK_SIZE]) \
+            .execute()
+    return len(rows)
+
+def record_manual_activity(user_id, entry_id, date_str, activity_name, trimp):
+    """Insert or update the activity of a manual_data entry"""
+    record_activities(user_id, [{
+        'activity_date': date_str,
+        'source': 'manual',
+        'source_id': str(entry_id),
+        'name': activity_name,
+        'trimp': float(trimp or 0),
+        'started_at': None
+    }])
+
+def delete_manual_activity(user_id, entry_id):
+    """Remove the activity of a deleted manual_data entry"""
+    supabase.table('activities') \
+        .delete() \
+        .eq('user_id', user_id) \
+        .eq('source', 'manual') \
+        .eq('source_id', str(entry_id)) \
+        .execute()
+
+def get_daily_totals(user_id, start_date_str, end_date_str):
+    """
+    Get a user's daily activity totals between two dates (inclusive).
+
+    Returns:
+        dict: {YYYY-MM-DD: {'trimp': float, 'activity': str}} for days with activities
+    """
+    totals = {}
+    offset = 0
+
+    while True:
+        response = supabase.table('activity_daily_totals') \
+            .select('activity_date, trimp, activities') \
+            .eq('user_id', user_id) \
+            .gte('activity_date', start_date_str) \
+            .lte('activity_date', end_date_str) \
+            .order('activity_date') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        page = response.data or []
+        for row in page:
+            totals[row['activity_date']] = {
+                'trimp': float(row['trimp']),
+                'activity': row['activities'] or REST_DAY
+            }
+
+        if len(page) < PAGE_SIZE:
+            return totals
+        offset += PAGE_SIZE
+
+def get_daily_total(user_id, date_str):
+    """A day's activity total, {'trimp': 0.0, 'activity': 'Rest day'} when it has none"""
+    return get_daily_totals(user_id, date_str, date_str).get(date_str, {'trimp': 0.0, 'activity': REST_DAY})
+
+def recompute_daily_metrics(user_id, start_date_str, end_date_str=None, seed=None, decimals=2):
+    """
+    Rewrite garmin_data from the daily totals with the recompute_training_metrics function.
+
+    Args:
+        user_id (str): The user's ID
+        start_date_str (str): First day to write (YYYY-MM-DD)
+        end_date_str (str, optional): Last day to write, defaults to the last stored day
+        seed (tuple, optional): (ATL, CTL) of the day before start_date_str; defaults
+            to the latest stored row before it
+        decimals (int): Rounding applied after every day
+
+    Returns:
+        dict: days_written, last_day, atl, ctl, tsb (last_day None when nothing was written)
+    """
+    params = {
+        'target_user': user_id,
+        'start_day': start_date_str,
+        'end_day': end_date_str,
+        'decimals': decimals
+    }
+    if seed is not None:
+        params['seed_atl'], params['seed_ctl'] = float(seed[0]), float(seed[1])
+
+    response = supabase.rpc('recompute_training_metrics', params).execute()
+    return response.data[0]
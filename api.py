@@ -1,13 +1,20 @@
 from flask import Flask, request, jsonify, redirect
 from flask_cors import CORS
-from direct_garmin_sync import sync_garmin_data
+from direct_garmin_sync import sync_garmin_data, get_transfer_stats
 from sync_metrics_calculator import calculate_sync_metrics
 from chart_updater import update_chart_data
 from manual_data_processor import add_manual_entry, update_manual_entry, delete_manual_entry
+from chart_cache import get_chart_series, get_cache_stats
+from history_store import get_history_stats
+from coach_metrics import get_coach_athlete_metrics
+from tsb_planner import solve_tsb_plan, project_candidate_plans
+from sync_scheduler import record_sync_result
 from supabase import create_client, Client
 import os
+import math
 import traceback
 import sys
+import threading
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
@@ -111,7 +118,8 @@ def sync_garmin():
 
         data = request.json
         user_id = data.get('user_id')
-        days = data.get('days', 15)
+        # Without an explicit number of days the sync continues from the user's watermark
+        days = data.get('days')
         
         # Access user ID correctly from UserResponse object
         if not user_id or user_id != user.user.id:
@@ -121,7 +129,7 @@ def sync_garmin():
         print(f"Starting sync for user {user_id}, days={days}")
         
         # Calculate start date from days
-        start_date = datetime.now() - timedelta(days=days)
+        start_date = datetime.now() - timedelta(days=days) if days is not None else None
         is_first_sync = data.get('is_first_sync', False)
         
         # Use the original garmin_sync module for sync
@@ -129,6 +137,8 @@ def sync_garmin():
         
         # Sync Garmin data using the original implementation that works
         sync_result = sync_garmin_data(user_id, start_date, is_first_sync)
+        # Lets the scheduler skip users who just synced by hand
+        record_sync_result(user_id, sync_result)
         
         if not sync_result.get('success', False):
             return jsonify(sync_result)
@@ -144,6 +154,68 @@ def sync_garmin():
         print(traceback_str)
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/backfill-garmin', methods=['POST'])
+def backfill_garmin():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        data = request.json or {}
+        user_id = user.user.id
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        resume = data.get('resume', True)
+
+        if not start_date:
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+        try:
+            for value in (start_date, end_date):
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must be in YYYY-MM-DD format'}), 400
+
+        from garmin_backfill import backfill_garmin_history
+
+        # Multi-year imports outlive the request; progress is tracked in the backfill cursor
+        thread = threading.Thread(
+            target=backfill_garmin_history,
+            args=(user_id, start_date, end_date),
+            kwargs={'resume': resume},
+            daemon=True
+        )
+        thread.start()
+
+        return jsonify({
+            'success': True,
+            'message': 'Backfill started'
+        }), 202
+    except Exception as e:
+        log_error("Error in backfill_garmin endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/backfill-garmin/status', methods=['GET'])
+def backfill_garmin_status():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        from garmin_backfill import get_cursor
+
+        return jsonify({
+            'success': True,
+            'cursor': get_cursor(user.user.id)
+        })
+    except Exception as e:
+        log_error("Error in backfill_garmin_status endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/update-chart', methods=['POST', 'OPTIONS'])
 def update_chart():
     if request.method == 'OPTIONS':
@@ -288,6 +360,141 @@ def delete_manual_entry_endpoint(entry_id):
         log_error("Error in delete_manual_entry endpoint", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/chart-data', methods=['GET'])
+def chart_data():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        # Coaches may read the series of their linked athletes
+        user_id = request.args.get('athlete_id') or user.user.id
+        if user_id != user.user.id and not is_coach_of(user.user.id, user_id):
+            return jsonify({'success': False, 'error': 'Not allowed to view this athlete'}), 403
+
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        try:
+            for value in (start_date, end_date):
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must be in YYYY-MM-DD format'}), 400
+
+        series, cached = get_chart_series(user_id, start_date, end_date)
+
+        return jsonify({
+            'success': True,
+            'data': series,
+            'cached': cached
+        })
+
+    except Exception as e:
+        log_error("Error in chart_data endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/coach/athletes/metrics', methods=['GET'])
+def coach_athletes_metrics():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        try:
+            page = int(request.args.get('page', 1))
+            page_size = int(request.args.get('page_size', 50))
+            history_days = int(request.args.get('history_days', 0))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'page, page_size and history_days must be integers'}), 400
+
+        # Only athletes linked to the authenticated coach are returned
+        result = get_coach_athlete_metrics(user.user.id, page, page_size, history_days)
+
+        if result.get('success', False):
+            return jsonify(result)
+        else:
+            return jsonify(result), 500
+
+    except Exception as e:
+        log_error("Error in coach_athletes_metrics endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/tsb-plan', methods=['POST'])
+def tsb_plan():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        data = request.json or {}
+        user_id = data.get('athlete_id') or user.user.id
+        if user_id != user.user.id and not is_coach_of(user.user.id, user_id):
+            return jsonify({'success': False, 'error': 'Not allowed to view this athlete'}), 403
+
+        event_date = data.get('event_date')
+        target_tsb = data.get('target_tsb')
+        custom_days = data.get('custom_days') or {}
+
+        # Validate required fields
+        if not event_date or target_tsb is None:
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        try:
+            datetime.strptime(event_date, '%Y-%m-%d')
+            target_tsb = float(target_tsb)
+            custom_days = {date_str: float(trimp) for date_str, trimp in custom_days.items()}
+        except (ValueError, TypeError, AttributeError):
+            return jsonify({'success': False, 'error': 'Invalid event_date, target_tsb or custom_days'}), 400
+        if not math.isfinite(target_tsb) or not all(math.isfinite(trimp) for trimp in custom_days.values()):
+            return jsonify({'success': False, 'error': 'target_tsb and custom_days must be finite numbers'}), 400
+
+        result = solve_tsb_plan(user_id, event_date, target_tsb, custom_days)
+
+        if result.get('success', False):
+            return jsonify(result)
+        else:
+            return jsonify(result), 400
+
+    except Exception as e:
+        log_error("Error in tsb_plan endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/tsb-projection', methods=['POST'])
+def tsb_projection():
+    try:
+        # Verify authentication
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        data = request.json or {}
+        user_id = data.get('athlete_id') or user.user.id
+        if user_id != user.user.id and not is_coach_of(user.user.id, user_id):
+            return jsonify({'success': False, 'error': 'Not allowed to view this athlete'}), 403
+
+        try:
+            plans = [[float(trimp) for trimp in plan] for plan in data.get('plans') or []]
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'error': 'plans must be a list of lists of TRIMP values'}), 400
+
+        result = project_candidate_plans(user_id, plans)
+
+        if result.get('success', False):
+            return jsonify(result)
+        else:
+            return jsonify(result), 400
+
+    except Exception as e:
+        log_error("Error in tsb_projection endpoint", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Render"""
@@ -305,6 +512,30 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-process counters for Garmin logins, activity payloads, the chart cache and the history cache"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        user = verify_auth_token(auth_header)
+        if not user:
+            return jsonify({'success': False, 'error': 'Invalid or missing authentication token'}), 401
+
+        from garmin_sync import get_login_metrics
+
+        return jsonify({
+            'success': True,
+            'pid': os.getpid(),
+            'garmin_logins': get_login_metrics(),
+            'activity_payloads': get_transfer_stats(),
+            'chart_cache': get_cache_stats(),
+            'history_cache': get_history_stats()
+        })
+    except Exception as e:
+        print(f"Error in metrics: {e}")
+        print(traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/auth/callback')
 def auth_callback():
     # Handle the callback from Garmin auth
@@ -329,10 +560,10 @@ def auth_callback():
         return str(e), 500
 
 def get_manual_entry_by_id(entry_id):
-    """Get a manual entry by ID - helper function for API endpoints"""
+    """Get a manual entry's owner by ID - helper function for API endpoints"""
     try:
         response = supabase.table('manual_data') \
-            .select('*') \
+            .select('id, user_id') \
             .eq('id', entry_id) \
             .execute()
             
@@ -343,6 +574,20 @@ def get_manual_entry_by_id(entry_id):
         print(f"Error getting manual entry {entry_id}: {e}")
         return None
 
+def is_coach_of(coach_id, athlete_id):
+    """Check whether athlete_id is linked to coach_id in coach_athletes"""
+    try:
+        response = supabase.table('coach_athletes') \
+            .select('id') \
+            .eq('coach_id', coach_id) \
+            .eq('athlete_id', athlete_id) \
+            .limit(1) \
+            .execute()
+        return bool(response.data)
+    except Exception as e:
+        print(f"Error checking coach link {coach_id} -> {athlete_id}: {e}")
+        return False
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     print(f"\n{'='*50}")
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+asyncio Garmin sync for many users in one worker.
+
+Garmin activity lists, activity details and the PostgREST reads/writes go
+through httpx.AsyncClient, so one process keeps many requests in flight across
+users instead of blocking a thread per sync. Concurrency is bounded by
+semaphores: users synced at once, Garmin requests in flight overall, detail
+requests per user, and database requests. The SSO login itself still uses
+direct_garmin_login (run in a thread); its cookies are copied into the async
+client.
+
+Usage: python async_garmin_sync.py [user_id ...]   (all users when none given)
+"""
+
+import os
+import sys
+import time
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+import httpx
+import numpy as np
+from activity_store import REST_DAY, WRITE_CHUNK_SIZE, garmin_activity_row
+from chart_cache import invalidate_user
+from direct_garmin_sync import MODERN_URL, direct_garmin_login, has_trimp_field, record_transfer, get_transfer_stats
+from garmin_backfill import extract_trimp
+from garmin_data_store import normalize_date
+from sync_watermark import get_watermark, sync_start, filter_new_activities, advance_watermark
+from training_metrics import DEFAULT_SEED, ATL_DAYS, CTL_DAYS, project_load
+
+ASYNC_SYNC_MAX_USERS = int(os.getenv('ASYNC_SYNC_MAX_USERS', '50'))
+ASYNC_GARMIN_CONCURRENCY = int(os.getenv('ASYNC_GARMIN_CONCURRENCY', '100'))
+ASYNC_DETAIL_CONCURRENCY_PER_USER = int(os.getenv('ASYNC_DETAIL_CONCURRENCY_PER_USER', '8'))
+ASYNC_DB_CONCURRENCY = int(os.getenv('ASYNC_DB_CONCURRENCY', '20'))
+# SSO logins run in threads and are the slowest step, so they get their own limit
+ASYNC_LOGIN_CONCURRENCY = int(os.getenv('ASYNC_LOGIN_CONCURRENCY', '8'))
+REQUEST_TIMEOUT_SECONDS = 30
+ACTIVITY_PAGE_SIZE = 100
+DEFAULT_SYNC_DAYS = 15
+
+class SyncLimits:
+    """Semaphores shared by all user syncs of one run"""
+
+    def __init__(self):
+        self.users = asyncio.Semaphore(ASYNC_SYNC_MAX_USERS)
+        self.garmin = asyncio.Semaphore(ASYNC_GARMIN_CONCURRENCY)
+        self.db = asyncio.Semaphore(ASYNC_DB_CONCURRENCY)
+        self.logins = asyncio.Semaphore(ASYNC_LOGIN_CONCURRENCY)
+
+def postgrest_client():
+    """Async client for the Supabase REST API with the service key"""
+    url = os.getenv('SUPABASE_URL')
+    key = os.getenv('SUPABASE_KEY')
+    return httpx.AsyncClient(
+        base_url=f"{url}/rest/v1",
+        headers={
+            'apikey': key,
+            'Authorization': f"Bearer {key}",
+            'Content-Type': 'application/json'
+        },
+        timeout=REQUEST_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=ASYNC_DB_CONCURRENCY, max_keepalive_connections=ASYNC_DB_CONCURRENCY)
+    )
+
+async def rest_request(db, limits, method, table, params=None, json=None, prefer=None):
+    """One PostgREST request; raises on an error status"""
+    headers = {'Prefer': prefer} if prefer else None
+    async with limits.db:
+        response = await db.request(method, f"/{table}", params=params, json=json, headers=headers)
+    response.raise_for_status()
+    return response.json() if response.content else None
+
+async def garmin_login(db, limits, user_id):
+    """Log the user in and return an AsyncClient carrying the Garmin session cookies"""
+    rows = await rest_request(db, limits, 'GET', 'garmin_credentials', {
+        'select': 'email, password',
+        'user_id': f"eq.{user_id}"
+    })
+    if not rows or not rows[0].get('email') or not rows[0].get('password'):
+        raise Exception("Missing or invalid Garmin credentials")
+
+    async with limits.logins:
+        session = await asyncio.to_thread(direct_garmin_login, rows[0]['email'], rows[0]['password'])
+
+    cookies = httpx.Cookies()
+    for cookie in session.cookies:
+        cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path)
+    return httpx.AsyncClient(
+        headers=dict(session.headers),
+        cookies=cookies,
+        timeout=REQUEST_TIMEOUT_SECONDS,
+        follow_redirects=True
+    )
+
+async def garmin_get(garmin, limits, url, params=None, with_size=False):
+    async with limits.garmin:
+        response = await garmin.get(url, params=params)
+    if response.status_code != 200:
+        raise Exception(f"Garmin request {url} failed with status {response.status_code}")
+    if with_size:
+        return response.json(), len(response.content)
+    return response.json()
+
+async def fetch_activities(garmin, limits, start_date_str, end_date_str):
+    """All activities between the dates, page by page"""
+    activities = []
+    page_start = 0
+    while True:
+        page = await garmin_get(garmin, limits, f"{MODERN_URL}/activitylist-service/activities/search/between", {
+            'startDate': start_date_str,
+            'endDate': end_date_str,
+            'start': page_start,
+            'limit': ACTIVITY_PAGE_SIZE
+        })
+        activities.extend(page)
+        if len(page) < ACTIVITY_PAGE_SIZE:
+            return activities
+        page_start += ACTIVITY_PAGE_SIZE
+
+async def fetch_activity_trimp(garmin, limits, user_limit, activity):
+    """
+    (activity, trimp), or (activity, None) when no payload could be fetched.
+
+    Like direct_garmin_sync.get_activity_details, the small summary is tried
+    first and /details only when it has no Connect IQ fields.
+    """
+    summary_url = f"{MODERN_URL}/activity-service/activity/{activity['activityId']}"
+    summary_bytes = 0
+    details_bytes = 0
+    payload = None
+    async with user_limit:
+        try:
+            payload, summary_bytes = await garmin_get(garmin, limits, summary_url, with_size=True)
+            if not has_trimp_field(payload):
+                payload, details_bytes = await garmin_get(garmin, limits, f"{summary_url}/details", with_size=True)
+        except Exception as e:
+            print(f"Could not get details for activity {activity['activityId']}: {e}")
+        finally:
+            record_transfer(summary_bytes, details_bytes)
+    if payload is None:
+        return activity, None
+    return activity, extract_trimp(activity, payload)
+
+def window_totals(start_date, end_date, total_rows):
+    """
+    Daily totals for every day of the window; days without activities are rest days.
+
+    Returns:
+        tuple: (list of YYYY-MM-DD dates, TRIMP array, list of activity strings)
+    """
+    totals = {normalize_date(row['activity_date']): row for row in total_rows}
+    dates, trimp, activity = [], [], []
+
+    day = start_date
+    while day <= end_date:
+        date_str = day.strftime('%Y-%m-%d')
+        row = totals.get(date_str)
+        dates.append(date_str)
+        trimp.append(float(row['trimp']) if row else 0.0)
+        activity.append(row['activities'] if row else REST_DAY)
+        day += timedelta(days=1)
+
+    return dates, np.array(trimp, dtype=float), activity
+
+async def record_user_activities(db, limits, user_id, rows, complete_days):
+    """Upsert activities rows and drop the legacy rows of days whose activities were all fetched"""
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        await rest_request(db, limits, 'POST', 'activities', {'on_conflict': 'user_id,source,source_id'}, json=[
+            dict(row, user_id=user_id) for row in rows[i:i + WRITE_CHUNK_SIZE]
+        ], prefer='resolution=merge-duplicates,return=minimal')
+    for i in range(0, len(complete_days), WRITE_CHUNK_SIZE):
+        await rest_request(db, limits, 'DELETE', 'activities', {
+            'user_id': f"eq.{user_id}",
+            'source': 'eq.legacy',
+            'source_id': f"in.({','.join(complete_days[i:i + WRITE_CHUNK_SIZE])})"
+        })
+
+async def sync_user(db, limits, user_id, start_date=None):
+    """
+    Sync one user: list and detail new activities, record them and write the
+    window's daily totals with recomputed metrics in one upsert.
+
+    Returns:
+        dict: Result of the operation
+    """
+    async with limits.users:
+        started = time.monotonic()
+        locked = False
+        garmin = None
+        try:
+            if await rest_request(db, limits, 'GET', 'sync_locks', {'select': 'user_id', 'user_id': f"eq.{user_id}"}):
+                return {'success': True, 'message': 'Sync already in progress'}
+            await rest_request(db, limits, 'POST', 'sync_locks', json={'user_id': user_id, 'timestamp': datetime.now().isoformat()})
+            locked = True
+
+            garmin = await garmin_login(db, limits, user_id)
+
+            watermark = await asyncio.to_thread(get_watermark, user_id)
+            if start_date is None:
+                if watermark:
+                    start_date = sync_start(watermark).replace(hour=0, minute=0, second=0, microsecond=0)
+                else:
+                    start_date = datetime.now() - timedelta(days=DEFAULT_SYNC_DAYS)
+            start = start_date.date()
+            end = datetime.now().date()
+            start_str = start.strftime('%Y-%m-%d')
+
+            activities = await fetch_activities(garmin, limits, start_str, end.strftime('%Y-%m-%d'))
+            listed = activities
+            activities = [
+                activity for activity in filter_new_activities(listed, watermark)
+                if activity.get('activityId') and (activity.get('startTimeLocal') or activity.get('startTimeGMT'))
+            ]
+            # Days with an activity the watermark shows was imported before
+            new_ids = {id(activity) for activity in activities}
+            seen_days = {
+                (activity.get('startTimeLocal') or activity.get('startTimeGMT') or '').split(' ')[0]
+                for activity in listed if id(activity) not in new_ids
+            }
+
+            # Details of all new activities are fetched concurrently, at most
+            # ASYNC_DETAIL_CONCURRENCY_PER_USER at a time for this user
+            user_limit = asyncio.Semaphore(ASYNC_DETAIL_CONCURRENCY_PER_USER)
+            results = await asyncio.gather(*[
+                fetch_activity_trimp(garmin, limits, user_limit, activity) for activity in activities
+            ])
+
+            rows = []
+            imported = []
+            failed_days = set()
+            for activity, trimp in results:
+                if trimp is None:
+                    failed_days.add((activity.get('startTimeLocal') or activity.get('startTimeGMT')).split(' ')[0])
+                    continue
+                rows.append(garmin_activity_row(activity, trimp))
+                imported.append(activity)
+
+            # A day counts either its legacy row or all of its activities, never part of
+            # them; days with a failed activity are listed again on the next sync
+            rows = [row for row in rows if row['activity_date'] not in failed_days]
+            imported = [
+                activity for activity in imported
+                if (activity.get('startTimeLocal') or activity.get('startTimeGMT')).split(' ')[0] not in failed_days
+            ]
+
+            # Days whose listed activities are all in rows no longer need their legacy rows
+            complete_days = [
+                (start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)
+            ]
+            complete_days = [day for day in complete_days if day not in failed_days and day not in seen_days]
+            await record_user_activities(db, limits, user_id, rows, complete_days)
+
+            total_rows, seed_rows = await asyncio.gather(
+                rest_request(db, limits, 'GET', 'activity_daily_totals', {
+                    'select': 'activity_date, trimp, activities',
+                    'user_id': f"eq.{user_id}",
+                    'activity_date': f"gte.{start_str}",
+                    'order': 'activity_date'
+                }),
+                rest_request(db, limits, 'GET', 'garmin_data', {
+                    'select': 'date, atl, ctl',
+                    'user_id': f"eq.{user_id}",
+                    'date': f"lt.{start_str}",
+                    'order': 'date.desc',
+                    'limit': 1
+                })
+            )
+
+            # The latest row before the window decays over any days missing before it
+            atl0, ctl0 = DEFAULT_SEED['atl'], DEFAULT_SEED['ctl']
+            seed = seed_rows[0] if seed_rows else {}
+            if seed.get('atl') is not None and seed.get('ctl') is not None:
+                gap = (start - datetime.strptime(normalize_date(seed['date']), '%Y-%m-%d').date()).days - 1
+                atl0 = float(seed['atl']) * (1 - 1 / ATL_DAYS) ** gap
+                ctl0 = float(seed['ctl']) * (1 - 1 / CTL_DAYS) ** gap
+
+            dates, trimp, activity = window_totals(start, end, total_rows or [])
+            atl, ctl, tsb = project_load(trimp, atl0, ctl0)
+
+            await rest_request(db, limits, 'POST', 'garmin_data', {'on_conflict': 'user_id,date'}, json=[
+                {
+                    'user_id': user_id,
+                    'date': dates[i],
+                    'trimp': float(trimp[i]),
+                    'activity': activity[i],
+                    'atl': round(float(atl[i]), 1),
+                    'ctl': round(float(ctl[i]), 1),
+                    'tsb': round(float(tsb[i]), 1)
+                }
+                for i in range(len(dates))
+            ], prefer='resolution=merge-duplicates,return=minimal')
+
+            hold_before = datetime.strptime(min(failed_days), '%Y-%m-%d') if failed_days else None
+            await asyncio.to_thread(advance_watermark, user_id, watermark, imported, hold_before=hold_before)
+            print(f"Async sync for {user_id}: {len(imported)} new activities, {len(dates)} days in {time.monotonic() - started:.1f}s")
+
+            return {
+                'success': True,
+                'newActivities': len(imported),
+                'processed_dates': dates,
+                'message': 'Activities and metrics saved in a single row per date'
+            }
+
+        except Exception as e:
+            print(f"Error in async sync for {user_id}: {e}")
+            print(traceback.format_exc())
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+        finally:
+            if garmin:
+                await garmin.aclose()
+            if locked:
+                since_date = start_date.strftime('%Y-%m-%d') if isinstance(start_date, datetime) else None
+                await asyncio.to_thread(invalidate_user, user_id, since_date)
+                try:
+                    await rest_request(db, limits, 'DELETE', 'sync_locks', {'user_id': f"eq.{user_id}"})
+                except Exception as e:
+                    print(f"Error removing lock: {e}")
+
+async def sync_users(user_ids, start_date=None):
+    """
+    Sync many users concurrently.
+
+    Returns:
+        dict: {user_id: result}
+    """
+    limits = SyncLimits()
+    async with postgrest_client() as db:
+        results = await asyncio.gather(*[sync_user(db, limits, user_id, start_date) for user_id in user_ids])
+    return dict(zip(user_ids, results))
+
+def run_async_sync(user_ids, start_date=None):
+    """Blocking entry point for callers outside an event loop"""
+    return asyncio.run(sync_users(user_ids, start_date))
+
+if __name__ == "__main__":
+    from sync_scheduler import _fetch_all_user_ids, record_sync_result
+
+    user_ids = sys.argv[1:] or _fetch_all_user_ids()
+    started = time.monotonic()
+    results = run_async_sync(user_ids)
+    for user_id, result in results.items():
+        record_sync_result(user_id, result)
+
+    succeeded = sum(1 for result in results.values() if result.get('success'))
+    print(f"Synced {succeeded}/{len(user_ids)} users in {time.monotonic() - started:.1f}s")
+    print(f"Activity payloads: {get_transfer_stats()}")
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Cache of per-user chart series built from garmin_data.
+
+Series live in an in-process LRU. When a shared tier is configured (Redis via
+CHART_CACHE_REDIS_URL, or the local stand-in for development) it also stores the
+series and a per-user generation counter, so a write handled by one gunicorn
+worker invalidates the entries held by every other worker.
+
+Every code path that writes garmin_data must call invalidate_user() afterwards,
+passing the earliest date it wrote when it knows it. Those dates are kept per
+generation so the columnar history cache (history_store) can refresh only the
+rows that changed.
+"""
+
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CHART_CACHE_MAX_ENTRIES = int(os.getenv('CHART_CACHE_MAX_ENTRIES', '512'))
+CHART_CACHE_TTL_SECONDS = int(os.getenv('CHART_CACHE_TTL_SECONDS', '900'))
+# '' (in-process only), 'redis' or 'local'
+CHART_CACHE_SHARED = os.getenv('CHART_CACHE_SHARED', '').lower()
+CHART_CACHE_REDIS_URL = os.getenv('CHART_CACHE_REDIS_URL') or os.getenv('REDIS_URL')
+# Generations whose earliest written date is remembered; readers further behind reload everything
+SINCE_MARKERS_KEPT = 64
+SINCE_MARKER_TTL_SECONDS = 7 * 24 * 3600
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+class LocalSharedTier:
+    """
+    In-memory stand-in for the Redis commands the cache uses (get, set with ex, incr).
+    Only shared within one process - meant for development and single-worker runs.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            expires_at = time.monotonic() + ex if ex else None
+            self._values[key] = (expires_at, value)
+
+    def incr(self, key):
+        with self._lock:
+            _, value = self._values.get(key, (None, 0))
+            value = int(value) + 1
+            self._values[key] = (None, value)
+            return value
+
+def _create_shared_tier():
+    if CHART_CACHE_SHARED == 'local':
+        print("Chart cache: using local shared tier stand-in")
+        return LocalSharedTier()
+    if CHART_CACHE_SHARED == 'redis' or (not CHART_CACHE_SHARED and CHART_CACHE_REDIS_URL):
+        if redis is None:
+            print("Chart cache: redis package not installed, using in-process cache only")
+            return None
+        if not CHART_CACHE_REDIS_URL:
+            print("Chart cache: CHART_CACHE_REDIS_URL not set, using in-process cache only")
+            return None
+        print("Chart cache: using Redis shared tier")
+        return redis.Redis.from_url(CHART_CACHE_REDIS_URL)
+    return None
+
+_local = LRUCache(CHART_CACHE_MAX_ENTRIES, CHART_CACHE_TTL_SECONDS)
+_shared = _create_shared_tier()
+_local_generations = {}
+_local_since = {}
+_generations_lock = threading.Lock()
+_stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+def _generation_key(user_id):
+    return f"chart_series_gen:{user_id}"
+
+def _get_generation(user_id):
+    if _shared is not None:
+        try:
+            value = _shared.get(_generation_key(user_id))
+            return int(value) if value is not None else 0
+        except Exception as e:
+            print(f"Chart cache: error reading generation for {user_id}: {e}")
+    with _generations_lock:
+        return _local_generations.get(user_id, 0)
+
+def _since_key(user_id, generation):
+    return f"chart_series_since:{user_id}:{generation}"
+
+def invalidate_user(user_id, since_date=None):
+    """
+    Drop every cached series for a user. Call after any write to their garmin_data.
+
+    Args:
+        user_id (str): The user whose rows changed
+        since_date (str, optional): Earliest date written (YYYY-MM-DD); without it
+            readers of the history cache reload the user's whole history
+    """
+    if not user_id:
+        return
+    _stats['invalidations'] += 1
+    with _generations_lock:
+        generation = _local_generations.get(user_id, 0) + 1
+        _local_generations[user_id] = generation
+        _local_since[(user_id, generation)] = since_date or ''
+        _local_since.pop((user_id, generation - SINCE_MARKERS_KEPT), None)
+    _local.delete_where(lambda key: key[0] == user_id)
+    if _shared is not None:
+        try:
+            generation = _shared.incr(_generation_key(user_id))
+            _shared.set(_since_key(user_id, generation), since_date or '', ex=SINCE_MARKER_TTL_SECONDS)
+        except Exception as e:
+            print(f"Chart cache: error invalidating shared tier for {user_id}: {e}")
+
+def _get_since_marker(user_id, generation):
+    if _shared is not None:
+        try:
+            value = _shared.get(_since_key(user_id, generation))
+            return value.decode() if isinstance(value, bytes) else value
+        except Exception as e:
+            print(f"Chart cache: error reading since marker for {user_id}: {e}")
+            return None
+    with _generations_lock:
+        return _local_since.get((user_id, generation))
+
+def changes_since(user_id, generation):
+    """
+    Find what a user's history lost since a cached copy was taken at a generation.
+
+    Args:
+        user_id (str): The user's ID
+        generation (int or None): Generation stored with the cached copy
+
+    Returns:
+        tuple: (current generation, since) where since is None when nothing was
+            written, the earliest date written, or '' when everything must be reloaded
+    """
+    current = _get_generation(user_id)
+    if generation == current:
+        return current, None
+    if generation is None or generation > current or current - generation >= SINCE_MARKERS_KEPT:
+        return current, ''
+
+    dates = []
+    for written in range(generation + 1, current + 1):
+        marker = _get_since_marker(user_id, written)
+        if not marker:
+            return current, ''
+        dates.append(marker)
+    return current, min(dates)
+
+def shared_tier_enabled():
+    """Whether generations are shared between processes"""
+    return _shared is not None
+
+def get_or_load(user_id, params, loader):
+    """
+    Return the cached value for (user_id, params), calling loader() on a miss.
+
+    Args:
+        user_id (str): Owner of the series; used for invalidation
+        params (tuple): Hashable, JSON-serializable request parameters (e.g. date range)
+        loader (callable): Builds the value; must return JSON-serializable data
+
+    Returns:
+        tuple: (value, cached) where cached is True when no loader call was needed
+    """
+    generation = _get_generation(user_id)
+    key = (user_id, generation) + tuple(params)
+
+    value = _local.get(key)
+    if value is not None:
+        _stats['hits'] += 1
+        return value, True
+
+    shared_key = 'chart_series:' + ':'.join(str(part) for part in key)
+    if _shared is not None:
+        try:
+            payload = _shared.get(shared_key)
+            if payload is not None:
+                value = json.loads(payload)
+                _local.set(key, value)
+                _stats['shared_hits'] += 1
+                return value, True
+        except Exception as e:
+            print(f"Chart cache: error reading shared tier: {e}")
+
+    _stats['misses'] += 1
+    value = loader()
+    _local.set(key, value)
+    if _shared is not None:
+        try:
+            _shared.set(shared_key, json.dumps(value), ex=CHART_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"Chart cache: error writing shared tier: {e}")
+    return value, False
+
+def get_chart_series(user_id, start_date_str=None, end_date_str=None):
+    """
+    Get a user's chart series (date, trimp, activity, atl, ctl, tsb) for a date range.
+
+    Returns:
+        tuple: (series, cached)
+    """
+    from garmin_data_store import fetch_garmin_series, normalize_date
+
+    def load():
+        from history_store import read_history_range, history_series
+
+        table = read_history_range(user_id, start_date_str, end_date_str)
+        if table is not None:
+            return history_series(table)
+
+        rows = fetch_garmin_series(user_id, start_date_str, end_date_str)
+        series = []
+        for row in rows:
+            series.append({
+                'date': normalize_date(row['date']),
+                'trimp': float(row['trimp']) if row.get('trimp') is not None else 0.0,
+                'activity': row.get('activity') or 'Rest day',
+                'atl': float(row['atl']) if row.get('atl') is not None else None,
+                'ctl': float(row['ctl']) if row.get('ctl') is not None else None,
+                'tsb': float(row['tsb']) if row.get('tsb') is not None else None
+            })
+        return series
+
+    return get_or_load(user_id, ('series', start_date_str or '', end_date_str or ''), load)
+
+def get_cache_stats():
+    """Counters for the health/metrics endpoints"""
+    return dict(_stats, entries=len(_local), shared_tier=type(_shared).__name__ if _shared is not None else None)
@@ -12,6 +12,9 @@ import time
 import math
 from datetime import timedelta
 from manual_data_processor import batch_fetch_garmin_data, batch_fetch_manual_data
+from chart_cache import invalidate_user
+from activity_store import garmin_activity_row, record_activities
+from metrics_checkpoints import seed_metrics
 
 load_dotenv()
 
@@ -322,6 +325,11 @@ class ChartUpdater:
                         activity_names.append(activity_name)
                         print(f"Activity {activity_name} (ID: {activity_id}): TRIMP = {trimp}")
                         self.processed_activity_ids.add(activity_id)
+                    # These are all of the day's activities, so its legacy row goes
+                    record_activities(self.user_id, [
+                        garmin_activity_row(activity, activity.get('trimp', 0)) for activity in activities
+                        if activity.get('activityId') and (activity.get('startTimeLocal') or activity.get('startTimeGMT'))
+                    ], [date_str])
                 else:
                     print(f"No activities found for {date_str}")
                 
@@ -361,6 +369,9 @@ class ChartUpdater:
                 
                 updated_count += 1
             
+            if updated_count > 0:
+                invalidate_user(self.user_id)
+            
             print(f"\n=== Update completed ===")
             print(f"Total records processed: {updated_count}")
             return {'success': True, 'updated': updated_count}
@@ -410,7 +421,12 @@ class ChartUpdater:
                     'tsb': float(data['tsb'])
                 }
         
-        # If not in cache, query the database
+        # Nearest month-end checkpoint plus at most a month of replayed days
+        seeded = seed_metrics(self.user_id, date_str)
+        if seeded:
+            return seeded
+        
+        # If no checkpoint, query the database
         response = self.client.table('garmin_data') \
             .select('trimp, atl, ctl, tsb') \
             .eq('user_id', self.user_id) \
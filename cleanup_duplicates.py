@@ -1,117 +1,338 @@
 from datetime import datetime
 from supabase_client import supabase
+from chart_cache import invalidate_user
+from garmin_data_store import PAGE_SIZE, fetch_garmin_rows_for_users, normalize_date
 import pandas as pd
+import numpy as np
+import os
 import sys
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Users whose duplicate rows are loaded and merged together
+USER_PAGE_SIZE = 200
+WRITE_CHUNK_SIZE = 500
+
+# Users audited together by one worker task
+AUDIT_CHUNK_SIZE = 50
+# Stored metrics are rounded to 1-2 decimals, so smaller differences are not discontinuities
+AUDIT_TOLERANCE = 0.11
+AUDIT_EXAMPLE_DATES = 5
+
+def fetch_duplicate_users(after_user=None, max_users=USER_PAGE_SIZE):
+    """One page of users with duplicate days, grouped in the database"""
+    response = supabase.rpc('garmin_data_duplicate_users', {
+        'after_user': after_user,
+        'max_users': max_users
+    }).execute()
+    return response.data or []
+
+def fetch_duplicate_rows(user_ids):
+    """All rows of the given users' duplicate days, keyset-paged past the row cap"""
+    rows = []
+    cursor = {'after_user': None, 'after_date': None, 'after_id': None}
+    while True:
+        response = supabase.rpc('garmin_data_duplicate_rows', {
+            'user_ids': user_ids,
+            'max_rows': PAGE_SIZE,
+            **cursor
+        }).execute()
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        last = page[-1]
+        cursor = {'after_user': last['user_id'], 'after_date': last['date'], 'after_id': last['id']}
+
+def merge_duplicate_groups(df):
+    """
+    Merge each (user, day) group into one row.
+
+    The row with the highest TRIMP provides trimp and activity, the latest row
+    with metrics provides atl/ctl/tsb and is kept (updated in place); the other
+    rows of the group are deleted. Groups without both kinds of row are left alone.
+
+    Args:
+        df (DataFrame): Rows of duplicate days
+
+    Returns:
+        tuple: (merged rows to upsert by id, ids to delete, number of skipped groups)
+    """
+    df = df.copy()
+    df['day'] = pd.to_datetime(df['date'], format='ISO8601').dt.strftime('%Y-%m-%d')
+    df['trimp'] = pd.to_numeric(df['trimp'], errors='coerce')
+    keys = ['user_id', 'day']
+
+    activity_entries = df[df['trimp'] > 0] \
+        .sort_values('trimp') \
+        .groupby(keys).tail(1)[keys + ['trimp', 'activity']]
+    metrics_entries = df[df['atl'].notnull()] \
+        .sort_values('created_at', na_position='first') \
+        .groupby(keys).tail(1)[keys + ['id', 'date', 'atl', 'ctl', 'tsb']]
+
+    merged = metrics_entries.merge(activity_entries, on=keys)
+    groups = df.groupby(keys).ngroups
+
+    merged_keys = merged.set_index(keys).index
+    in_merged = df.set_index(keys).index.isin(merged_keys)
+    delete_ids = df.loc[in_merged & ~df['id'].isin(merged['id']), 'id'].tolist()
+
+    rows = [
+        {
+            'id': row.id,
+            'user_id': row.user_id,
+            'date': row.date,
+            'trimp': float(row.trimp),
+            'activity': row.activity,
+            'atl': float(row.atl),
+            'ctl': float(row.ctl),
+            'tsb': float(row.tsb) if pd.notna(row.tsb) else None
+        }
+        for row in merged.itertuples(index=False)
+    ]
+    return rows, delete_ids, groups - len(merged)
+
+def apply_merges(rows, delete_ids):
+    """Write merged rows, then remove the rows folded into them, in chunks"""
+    # Deleted rows share a day with a merged row, so the merged rows bound what changed
+    since_dates = {}
+    for row in rows:
+        day = normalize_date(row['date'])
+        since_dates[row['user_id']] = min(day, since_dates.get(row['user_id'], day))
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        supabase.table('garmin_data')\
+            .upsert(rows[i:i + WRITE_CHUNK_SIZE], on_conflict='id')\
+            .execute()
+    for i in range(0, len(delete_ids), WRITE_CHUNK_SIZE):
+        supabase.table('garmin_data')\
+            .delete()\
+            .in_('id', delete_ids[i:i + WRITE_CHUNK_SIZE])\
+            .execute()
+    for user_id, since_date in since_dates.items():
+        invalidate_user(user_id, since_date)
 
 def merge_duplicate_entries(user_id=None):
     """
     Merge duplicate date entries for a user or all users.
     Combines activity and TRIMP data with metrics (ATL, CTL, TSB) into a single row.
+
+    Users with duplicates are found by a grouped query and processed
+    USER_PAGE_SIZE at a time, so the full table is never loaded.
     """
     print(f"\n{'='*50}")
     print(f"Starting duplicate cleanup process at {datetime.now().isoformat()}")
-    
+
     try:
-        # Get all data if no user_id specified, otherwise filter by user_id
-        query = supabase.table('garmin_data').select('*')
-        if user_id:
-            print(f"Running cleanup for user: {user_id}")
-            query = query.eq('user_id', user_id)
-        
-        response = query.execute()
-        
-        if not response.data:
-            print("No data found to clean up")
-            return
-            
-        # Load data into DataFrame
-        df = pd.DataFrame(response.data)
-        print(f"Retrieved {len(df)} total rows")
-        
-        # Count unique dates
-        unique_dates = df.groupby(['user_id', 'date']).size().reset_index(name='count')
-        duplicate_dates = unique_dates[unique_dates['count'] > 1]
-        print(f"Found {len(duplicate_dates)} duplicate date entries")
-        
-        if len(duplicate_dates) == 0:
+        merged_total = 0
+        deleted_total = 0
+        skipped_total = 0
+        after_user = None
+
+        while True:
+            if user_id:
+                print(f"Running cleanup for user: {user_id}")
+                user_ids = [user_id]
+            else:
+                page = fetch_duplicate_users(after_user)
+                if not page:
+                    break
+                user_ids = [row['user_id'] for row in page]
+                after_user = user_ids[-1]
+                print(f"\nProcessing {len(user_ids)} users with {sum(row['duplicate_days'] for row in page)} duplicate days")
+
+            rows = fetch_duplicate_rows(user_ids)
+            if rows:
+                merged, delete_ids, skipped = merge_duplicate_groups(pd.DataFrame(rows))
+                apply_merges(merged, delete_ids)
+                merged_total += len(merged)
+                deleted_total += len(delete_ids)
+                skipped_total += skipped
+                print(f"Merged {len(merged)} days, deleted {len(delete_ids)} rows, "
+                      f"{skipped} days without both activity and metrics entries")
+
+            if user_id or len(user_ids) < USER_PAGE_SIZE:
+                break
+
+        if merged_total == 0 and skipped_total == 0:
             print("No duplicate dates found, nothing to clean up")
             return
-            
-        # Process each duplicate
-        success_count = 0
-        for _, row in duplicate_dates.iterrows():
-            user_id = row['user_id']
-            date = row['date']
-            
-            # Get all entries for this date
-            date_entries = df[(df['user_id'] == user_id) & (df['date'] == date)]
-            print(f"\nProcessing {len(date_entries)} entries for {user_id} on {date}")
-            
-            # Find which entry has activity/TRIMP and which has metrics
-            has_trimp = date_entries['trimp'].notnull() & (date_entries['trimp'] > 0)
-            has_metrics = date_entries['atl'].notnull()
-            
-            # Extract data from each entry
-            activity_entry = None
-            metrics_entry = None
-            
-            for _, entry in date_entries.iterrows():
-                if pd.notna(entry['trimp']) and entry['trimp'] > 0:
-                    if activity_entry is None or entry['trimp'] > activity_entry['trimp']:
-                        activity_entry = entry
-                        
-                if pd.notna(entry['atl']):
-                    metrics_entry = entry
-            
-            # If we have both activity and metrics entries, merge them
-            if activity_entry is not None and metrics_entry is not None:
-                # Create merged entry
-                merged_entry = {
-                    'user_id': user_id,
-                    'date': date,
-                    'trimp': float(activity_entry['trimp']),
-                    'activity': activity_entry['activity'],
-                    'atl': float(metrics_entry['atl']),
-                    'ctl': float(metrics_entry['ctl']),
-                    'tsb': float(metrics_entry['tsb'])
-                }
-                
-                print(f"Merging entries:")
-                print(f"TRIMP: {merged_entry['trimp']}, Activity: {merged_entry['activity']}")
-                print(f"ATL: {merged_entry['atl']}, CTL: {merged_entry['ctl']}, TSB: {merged_entry['tsb']}")
-                
-                # Delete all entries for this date
-                delete_response = supabase.table('garmin_data')\
-                    .delete()\
-                    .eq('user_id', user_id)\
-                    .eq('date', date)\
-                    .execute()
-                
-                # Insert merged entry
-                insert_response = supabase.table('garmin_data')\
-                    .insert(merged_entry)\
-                    .execute()
-                
-                if insert_response.data:
-                    success_count += 1
-                    print(f"Successfully merged entries for {date}")
-                else:
-                    print(f"Failed to insert merged entry for {date}")
-            else:
-                print(f"Couldn't find both activity and metrics entries for {date}")
-        
-        print(f"\nCleanup complete! Successfully merged {success_count} duplicate entries.")
-    
+
+        print(f"\nCleanup complete! Successfully merged {merged_total} duplicate entries "
+              f"({deleted_total} rows removed, {skipped_total} left for manual review).")
+
     except Exception as e:
         print(f"Error in cleanup process: {str(e)}")
         import traceback
         traceback.print_exc()
 
+def fetch_all_profile_user_ids():
+    """Every user ID, paged past the row cap"""
+    user_ids = []
+    offset = 0
+    while True:
+        response = supabase.table('profiles')\
+            .select('user_id')\
+            .order('user_id')\
+            .range(offset, offset + PAGE_SIZE - 1)\
+            .execute()
+        page = response.data or []
+        user_ids.extend(row['user_id'] for row in page if row.get('user_id'))
+        if len(page) < PAGE_SIZE:
+            return user_ids
+        offset += PAGE_SIZE
+
+def fetch_manual_rows_for_users(user_ids):
+    rows = []
+    offset = 0
+    while True:
+        response = supabase.table('manual_data')\
+            .select('user_id, date, trimp')\
+            .in_('user_id', user_ids)\
+            .order('user_id')\
+            .order('date')\
+            .range(offset, offset + PAGE_SIZE - 1)\
+            .execute()
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+def _examples(days):
+    return sorted(days)[:AUDIT_EXAMPLE_DATES]
+
+def find_data_issues(garmin_df, manual_df):
+    """
+    Find duplicate days, metric discontinuities and orphaned manual totals.
+
+    Args:
+        garmin_df (DataFrame): garmin_data rows (user_id, date, trimp, atl, ctl, tsb)
+        manual_df (DataFrame): manual_data rows (user_id, date, trimp)
+
+    Returns:
+        dict: {user_id: {issue: {'count', 'examples'}}} for users with issues
+    """
+    issues = {}
+
+    def add(frame, issue):
+        for user_id, days in frame.groupby('user_id')['day']:
+            issues.setdefault(user_id, {})[issue] = {'count': int(days.nunique()), 'examples': _examples(days.unique())}
+
+    if len(garmin_df):
+        garmin_df = garmin_df.copy()
+        garmin_df['day'] = pd.to_datetime(garmin_df['date'], format='ISO8601').dt.strftime('%Y-%m-%d')
+        for column in ['trimp', 'atl', 'ctl', 'tsb']:
+            garmin_df[column] = pd.to_numeric(garmin_df[column], errors='coerce')
+
+        counts = garmin_df.groupby(['user_id', 'day']).size().reset_index(name='rows')
+        add(counts[counts['rows'] > 1], 'duplicate_days')
+
+        # One row per day for the recurrence check
+        days = garmin_df.sort_values(['user_id', 'date']).drop_duplicates(['user_id', 'day'], keep='last').copy()
+        days['day_number'] = pd.to_datetime(days['day']).values.astype('datetime64[D]').astype(np.int64)
+        previous = days.groupby('user_id')[['day_number', 'atl', 'ctl']].shift(1)
+        consecutive = (days['day_number'] - previous['day_number']) == 1
+
+        expected_atl = previous['atl'] + (days['trimp'] - previous['atl']) / 7
+        expected_ctl = previous['ctl'] + (days['trimp'] - previous['ctl']) / 42
+        expected_tsb = previous['ctl'] - previous['atl']
+        broken = consecutive & (
+            ((days['atl'] - expected_atl).abs() > AUDIT_TOLERANCE) |
+            ((days['ctl'] - expected_ctl).abs() > AUDIT_TOLERANCE) |
+            ((days['tsb'] - expected_tsb).abs() > AUDIT_TOLERANCE)
+        )
+        add(days[broken], 'metric_discontinuities')
+        add(days[days['atl'].isnull() | days['ctl'].isnull()], 'missing_metrics')
+
+    if len(manual_df):
+        manual_df = manual_df.copy()
+        manual_df['day'] = pd.to_datetime(manual_df['date'], format='ISO8601').dt.strftime('%Y-%m-%d')
+        manual_df['trimp'] = pd.to_numeric(manual_df['trimp'], errors='coerce').fillna(0)
+        manual_totals = manual_df.groupby(['user_id', 'day'])['trimp'].sum().reset_index(name='manual_trimp')
+
+        if len(garmin_df):
+            garmin_totals = garmin_df.groupby(['user_id', 'day'])['trimp'].max().reset_index(name='garmin_trimp')
+            manual_totals = manual_totals.merge(garmin_totals, on=['user_id', 'day'], how='left')
+        else:
+            manual_totals['garmin_trimp'] = np.nan
+
+        # Manual TRIMP is folded into the day's garmin_data row; a missing row or a
+        # smaller stored total means the manual entry was lost
+        orphaned = manual_totals['garmin_trimp'].isnull() | \
+            (manual_totals['garmin_trimp'] < manual_totals['manual_trimp'] - AUDIT_TOLERANCE)
+        add(manual_totals[orphaned], 'orphaned_manual_totals')
+
+    return issues
+
+def audit_users(user_ids):
+    """Audit one chunk of users inside a worker process"""
+    garmin_rows = fetch_garmin_rows_for_users(user_ids, columns='user_id, date, trimp, atl, ctl, tsb')
+    manual_rows = fetch_manual_rows_for_users(user_ids)
+    return {
+        'users': len(user_ids),
+        'rows': len(garmin_rows),
+        'issues': find_data_issues(pd.DataFrame(garmin_rows), pd.DataFrame(manual_rows))
+    }
+
+def audit_garmin_data(user_id=None, processes=None, report_path=None):
+    """
+    Dry-run audit of garmin_data: reports problems, changes nothing.
+
+    Users are split into chunks of AUDIT_CHUNK_SIZE and audited by a process pool.
+
+    Args:
+        user_id (str, optional): Audit a single user
+        processes (int, optional): Worker processes (default: CPU count)
+        report_path (str, optional): Where to write the JSON report
+
+    Returns:
+        dict: The report
+    """
+    print(f"\n{'='*50}")
+    print(f"Starting garmin_data audit at {datetime.now().isoformat()}")
+
+    user_ids = [user_id] if user_id else fetch_all_profile_user_ids()
+    chunks = [user_ids[i:i + AUDIT_CHUNK_SIZE] for i in range(0, len(user_ids), AUDIT_CHUNK_SIZE)]
+    processes = processes or os.cpu_count() or 2
+    print(f"Auditing {len(user_ids)} users in {len(chunks)} chunks with {processes} processes")
+
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'users_scanned': 0,
+        'rows_scanned': 0,
+        'totals': {},
+        'users': {}
+    }
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        for result in executor.map(audit_users, chunks):
+            report['users_scanned'] += result['users']
+            report['rows_scanned'] += result['rows']
+            for audited_user, user_issues in result['issues'].items():
+                report['users'][audited_user] = user_issues
+                for issue, details in user_issues.items():
+                    report['totals'][issue] = report['totals'].get(issue, 0) + details['count']
+
+    report_path = report_path or f"garmin_data_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+
+    print(f"Scanned {report['rows_scanned']} rows of {report['users_scanned']} users; "
+          f"{len(report['users'])} users with issues: {report['totals']}")
+    print(f"Report written to {report_path}")
+    return report
+
 if __name__ == "__main__":
+    if '--audit' in sys.argv:
+        # Dry run: python cleanup_duplicates.py --audit [USER_ID]
+        args = [arg for arg in sys.argv[1:] if arg != '--audit']
+        audit_garmin_data(args[0] if args else None)
     # If user_id is passed as an argument, clean up only that user
-    if len(sys.argv) > 1:
+    elif len(sys.argv) > 1:
         user_id = sys.argv[1]
         merge_duplicate_entries(user_id)
     else:
         merge_duplicate_entries()
-        print("To clean up a specific user, run: python cleanup_duplicates.py USER_ID") 
\ No newline at end of file
+        print("To clean up a specific user, run: python cleanup_duplicates.py USER_ID")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Load metrics for all athletes linked to a coach, fetched in one set-based query.
+"""
+
+import traceback
+from datetime import datetime, timedelta
+import numpy as np
+from supabase_client import supabase
+from garmin_data_store import fetch_garmin_rows_for_users, fetch_latest_rows_before, normalize_date
+from training_metrics import ATL_DAYS, CTL_DAYS, fill_load_gaps
+
+MAX_PAGE_SIZE = 200
+MAX_HISTORY_DAYS = 365
+# Window used to find each athlete's latest stored metrics when no history is requested
+LATEST_LOOKBACK_DAYS = 14
+
+def get_coach_athlete_metrics(coach_id, page=1, page_size=50, history_days=0):
+    """
+    Get latest ATL/CTL/TSB (and optionally recent history) for a page of a coach's athletes.
+
+    Days without a stored row (e.g. not synced yet) are filled with the ATL/CTL
+    recurrence from the previous day, so "latest" is always as of today.
+
+    Args:
+        coach_id (str): The coach's user ID
+        page (int): 1-based page number over the coach's athletes
+        page_size (int): Athletes per page, capped at MAX_PAGE_SIZE
+        history_days (int): Days of history to include per athlete (0 for latest only)
+
+    Returns:
+        dict: Result of the operation
+    """
+    try:
+        page = max(1, int(page))
+        page_size = min(max(1, int(page_size)), MAX_PAGE_SIZE)
+        history_days = min(max(0, int(history_days)), MAX_HISTORY_DAYS)
+        offset = (page - 1) * page_size
+
+        # 1. One page of linked athletes
+        links = supabase.table('coach_athletes') \
+            .select('athlete_id, athlete_email', count='exact') \
+            .eq('coach_id', coach_id) \
+            .not_.is_('athlete_id', 'null') \
+            .order('athlete_id') \
+            .range(offset, offset + page_size - 1) \
+            .execute()
+
+        athletes = links.data or []
+        result = {
+            'success': True,
+            'page': page,
+            'page_size': page_size,
+            'total': links.count if links.count is not None else len(athletes),
+            'athletes': []
+        }
+        if not athletes:
+            return result
+
+        athlete_ids = [athlete['athlete_id'] for athlete in athletes]
+
+        # 2. One query for every athlete's rows in the window
+        today = datetime.now().date()
+        window_days = max(history_days, LATEST_LOOKBACK_DAYS)
+        first_day = today - timedelta(days=window_days - 1)
+        dates = [first_day + timedelta(days=i) for i in range(window_days)]
+        day_index = {day.strftime('%Y-%m-%d'): i for i, day in enumerate(dates)}
+        athlete_index = {athlete_id: i for i, athlete_id in enumerate(athlete_ids)}
+
+        rows = fetch_garmin_rows_for_users(
+            athlete_ids,
+            first_day.strftime('%Y-%m-%d'),
+            today.strftime('%Y-%m-%d'),
+            columns='user_id, date, trimp, atl, ctl, tsb'
+        )
+        print(f"Fetched {len(rows)} rows for {len(athlete_ids)} athletes of coach {coach_id}")
+
+        # 3. Pivot into (athlete, day) matrices
+        shape = (len(athlete_ids), window_days)
+        trimp = np.zeros(shape)
+        stored_atl = np.full(shape, np.nan)
+        stored_ctl = np.full(shape, np.nan)
+        stored_tsb = np.full(shape, np.nan)
+        has_row = np.zeros(shape, dtype=bool)
+
+        for row in rows:
+            a = athlete_index.get(row['user_id'])
+            d = day_index.get(normalize_date(row['date']))
+            if a is None or d is None:
+                continue
+            has_row[a, d] = True
+            trimp[a, d] = float(row['trimp']) if row.get('trimp') is not None else 0.0
+            for matrix, column in ((stored_atl, 'atl'), (stored_ctl, 'ctl'), (stored_tsb, 'tsb')):
+                if row.get(column) is not None:
+                    matrix[a, d] = float(row[column])
+
+        # Athletes with nothing stored in the window: seed the first day from their
+        # last row before it, decayed over the rest days in between (one query for all)
+        last_seen = {}
+        missing = np.flatnonzero(~has_row.any(axis=1))
+        latest_rows = fetch_latest_rows_before(
+            [athlete_ids[a] for a in missing], first_day.strftime('%Y-%m-%d')
+        ) if len(missing) else {}
+        for a in missing:
+            last = latest_rows.get(athlete_ids[a])
+            if not last:
+                continue
+            last_seen[a] = normalize_date(last['date'])
+            gap = (first_day - datetime.strptime(normalize_date(last['date']), '%Y-%m-%d').date()).days
+            prev_atl = float(last['atl']) * (1 - 1 / ATL_DAYS) ** (gap - 1)
+            prev_ctl = float(last['ctl']) * (1 - 1 / CTL_DAYS) ** (gap - 1)
+            stored_atl[a, 0] = prev_atl * (1 - 1 / ATL_DAYS)
+            stored_ctl[a, 0] = prev_ctl * (1 - 1 / CTL_DAYS)
+            stored_tsb[a, 0] = prev_ctl - prev_atl
+
+        # 4. Shared vectorized computation for all athletes
+        atl, ctl, tsb = fill_load_gaps(trimp, stored_atl, stored_ctl, stored_tsb)
+
+        for a, athlete in enumerate(athletes):
+            stored_days = np.flatnonzero(has_row[a])
+            entry = {
+                'athlete_id': athlete['athlete_id'],
+                'email': athlete.get('athlete_email'),
+                'last_data_date': dates[stored_days[-1]].strftime('%Y-%m-%d') if len(stored_days) else last_seen.get(a),
+                'latest': None
+            }
+
+            if not np.isnan(atl[a, -1]):
+                entry['latest'] = {
+                    'date': today.strftime('%Y-%m-%d'),
+                    'atl': round(float(atl[a, -1]), 2),
+                    'ctl': round(float(ctl[a, -1]), 2),
+                    'tsb': round(float(tsb[a, -1]), 2)
+                }
+
+            if history_days:
+                entry['history'] = [
+                    {
+                        'date': dates[d].strftime('%Y-%m-%d'),
+                        'trimp': float(trimp[a, d]),
+                        'atl': round(float(atl[a, d]), 2),
+                        'ctl': round(float(ctl[a, d]), 2),
+                        'tsb': round(float(tsb[a, d]), 2)
+                    }
+                    for d in range(window_days - history_days, window_days)
+                    if not np.isnan(atl[a, d])
+                ]
+
+            result['athletes'].append(entry)
+
+        return result
+
+    except Exception as e:
+        print(f"Error getting coach athlete metrics: {str(e)}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'error': str(e)
+        }
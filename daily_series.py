@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Dense daily training history.
+
+A DailySeries covers consecutive days from a start date. trimp/atl/ctl/tsb are
+float64 arrays indexed by day offset (NaN where a day has no stored metric) and
+present marks the days that have a row. Activity names are interned in one
+table per series; each day keeps a tuple of indices into it, so rest days share
+one empty tuple and repeated names are stored once.
+
+Looking up a day is an ordinal subtraction instead of parsing and hashing a
+date string, and whole ranges go straight to training_metrics.project_load.
+"""
+
+from datetime import date, datetime, timedelta
+import numpy as np
+from garmin_data_store import normalize_date
+from training_metrics import project_load
+
+REST_DAY = 'Rest day'
+
+def to_day(value):
+    """date for a date, datetime, pandas Timestamp or YYYY-MM-DD / ISO timestamp string"""
+    if isinstance(value, str):
+        return date.fromisoformat(normalize_date(value))
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+class DailySeries:
+    """
+    Daily history from start for a fixed number of days (grows with ensure()).
+
+    start may be a datetime; date() then keeps its time of day, as the sync's
+    date ranges do.
+    """
+
+    __slots__ = ('start', 'trimp', 'atl', 'ctl', 'tsb', 'present', 'day_activities', 'names', '_name_ids')
+
+    def __init__(self, start, days):
+        self.start = start
+        self.trimp = np.zeros(days)
+        self.atl = np.full(days, np.nan)
+        self.ctl = np.full(days, np.nan)
+        self.tsb = np.full(days, np.nan)
+        self.present = np.zeros(days, dtype=bool)
+        self.day_activities = [()] * days
+        self.names = []
+        self._name_ids = {}
+
+    @classmethod
+    def from_rows(cls, rows, start=None, end=None):
+        """
+        Build a series from garmin_data rows (date, trimp, activity, atl, ctl, tsb).
+
+        Args:
+            rows (list): Rows in date order; a later row for the same day wins
+            start (date, optional): First day, defaults to the first row's day
+            end (date, optional): Last day, defaults to the last row's day
+
+        Returns:
+            DailySeries: Rows outside start..end are dropped
+        """
+        days = [to_day(row['date']) for row in rows]
+        if start is None:
+            start = min(days) if days else date.today()
+        if end is None:
+            end = max(days) if days else to_day(start)
+        series = cls(start, max((to_day(end) - to_day(start)).days + 1, 0))
+
+        for day, row in zip(days, rows):
+            offset = series.offset(day)
+            if 0 <= offset < len(series):
+                series.set_row(offset, row)
+        return series
+
+    def __len__(self):
+        return len(self.trimp)
+
+    def offset(self, day):
+        """Day offset of a date or datetime (not bounds-checked)"""
+        return day.toordinal() - self.start.toordinal()
+
+    def find(self, day):
+        """Offset of a day that has a row, or None"""
+        offset = self.offset(to_day(day))
+        if 0 <= offset < len(self) and self.present[offset]:
+            return offset
+        return None
+
+    def date(self, offset):
+        return self.start + timedelta(days=int(offset))
+
+    def date_str(self, offset):
+        return self.date(offset).strftime('%Y-%m-%d')
+
+    def ensure(self, day):
+        """Grow the arrays so they cover day; returns its offset"""
+        offset = self.offset(to_day(day))
+        if offset < 0:
+            self._grow(-offset, 0)
+            self.start = self.start - timedelta(days=-offset)
+            return 0
+        if offset >= len(self):
+            self._grow(0, offset - len(self) + 1)
+        return offset
+
+    def _grow(self, before, after):
+        self.trimp = np.pad(self.trimp, (before, after))
+        self.atl = np.pad(self.atl, (before, after), constant_values=np.nan)
+        self.ctl = np.pad(self.ctl, (before, after), constant_values=np.nan)
+        self.tsb = np.pad(self.tsb, (before, after), constant_values=np.nan)
+        self.present = np.pad(self.present, (before, after))
+        self.day_activities = [()] * before + self.day_activities + [()] * after
+
+    def intern(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def add_activity(self, offset, trimp, name):
+        """Add one activity's TRIMP and name to a day"""
+        self.trimp[offset] += trimp
+        self.day_activities[offset] += (self.intern(name),)
+        self.present[offset] = True
+
+    def set_row(self, offset, row):
+        """Replace a day with a garmin_data row; 'Rest day' becomes an empty activity list"""
+        self.trimp[offset] = float(row.get('trimp') or 0)
+        for column in ('atl', 'ctl', 'tsb'):
+            value = row.get(column)
+            getattr(self, column)[offset] = float(value) if value is not None else np.nan
+        activity = row.get('activity')
+        if activity and activity != REST_DAY:
+            self.day_activities[offset] = tuple(self.intern(name) for name in activity.split(', '))
+        else:
+            self.day_activities[offset] = ()
+        self.present[offset] = True
+
+    def set_metrics(self, offset, atl, ctl, tsb):
+        self.atl[offset] = atl
+        self.ctl[offset] = ctl
+        self.tsb[offset] = tsb
+        self.present[offset] = True
+
+    def activities(self, offset):
+        """Activity names of a day, in the order they were added"""
+        return [self.names[name_id] for name_id in self.day_activities[offset]]
+
+    def activity_label(self, offset):
+        """Activity string as stored in garmin_data"""
+        return ', '.join(self.activities(offset)) or REST_DAY
+
+    def project(self, atl0, ctl0, first=0, stop=None):
+        """ATL/CTL/TSB over offsets first..stop-1 from the given seed (see training_metrics.project_load)"""
+        return project_load(self.trimp[first:stop], atl0, ctl0)
@@ -22,7 +22,7 @@ SIGNIN_URL = "https://sso.garmin.com/sso/signin"
 def get_garmin_credentials(user_id):
     print(f"Fetching Garmin credentials for user {user_id}")
     try:
-        response = supabase.table('garmin_credentials').select('*').eq('user_id', user_id).execute()
+        response = supabase.table('garmin_credentials').select('email, password').eq('user_id', user_id).execute()
         print(f"Credential response data length: {len(response.data) if response.data else 0}")
         
         if not response.data or len(response.data) == 0:
@@ -6,14 +6,18 @@ This uses a direct OAuth flow and REST API calls to Garmin Connect.
 
 import os
 import sys
-import requests
 import json
 import re
 import urllib.parse
 import pandas as pd
 import traceback
+import threading
 from datetime import datetime, timedelta
 from supabase_client import supabase
+from chart_cache import invalidate_user
+from garmin_http import create_session, SYNC_DETAIL_WORKERS
+from activity_store import garmin_activity_row, record_activities
+from garmin_data_store import fetch_garmin_series, SERIES_COLUMNS
 
 # Constants for Garmin OAuth flow
 BASE_URL = "https://connect.garmin.com"
@@ -24,7 +28,7 @@ SIGNIN_URL = "https://sso.garmin.com/sso/signin"
 def get_garmin_credentials(supabase_client, user_id):
     print(f"Fetching Garmin credentials for user {user_id}")
     try:
-        response = supabase_client.table('garmin_credentials').select('*').eq('user_id', user_id).execute()
+        response = supabase_client.table('garmin_credentials').select('email, password').eq('user_id', user_id).execute()
         print(f"Credential response data length: {len(response.data) if response.data else 0}")
         
         if not response.data or len(response.data) == 0:
@@ -46,15 +50,18 @@ def get_garmin_credentials(supabase_client, user_id):
         print(f"Full error: {traceback.format_exc()}")
         return None, None
 
-def direct_garmin_login(email, password):
+def direct_garmin_login(email, password, pool_size=SYNC_DETAIL_WORKERS):
     """
     Direct Garmin authentication that doesn't use the garminconnect package.
     Uses custom OAuth flow to get the necessary tokens.
+
+    The returned session keeps its pooled connections for the rest of the sync;
+    pool_size should match the number of threads sharing it.
     """
     print(f"\nInitializing direct Garmin authentication for {email}")
     
     # Create session with standard browser headers
-    session = requests.Session()
+    session = create_session(pool_size=pool_size)
     session.headers.update({
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
         'origin': 'https://sso.garmin.com',
@@ -194,29 +201,56 @@ def direct_garmin_login(email, password):
         print(f"Full error: {traceback.format_exc()}")
         raise Exception(f"Garmin authentication failed: {str(e)}")
 
-def get_activities_by_date(session, start_date_str, end_date_str):
+ACTIVITY_PAGE_SIZE = 100
+
+def get_activities_page(session, start_date_str, end_date_str, start=0, limit=100):
     """
-    Get activities between start_date and end_date using the direct API.
+    Get one page of activities between start_date and end_date.
+
+    Unlike get_activities_by_date this raises on a failed request, so callers
+    that page through long ranges can tell an error apart from an empty page.
     """
-    print(f"Getting activities from {start_date_str} to {end_date_str}")
-    
-    # Format for the API request
     activities_url = f"{MODERN_URL}/activitylist-service/activities/search/between"
     params = {
         'startDate': start_date_str,
         'endDate': end_date_str,
-        'limit': 1000  # Get a lot of activities at once
+        'start': start,
+        'limit': limit
     }
-    
+
+    response = session.get(activities_url, params=params)
+
+    if response.status_code != 200:
+        raise Exception(f"Failed to get activities page {start}-{start + limit}. Status: {response.status_code}")
+
+    return response.json()
+
+def iter_activities_by_date(session, start_date_str, end_date_str, page_size=ACTIVITY_PAGE_SIZE):
+    """
+    Yield activities between start_date and end_date, one page at a time.
+
+    Only one page is held in memory and the next page is requested when the
+    caller has consumed the current one, so processing starts with the first page.
+    """
+    print(f"Getting activities from {start_date_str} to {end_date_str}")
+
+    start = 0
+    while True:
+        page = get_activities_page(session, start_date_str, end_date_str, start, page_size)
+        print(f"Activities {start}-{start + len(page)}: {len(page)} on this page")
+        yield from page
+        if len(page) < page_size:
+            return
+        start += page_size
+
+def get_activities_by_date(session, start_date_str, end_date_str):
+    """
+    Get all activities between start_date and end_date using the direct API.
+    """
+    activities = []
     try:
-        response = session.get(activities_url, params=params)
-        
-        if response.status_code != 200:
-            print(f"Failed to get activities. Status: {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return []
-            
-        activities = response.json()
+        for activity in iter_activities_by_date(session, start_date_str, end_date_str):
+            activities.append(activity)
         print(f"Found {len(activities)} activities")
         return activities
     except Exception as e:
@@ -224,34 +258,77 @@ def get_activities_by_date(session, start_date_str, end_date_str):
         print(f"Full error: {traceback.format_exc()}")
         return []
 
+# Bytes downloaded for activity payloads since the process started
+_transfer_stats = {'activities': 0, 'summary_bytes': 0, 'details_bytes': 0, 'escalations': 0}
+_transfer_lock = threading.Lock()
+
+def record_transfer(summary_bytes=0, details_bytes=0):
+    """Count the payload bytes fetched for one activity"""
+    with _transfer_lock:
+        _transfer_stats['activities'] += 1
+        _transfer_stats['summary_bytes'] += summary_bytes
+        _transfer_stats['details_bytes'] += details_bytes
+        if details_bytes:
+            _transfer_stats['escalations'] += 1
+
+def get_transfer_stats():
+    """Copy of the payload counters with the average bytes per activity"""
+    with _transfer_lock:
+        stats = dict(_transfer_stats)
+    total = stats['summary_bytes'] + stats['details_bytes']
+    stats['bytes_per_activity'] = round(total / stats['activities']) if stats['activities'] else 0
+    return stats
+
+def has_trimp_field(payload):
+    return bool(payload) and 'connectIQMeasurements' in payload
+
 def get_activity_details(session, activity_id):
     """
-    Get detailed information for a specific activity.
+    Get an activity payload that contains the TRIMP developer field.
+
+    The activity summary already carries connectIQMeasurements and is a fraction
+    of the size of /details (which adds the full metric streams), so /details
+    is only requested when the summary lacks the field.
     """
-    print(f"Getting details for activity {activity_id}")
-    
-    details_url = f"{MODERN_URL}/activity-service/activity/{activity_id}/details"
-    
+    summary_url = f"{MODERN_URL}/activity-service/activity/{activity_id}"
+    details_url = f"{summary_url}/details"
+    summary = None
+    summary_bytes = 0
+    details_bytes = 0
+
     try:
+        response = session.get(summary_url)
+        summary_bytes = len(response.content)
+        if response.status_code == 200:
+            summary = response.json()
+            if has_trimp_field(summary):
+                return summary
+        else:
+            print(f"Failed to get activity summary. Status: {response.status_code}")
+
+        print(f"Summary of activity {activity_id} has no Connect IQ fields, getting full details")
         response = session.get(details_url)
+        details_bytes = len(response.content)
         
         if response.status_code != 200:
             print(f"Failed to get activity details. Status: {response.status_code}")
-            return None
+            return summary
             
-        details = response.json()
-        return details
+        return response.json()
     except Exception as e:
         print(f"Error getting activity details: {str(e)}")
         print(f"Full error: {traceback.format_exc()}")
-        return None
+        return summary
+    finally:
+        record_transfer(summary_bytes, details_bytes)
+        print(f"Activity {activity_id}: {summary_bytes + details_bytes} bytes")
 
 def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
     try:
         # Check for existing sync
         lock_key = f"sync_lock_{user_id}"
         lock_data = supabase.table('sync_locks')\
-            .select('*')\
+            .select('user_id')\
             .eq('user_id', user_id)\
             .execute()
 
@@ -297,15 +374,13 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                 # Default to 30 days ago if no start date specified
                 start_date = datetime.now() - timedelta(days=30)
 
-            # Get activities from Garmin
-            activities = get_activities_by_date(
+            # Activities are processed page by page as the list downloads
+            activities = iter_activities_by_date(
                 session,
                 start_date.strftime("%Y-%m-%d"),
                 datetime.now().strftime("%Y-%m-%d")
             )
 
-            print(f"Found {len(activities)} activities")
-
             # Create a complete date range
             end_date = datetime.now()
             date_range = pd.date_range(start=start_date, end=end_date, freq='D')
@@ -316,7 +391,11 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
             } for date in date_range}
 
             # Process activities
+            transfer_before = get_transfer_stats()
+            activity_rows = []
+            failed_days = set()
             for activity in activities:
+                activity_day = (activity.get('startTimeLocal') or activity.get('startTimeGMT') or '').split(' ')[0]
                 try:
                     activity_id = activity.get('activityId')
                     if not activity_id:
@@ -328,6 +407,7 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                     activity_details = get_activity_details(session, activity_id)
                     if not activity_details:
                         print(f"Could not get details for activity {activity_id}, skipping")
+                        failed_days.add(activity_day)
                         continue
                         
                     trimp = 0
@@ -365,27 +445,34 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                     daily_data[date_str]['trimp'] += trimp
                     # Add each activity individually, without deduplication
                     daily_data[date_str]['activities'].append(activity_name)
+                    activity_rows.append(garmin_activity_row(activity, trimp))
                     print(f"Saved activity data for {date_str}")
 
                 except Exception as e:
                     print(f"Error processing activity: {e}")
                     print(f"Full error: {traceback.format_exc()}")
+                    failed_days.add(activity_day)
                     continue
 
+            # Keep the per-activity table in step with garmin_data; every activity of the
+            # range was listed, so its days no longer need legacy rows. A day with a failed
+            # activity keeps its legacy row instead of part of its activities
+            record_activities(
+                user_id,
+                [row for row in activity_rows if row['activity_date'] not in failed_days],
+                [day for day in daily_data if day not in failed_days]
+            )
+
             # Save activity data with metrics in a single operation
             print("\nSaving data for all days:")
             processed_dates = []
             
             # Get all previous data to initialize metrics calculation
-            all_data = supabase.table('garmin_data')\
-                .select('*')\
-                .eq('user_id', user_id)\
-                .order('date')\
-                .execute()
+            history_rows = fetch_garmin_series(user_id, None, None, 'user_id, ' + SERIES_COLUMNS)
                 
             # Convert to DataFrame for metrics calculation
-            if all_data.data:
-                df = pd.DataFrame(all_data.data)
+            if history_rows:
+                df = pd.DataFrame(history_rows)
                 df['date'] = pd.to_datetime(df['date'], format='ISO8601').dt.tz_localize(None)
                 # Sort by date
                 df = df.sort_values('date')
@@ -456,7 +543,7 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                 
                 # Get existing data for this date if any
                 existing = supabase.table('garmin_data')\
-                    .select('*')\
+                    .select('trimp, activity')\
                     .eq('user_id', user_id)\
                     .eq('date', data['date'].isoformat())\
                     .execute()
@@ -554,6 +641,15 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                 df = df.drop_duplicates(subset=['date', 'user_id'], keep='last')
                 df = df.sort_values('date')
 
+            transfer_after = get_transfer_stats()
+            fetched = transfer_after['activities'] - transfer_before['activities']
+            if fetched:
+                fetched_bytes = (transfer_after['summary_bytes'] + transfer_after['details_bytes']
+                                 - transfer_before['summary_bytes'] - transfer_before['details_bytes'])
+                print(f"Activity payloads: {fetched_bytes} bytes for {fetched} activities "
+                      f"({round(fetched_bytes / fetched)} per activity, "
+                      f"{transfer_after['escalations'] - transfer_before['escalations']} needed full details)")
+
             # Return the processed dates
             return {
                 'success': True,
@@ -563,6 +659,9 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
             }
 
         finally:
+            # Rows may have been written even if the sync failed part way
+            invalidate_user(user_id)
+
             # Always remove lock at the end
             try:
                 supabase.table('sync_locks')\
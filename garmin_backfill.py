@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Historical backfill of Garmin data in chunked, resumable windows.
+
+The range is split into windows of BACKFILL_WINDOW_DAYS. Windows are fetched in
+parallel (activity list page by page, then details) behind one shared rate
+limiter, written in date order, and the per-user cursor in sync_backfill_cursors
+is advanced after each batch so a failed or timed-out import resumes where it
+stopped. ATL/CTL/TSB are recomputed once at the end over the whole range.
+"""
+
+import os
+import sys
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+from supabase_client import supabase
+from chart_cache import invalidate_user
+from direct_garmin_sync import get_garmin_credentials, direct_garmin_login, get_activities_page, get_activity_details
+from garmin_data_store import fetch_garmin_series, fetch_latest_row, normalize_date
+from metrics_checkpoints import save_month_end_checkpoints
+from history_store import read_history, slice_history, history_rows
+from daily_series import DailySeries
+from activity_store import garmin_activity_row, record_activities, get_daily_totals
+from training_metrics import DEFAULT_SEED, ATL_DAYS, CTL_DAYS
+from sync_watermark import get_watermark, advance_watermark
+
+BACKFILL_WINDOW_DAYS = int(os.getenv('BACKFILL_WINDOW_DAYS', '60'))
+BACKFILL_MAX_WORKERS = int(os.getenv('BACKFILL_MAX_WORKERS', '3'))
+# Shared by all windows of one backfill
+BACKFILL_REQUESTS_PER_SECOND = float(os.getenv('BACKFILL_REQUESTS_PER_SECOND', '2'))
+ACTIVITY_PAGE_SIZE = 100
+WRITE_CHUNK_SIZE = 500
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart across threads"""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def split_windows(start_date, end_date, window_days=BACKFILL_WINDOW_DAYS):
+    """Split [start_date, end_date] into consecutive (window_start, window_end) date pairs"""
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+def get_cursor(user_id):
+    """Get the user's backfill cursor row, or None"""
+    response = supabase.table('sync_backfill_cursors') \
+        .select('*') \
+        .eq('user_id', user_id) \
+        .execute()
+    return response.data[0] if response.data else None
+
+def save_cursor(user_id, **fields):
+    """Create or replace the user's cursor; fields must include every NOT NULL column"""
+    fields['user_id'] = user_id
+    fields['updated_at'] = datetime.now().isoformat()
+    supabase.table('sync_backfill_cursors') \
+        .upsert(fields, on_conflict='user_id') \
+        .execute()
+
+def update_cursor(user_id, **fields):
+    fields['updated_at'] = datetime.now().isoformat()
+    supabase.table('sync_backfill_cursors') \
+        .update(fields) \
+        .eq('user_id', user_id) \
+        .execute()
+
+def extract_trimp(activity, details):
+    """TRIMP from the Connect IQ developer field 4, doubled for strength training"""
+    trimp = 0
+    for item in details.get('connectIQMeasurements') or []:
+        if item.get('developerFieldNumber') == 4:
+            trimp = round(float(item.get('value', 0)), 1)
+
+    if activity.get('activityName', 'Unknown') in ['Strength Training', 'Siła']:
+        trimp = trimp * 2
+    return trimp
+
+def fetch_window(session, limiter, window_start, window_end):
+    """
+    Fetch all activities of one window page by page with their TRIMP.
+
+    Returns:
+        tuple: (activities rows (activity_store.garmin_activity_row), list of imported
+               activity list entries, set of days with an activity whose details failed);
+               the rows and entries leave out those days
+    """
+    start_str = window_start.strftime('%Y-%m-%d')
+    end_str = window_end.strftime('%Y-%m-%d')
+    rows = []
+    imported = []
+    skipped_days = set()
+    page_start = 0
+
+    while True:
+        limiter.wait()
+        page = get_activities_page(session, start_str, end_str, page_start, ACTIVITY_PAGE_SIZE)
+        print(f"Window {start_str}..{end_str}: page at {page_start} has {len(page)} activities")
+
+        for activity in page:
+            activity_id = activity.get('activityId')
+            start_time = activity.get('startTimeLocal') or activity.get('startTimeGMT')
+            if not activity_id or not start_time:
+                continue
+
+            details = None
+            for attempt in range(2):
+                limiter.wait()
+                details = get_activity_details(session, activity_id)
+                if details:
+                    break
+                time.sleep(2 ** (attempt + 1))
+            if not details:
+                print(f"Could not get details for activity {activity_id}, skipping")
+                skipped_days.add(start_time.split(' ')[0])
+                continue
+
+            rows.append(garmin_activity_row(activity, extract_trimp(activity, details)))
+            imported.append(activity)
+
+        if len(page) < ACTIVITY_PAGE_SIZE:
+            # A day with a skipped activity keeps its legacy row instead of part of its activities
+            rows = [row for row in rows if row['activity_date'] not in skipped_days]
+            imported = [activity for activity in imported
+                        if (activity.get('startTimeLocal') or activity.get('startTimeGMT')).split(' ')[0] not in skipped_days]
+            return rows, imported, skipped_days
+        page_start += ACTIVITY_PAGE_SIZE
+
+def write_window(user_id, window_start, window_end, activities, skipped_days):
+    """
+    Record a window's activities and upsert the daily totals (Garmin plus manual
+    entries) of every day of the window.
+
+    Every activity of the window was listed, so days without skipped activities
+    replace their legacy rows.
+    """
+    start_str = window_start.strftime('%Y-%m-%d')
+    end_str = window_end.strftime('%Y-%m-%d')
+    days = [(window_start + timedelta(days=offset)).strftime('%Y-%m-%d')
+            for offset in range((window_end - window_start).days + 1)]
+
+    record_activities(user_id, activities, [day for day in days if day not in skipped_days])
+    totals = get_daily_totals(user_id, start_str, end_str)
+
+    rows = []
+    for date_str in days:
+        total = totals.get(date_str, {'trimp': 0.0, 'activity': 'Rest day'})
+        rows.append({
+            'user_id': user_id,
+            'date': date_str,
+            'trimp': total['trimp'],
+            'activity': total['activity']
+        })
+
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        supabase.table('garmin_data') \
+            .upsert(rows[i:i + WRITE_CHUNK_SIZE], on_conflict='user_id,date') \
+            .execute()
+
+def recompute_metrics(user_id, start_date_str):
+    """
+    Recompute ATL/CTL/TSB for every stored day from start_date_str onwards in one vectorized pass.
+
+    Seeds from the latest row before start_date_str (decayed over any gap) or the
+    50/50 defaults used by the sync, and treats days without a row as rest days.
+
+    Returns:
+        int: Number of rows updated
+    """
+    # The backfill windows just wrote every row from start_date_str on
+    invalidate_user(user_id, start_date_str)
+    first_day = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    history = read_history(user_id)
+    if history is not None:
+        rows = history_rows(slice_history(history, start_date_str))
+        earlier = slice_history(history, None, (first_day - timedelta(days=1)).isoformat())
+        seed_row = history_rows(earlier.slice(earlier.num_rows - 1))[0] if earlier.num_rows else None
+    else:
+        rows = fetch_garmin_series(user_id, start_date_str, None, 'date, trimp, activity')
+        seed_row = fetch_latest_row(user_id, 'date, atl, ctl', start_date_str) if rows else None
+    if not rows:
+        return 0
+
+    seed_atl, seed_ctl = DEFAULT_SEED['atl'], DEFAULT_SEED['ctl']
+    if seed_row and seed_row.get('atl') is not None and seed_row.get('ctl') is not None:
+        gap = (first_day - datetime.strptime(normalize_date(seed_row['date']), '%Y-%m-%d').date()).days - 1
+        seed_atl = float(seed_row['atl']) * (1 - 1 / ATL_DAYS) ** gap
+        seed_ctl = float(seed_row['ctl']) * (1 - 1 / CTL_DAYS) ** gap
+
+    # One slot per day; a later duplicate for the same date wins
+    series = DailySeries.from_rows(rows, start=first_day)
+    atl, ctl, tsb = series.project(seed_atl, seed_ctl)
+
+    updates = [{
+        'user_id': user_id,
+        'date': series.date_str(offset),
+        'trimp': float(series.trimp[offset]),
+        'activity': series.activity_label(offset),
+        'atl': round(float(atl[offset]), 2),
+        'ctl': round(float(ctl[offset]), 2),
+        'tsb': round(float(tsb[offset]), 2)
+    } for offset in np.flatnonzero(series.present)]
+
+    for i in range(0, len(updates), WRITE_CHUNK_SIZE):
+        supabase.table('garmin_data') \
+            .upsert(updates[i:i + WRITE_CHUNK_SIZE], on_conflict='user_id,date') \
+            .execute()
+    save_month_end_checkpoints(user_id, updates)
+
+    return len(updates)
+
+def backfill_garmin_history(user_id, start_date, end_date=None, window_days=BACKFILL_WINDOW_DAYS,
+                            max_workers=BACKFILL_MAX_WORKERS, resume=True):
+    """
+    Import a user's Garmin history over a long range in resumable windows.
+
+    Args:
+        user_id (str): The user's ID
+        start_date (date or str): First day to import (YYYY-MM-DD if str)
+        end_date (date or str, optional): Last day to import, defaults to today
+        window_days (int): Days per window
+        max_workers (int): Windows fetched in parallel
+        resume (bool): Continue from the stored cursor if it covers the same range
+
+    Returns:
+        dict: Result of the operation
+    """
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date[:10], '%Y-%m-%d').date()
+    if isinstance(end_date, str):
+        end_date = datetime.strptime(end_date[:10], '%Y-%m-%d').date()
+    end_date = end_date or datetime.now().date()
+
+    # Share the sync lock so a backfill never runs alongside a regular sync
+    lock_data = supabase.table('sync_locks')\
+        .select('user_id')\
+        .eq('user_id', user_id)\
+        .execute()
+
+    if lock_data.data:
+        print(f"Sync already in progress for user {user_id}")
+        return {
+            'success': True,
+            'message': 'Sync already in progress'
+        }
+
+    try:
+        supabase.table('sync_locks')\
+            .insert({'user_id': user_id, 'timestamp': datetime.now().isoformat()})\
+            .execute()
+    except Exception as e:
+        print(f"Error setting lock: {e}")
+
+    try:
+        windows = split_windows(start_date, end_date, window_days)
+
+        cursor = get_cursor(user_id) if resume else None
+        completed_through = None
+        if cursor and cursor['status'] != 'completed' \
+                and cursor['range_start'] == start_date.isoformat() \
+                and cursor['range_end'] == end_date.isoformat() \
+                and cursor['window_days'] == window_days \
+                and cursor.get('completed_through'):
+            completed_through = datetime.strptime(cursor['completed_through'], '%Y-%m-%d').date()
+            print(f"Resuming backfill for user {user_id} after {completed_through}")
+
+        pending = [window for window in windows if not completed_through or window[1] > completed_through]
+        windows_done = len(windows) - len(pending)
+        save_cursor(
+            user_id,
+            range_start=start_date.isoformat(),
+            range_end=end_date.isoformat(),
+            window_days=window_days,
+            completed_through=completed_through.isoformat() if completed_through else None,
+            windows_total=len(windows),
+            windows_done=windows_done,
+            status='running',
+            error=None
+        )
+
+        print(f"\nBackfilling {start_date} to {end_date} for user {user_id}: {len(pending)} of {len(windows)} windows to fetch")
+
+        if pending:
+            email, password = get_garmin_credentials(supabase, user_id)
+            if not email or not password:
+                raise Exception("Missing or invalid Garmin credentials")
+
+            session = direct_garmin_login(email, password, pool_size=max_workers)
+            limiter = RateLimiter(BACKFILL_REQUESTS_PER_SECOND)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for i in range(0, len(pending), max_workers):
+                    batch = pending[i:i + max_workers]
+                    results = list(executor.map(lambda window: fetch_window(session, limiter, *window), batch))
+
+                    for (window_start, window_end), (activities, imported, skipped_days) in zip(batch, results):
+                        write_window(user_id, window_start, window_end, activities, skipped_days)
+                        # Later routine syncs must not import these activities again. Only an
+                        # existing watermark is advanced: without one the next sync still lists
+                        # its default range and sets the first watermark itself
+                        watermark = get_watermark(user_id)
+                        if watermark:
+                            advance_watermark(user_id, watermark, imported)
+
+                    windows_done += len(batch)
+                    update_cursor(user_id, completed_through=batch[-1][1].isoformat(), windows_done=windows_done)
+                    print(f"Backfill progress: {windows_done}/{len(windows)} windows")
+
+        updated = recompute_metrics(user_id, start_date.isoformat())
+        update_cursor(user_id, status='completed')
+        print(f"Backfill complete, recomputed metrics for {updated} days")
+
+        return {
+            'success': True,
+            'windows': len(windows),
+            'updated': updated,
+            'message': f'Backfilled {start_date} to {end_date}'
+        }
+
+    except Exception as e:
+        print(f"Error during backfill: {e}")
+        print(f"Full error: {traceback.format_exc()}")
+        try:
+            update_cursor(user_id, status='failed', error=str(e))
+        except Exception as cursor_err:
+            print(f"Error saving backfill cursor: {cursor_err}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+    finally:
+        invalidate_user(user_id, start_date.isoformat())
+
+        try:
+            supabase.table('sync_locks')\
+                .delete()\
+                .eq('user_id', user_id)\
+                .execute()
+        except Exception as e:
+            print(f"Error removing lock: {e}")
+
+# For running a backfill directly
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        user_id = sys.argv[1]
+        years_back = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+        start_date = datetime.now().date() - timedelta(days=int(years_back * 365))
+
+        print(f"Backfilling user {user_id} from {start_date}")
+        result = backfill_garmin_history(user_id, start_date)
+        print(f"Backfill result: {result}")
+    else:
+        print("Usage: python garmin_backfill.py <user_id> [years_back]")
+        print("Example: python garmin_backfill.py 123e4567-e89b-12d3-a456-426614174000 5")
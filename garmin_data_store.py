@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Read helpers for the garmin_data table.
+
+PostgREST caps every response at its max-rows setting (1000 by default) and
+silently drops the rest, so reads that can span more than a few years of days
+go through the paged helpers here. Pages are keyset-paginated on date: each
+page starts after the last row of the previous one, so deep pages are index
+range scans instead of ever larger OFFSETs.
+
+History pages are requested as CSV: the column names are sent once per page
+instead of once per row, and parsing is a C loop instead of JSON decoding.
+"""
+
+import os
+import csv
+import io
+from supabase_client import supabase
+
+# PostgREST default max-rows; pages smaller than this mean we reached the end
+PAGE_SIZE = 1000
+
+SERIES_COLUMNS = 'date, trimp, activity, atl, ctl, tsb'
+# Set to 0 to fetch history pages as JSON
+HISTORY_CSV = os.getenv('HISTORY_CSV', '1') != '0'
+NUMERIC_COLUMNS = {'trimp', 'atl', 'ctl', 'tsb'}
+
+def parse_csv_rows(text):
+    """
+    Row dicts from a PostgREST CSV response, shaped like its JSON rows.
+
+    Empty fields are NULL, metric columns become floats and timestamps keep the
+    ISO 'T' separator of the JSON output.
+    """
+    if not text or not isinstance(text, str):
+        return text or []
+
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        row = {}
+        for column, value in record.items():
+            if value == '':
+                row[column] = None
+            elif column in NUMERIC_COLUMNS:
+                row[column] = float(value)
+            elif column == 'date':
+                row[column] = value.replace(' ', 'T')
+            else:
+                row[column] = value
+        rows.append(row)
+    return rows
+
+def _fetch_page(query):
+    """Rows of one page, as CSV unless HISTORY_CSV is off"""
+    if HISTORY_CSV:
+        return parse_csv_rows(query.csv().execute().data)
+    return query.execute().data or []
+
+def fetch_garmin_series(user_id, start_date_str=None, end_date_str=None, columns=SERIES_COLUMNS):
+    """
+    Fetch a user's garmin_data rows ordered by date, following pages past the row cap.
+
+    Args:
+        user_id (str): The user's ID
+        start_date_str (str, optional): Start date in YYYY-MM-DD format (inclusive)
+        end_date_str (str, optional): End date in YYYY-MM-DD format (inclusive)
+        columns (str): Columns to select; must include date
+
+    Returns:
+        list: garmin_data rows ordered by date
+    """
+    rows = []
+    last_date = None
+
+    while True:
+        query = supabase.table('garmin_data').select(columns).eq('user_id', user_id)
+
+        if start_date_str:
+            query = query.gte('date', start_date_str)
+        if end_date_str:
+            query = query.lte('date', end_date_str)
+        if last_date:
+            query = query.gt('date', last_date)
+
+        page = _fetch_page(query.order('date').limit(PAGE_SIZE))
+        rows.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            return rows
+        last_date = page[-1]['date']
+
+def fetch_garmin_rows_for_users(user_ids, start_date_str=None, end_date_str=None, columns='user_id, ' + SERIES_COLUMNS):
+    """
+    Fetch garmin_data rows for many users with one set-based query, following pages.
+
+    Args:
+        user_ids (list): User IDs to include
+        start_date_str (str, optional): Start date in YYYY-MM-DD format (inclusive)
+        end_date_str (str, optional): End date in YYYY-MM-DD format (inclusive)
+        columns (str): Columns to select; must include user_id and date
+
+    Returns:
+        list: garmin_data rows ordered by user_id, then date
+    """
+    if not user_ids:
+        return []
+
+    rows = []
+    last_row = None
+
+    while True:
+        query = supabase.table('garmin_data').select(columns).in_('user_id', list(user_ids))
+
+        if start_date_str:
+            query = query.gte('date', start_date_str)
+        if end_date_str:
+            query = query.lte('date', end_date_str)
+        if last_row:
+            # (user_id, date) > last key; the timestamp is quoted for its ':' and '.'
+            query = query.or_(
+                f"user_id.gt.{last_row['user_id']},"
+                f"and(user_id.eq.{last_row['user_id']},date.gt.\"{last_row['date']}\")"
+            )
+
+        page = _fetch_page(query.order('user_id').order('date').limit(PAGE_SIZE))
+        rows.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            return rows
+        last_row = page[-1]
+
+def fetch_latest_row(user_id, columns=SERIES_COLUMNS, before_date_str=None):
+    """Get a user's most recent garmin_data row (optionally strictly before a date), or None"""
+    query = supabase.table('garmin_data').select(columns).eq('user_id', user_id)
+    if before_date_str:
+        query = query.lt('date', before_date_str)
+
+    response = query.order('date', desc=True).limit(1).execute()
+    return response.data[0] if response.data else None
+
+def fetch_latest_rows_before(user_ids, before_date_str):
+    """Each user's latest garmin_data row with ATL/CTL strictly before a date, keyed by user ID"""
+    response = supabase.rpc('garmin_data_latest_rows_before', {
+        'user_ids': user_ids,
+        'before_day': before_date_str
+    }).execute()
+    return {row['user_id']: row for row in response.data or []}
+
+def fetch_first_row(user_id, columns=SERIES_COLUMNS):
+    """Get a user's oldest garmin_data row, or None"""
+    response = supabase.table('garmin_data') \
+        .select(columns) \
+        .eq('user_id', user_id) \
+        .order('date') \
+        .limit(1) \
+        .execute()
+    return response.data[0] if response.data else None
+
+def normalize_date(value):
+    """Return the YYYY-MM-DD part of a garmin_data date (stored both as dates and ISO timestamps)"""
+    return value.split('T')[0] if 'T' in value else value
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+HTTP sessions for talking to Garmin Connect.
+
+Every sync creates one session with create_session() and uses it until the
+sync ends, so connections are kept alive between the activity list and detail
+requests. The connection pool is sized to the number of concurrent detail
+fetches, requests without an explicit timeout get GARMIN_CONNECT_TIMEOUT /
+GARMIN_READ_TIMEOUT, and idempotent requests are retried on 429 and 5xx with
+jittered exponential backoff (honouring Retry-After).
+"""
+
+import os
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Activity details fetched concurrently during one sync; also the pool size
+SYNC_DETAIL_WORKERS = int(os.getenv('SYNC_DETAIL_WORKERS', '4'))
+GARMIN_HTTP_RETRIES = int(os.getenv('GARMIN_HTTP_RETRIES', '3'))
+GARMIN_HTTP_BACKOFF_SECONDS = float(os.getenv('GARMIN_HTTP_BACKOFF_SECONDS', '1'))
+GARMIN_CONNECT_TIMEOUT = float(os.getenv('GARMIN_CONNECT_TIMEOUT', '10'))
+GARMIN_READ_TIMEOUT = float(os.getenv('GARMIN_READ_TIMEOUT', '30'))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class JitterRetry(Retry):
+    """Retry whose backoff is drawn uniformly between 0 and the exponential delay"""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+def create_adapter(pool_size=SYNC_DETAIL_WORKERS):
+    retry = JitterRetry(
+        total=GARMIN_HTTP_RETRIES,
+        backoff_factor=GARMIN_HTTP_BACKOFF_SECONDS,
+        status_forcelist=RETRY_STATUSES,
+        # POSTs (SSO login) are never retried automatically
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    return TimeoutHTTPAdapter(
+        max_retries=retry,
+        pool_connections=2,
+        pool_maxsize=pool_size,
+        timeout=(GARMIN_CONNECT_TIMEOUT, GARMIN_READ_TIMEOUT)
+    )
+
+def configure_session(session, pool_size=SYNC_DETAIL_WORKERS):
+    """Mount the pooled, retrying adapter on an existing session (e.g. garth's)"""
+    adapter = create_adapter(pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+def create_session(headers=None, pool_size=SYNC_DETAIL_WORKERS):
+    """
+    Create a session for one user's sync.
+
+    Args:
+        headers (dict, optional): Headers added to the defaults
+        pool_size (int): Connections kept per host, normally the detail concurrency
+
+    Returns:
+        requests.Session: Configured session
+    """
+    session = configure_session(requests.Session(), pool_size)
+    if headers:
+        session.headers.update(headers)
+    return session
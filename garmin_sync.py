@@ -1,14 +1,25 @@
 from garminconnect import Garmin, GarminConnectAuthenticationError, GarminConnectConnectionError, GarminConnectTooManyRequestsError
-import pandas as pd
 from datetime import datetime, timedelta
 import time
 from requests.exceptions import HTTPError
 import garth
 from garth.exc import GarthHTTPError
 from supabase_client import supabase, get_garmin_credentials
+from chart_cache import invalidate_user
+from garmin_http import configure_session, SYNC_DETAIL_WORKERS
+from garmin_data_store import fetch_first_row, fetch_latest_row
+from daily_series import DailySeries, to_day
+from activity_store import garmin_activity_row, record_activities, get_daily_totals, \
+    recompute_daily_metrics, DB_METRICS_RECOMPUTE
+from metrics_checkpoints import save_month_end_checkpoints
+from sync_watermark import get_watermark, sync_start, filter_new_activities, advance_watermark
 import traceback
 import sys
 import os
+import threading
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Print environment information for debugging
 print(f"Python version: {sys.version}")
@@ -28,7 +39,7 @@ except Exception as e:
 def get_garmin_credentials(supabase_client, user_id):
     print(f"Fetching Garmin credentials for user {user_id}")
     try:
-        response = supabase_client.table('garmin_credentials').select('*').eq('user_id', user_id).execute()
+        response = supabase_client.table('garmin_credentials').select('email, password').eq('user_id', user_id).execute()
         print(f"Credential response data length: {len(response.data) if response.data else 0}")
         
         if not response.data or len(response.data) == 0:
@@ -50,200 +61,298 @@ def get_garmin_credentials(supabase_client, user_id):
         print(f"Full error: {traceback.format_exc()}")
         return None, None
 
-def test_raw_garmin_login(email, password):
-    """Test raw Garmin login without any error handling to see raw exceptions"""
-    print(f"\n===== DIAGNOSTIC: Testing raw Garmin login for {email} =====")
+_login_metrics = {}
+_login_metrics_lock = threading.Lock()
+
+def _record_login_attempt(strategy, succeeded, seconds):
+    with _login_metrics_lock:
+        metrics = _login_metrics.setdefault(strategy, {'attempts': 0, 'successes': 0, 'failures': 0, 'total_seconds': 0.0})
+        metrics['attempts'] += 1
+        metrics['successes' if succeeded else 'failures'] += 1
+        metrics['total_seconds'] += seconds
+
+def get_login_metrics():
+    """Login attempts, outcomes and average latency per strategy in this process"""
+    with _login_metrics_lock:
+        return {
+            strategy: dict(
+                metrics,
+                total_seconds=round(metrics['total_seconds'], 3),
+                avg_seconds=round(metrics['total_seconds'] / metrics['attempts'], 3) if metrics['attempts'] else 0.0
+            )
+            for strategy, metrics in _login_metrics.items()
+        }
+
+def _login_garminconnect(email, password):
+    garmin_client = Garmin(email, password)
+    configure_session(garmin_client.garth.sess)
+    garmin_client.login()
+    return garmin_client
+
+def _login_garminconnect_encoded(email, password):
+    # Some accounts only authenticated with a URL-encoded password
+    return _login_garminconnect(email, urllib.parse.quote_plus(password))
+
+SPECIAL_PASSWORD_CHARACTERS = ['@', '!', '#', '$', '%', '^', '&', '*', '(', ')', '+', '=', '{', '}', '[', ']', '|', '\\', ':', ';', '"', "'", '<', '>', ',', '?', '/']
+
+LOGIN_STRATEGIES = {
+    'garminconnect': _login_garminconnect,
+    'garminconnect_encoded_password': _login_garminconnect_encoded
+}
+
+def get_login_strategy(user_id):
+    """Login strategy that last worked for the user, or None"""
     try:
-        # Direct API client creation
-        print("Creating raw Garmin client...")
-        import inspect
-        print(f"Garmin constructor signature: {inspect.signature(Garmin.__init__)}")
-        
-        raw_client = Garmin(email, password)
-        print("Raw client created successfully")
-        
-        # Try login directly
-        print("Attempting raw login...")
-        raw_client.login()
-        print("Raw login successful")
-        
-        return True
+        response = supabase.table('garmin_login_strategies') \
+            .select('strategy') \
+            .eq('user_id', user_id) \
+            .execute()
+        return response.data[0]['strategy'] if response.data else None
     except Exception as e:
-        print(f"Raw login test failed with error: {str(e)}")
-        print(f"Raw error type: {type(e)}")
-        print(f"Raw error traceback: {traceback.format_exc()}")
-        return False
+        print(f"Error getting Garmin login strategy for {user_id}: {e}")
+        return None
 
-def initialize_garmin_client(email, password):
-    print(f"\nInitializing Garmin client for {email}")
+def save_login_strategy(user_id, strategy):
     try:
-        # Create API client with basic initialization
-        print("Initializing GarminConnect client...")
-        print("Debugging Garmin constructor...")
-        
-        # Add URL encoding for special characters in password
-        import urllib.parse
-        safe_password = password
-        if any(c in password for c in ['@', '!', '#', '$', '%', '^', '&', '*', '(', ')', '+', '=', '{', '}', '[', ']', '|', '\\', ':', ';', '"', "'", '<', '>', ',', '?', '/']):
-            print("Password contains special characters - applying URL encoding")
-            safe_password = urllib.parse.quote_plus(password)
-        
-        try:
-            # Test raw login first for diagnostic purposes
-            test_raw_garmin_login(email, safe_password)
-        except Exception as test_err:
-            print(f"Raw login test generated exception: {str(test_err)}")
-            # Continue with regular flow
-        
-        # Try direct authentication through cookies approach
-        print("\nTrying manual cookie-based authentication...")
+        supabase.table('garmin_login_strategies') \
+            .upsert({'user_id': user_id, 'strategy': strategy, 'updated_at': datetime.now().isoformat()}, on_conflict='user_id') \
+            .execute()
+    except Exception as e:
+        print(f"Error saving Garmin login strategy for {user_id}: {e}")
+
+def clear_login_strategy(user_id):
+    try:
+        supabase.table('garmin_login_strategies') \
+            .delete() \
+            .eq('user_id', user_id) \
+            .execute()
+    except Exception as e:
+        print(f"Error clearing Garmin login strategy for {user_id}: {e}")
+
+def _login_strategy_order(password, preferred=None):
+    order = ['garminconnect']
+    if any(c in password for c in SPECIAL_PASSWORD_CHARACTERS):
+        order.append('garminconnect_encoded_password')
+    if preferred in order:
+        order.remove(preferred)
+        order.insert(0, preferred)
+    return order
+
+def initialize_garmin_client(email, password, user_id=None):
+    """
+    Log into Garmin Connect with the first strategy that works.
+
+    Strategies are tried in order, starting with the one that last worked for
+    the user (stored in garmin_login_strategies when user_id is given), and the
+    chain stops at the first success. A rate-limit error stops the chain
+    immediately, since further logins only raise the lockout risk. Attempts and
+    latency are counted per strategy (see get_login_metrics).
+    """
+    print(f"\nInitializing Garmin client for {email}")
+    last_error = None
+    preferred = get_login_strategy(user_id) if user_id else None
+
+    for strategy in _login_strategy_order(password, preferred):
+        print(f"Trying Garmin login strategy '{strategy}'...")
+        started = time.monotonic()
         try:
-            import requests
-            import json
-            from http.cookiejar import LWPCookieJar
-            
-            session = requests.Session()
-            
-            # Setup session with proper headers
-            session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
-                'origin': 'https://sso.garmin.com',
-                'nk': 'NT'
-            })
-            
-            # First get the SSO page to collect initial cookies
-            sso_url = "https://sso.garmin.com/sso/signin"
-            print(f"Fetching initial SSO page: {sso_url}")
-            
-            params = {
-                'service': 'https://connect.garmin.com/modern',
-                'webhost': 'https://connect.garmin.com/modern',
-                'source': 'https://connect.garmin.com/signin',
-                'redirectAfterAccountLoginUrl': 'https://connect.garmin.com/modern',
-                'redirectAfterAccountCreationUrl': 'https://connect.garmin.com/modern',
-                'gauthHost': 'https://sso.garmin.com/sso',
-                'locale': 'en_US',
-                'id': 'gauth-widget',
-                'cssUrl': 'https://connect.garmin.com/gauth-custom-v1.2-min.css',
-                'clientId': 'GarminConnect',
-                'rememberMeShown': 'true',
-                'rememberMeChecked': 'false',
-                'createAccountShown': 'true',
-                'openCreateAccount': 'false',
-                'displayNameShown': 'false',
-                'consumeServiceTicket': 'false',
-                'initialFocus': 'true',
-                'embedWidget': 'false',
-                'generateExtraServiceTicket': 'true',
-                'generateTwoExtraServiceTickets': 'false',
-                'generateNoServiceTicket': 'false',
-                'globalOptInShown': 'true',
-                'globalOptInChecked': 'false',
-                'mobile': 'false',
-                'connectLegalTerms': 'true',
-                'locationPromptShown': 'true',
-                'showPassword': 'true'
-            }
-            
-            print("Sending initial request...")
-            response = session.get(sso_url, params=params)
-            print(f"Initial response status: {response.status_code}")
-            
-            if response.status_code != 200:
-                print("Initial SSO page request failed")
-                print(f"Error body: {response.text[:200]}...")
-                raise Exception("Failed to load Garmin login page")
-            
-            # Now attempt the actual login
-            print("Preparing login request...")
-            payload = {
-                'username': email,
-                'password': safe_password,
-                'embed': 'false',
-                'rememberme': 'on'  # Keep the session alive longer
-            }
-            
-            login_url = "https://sso.garmin.com/sso/signin"
-            print(f"Sending login request to: {login_url}")
-            
-            login_response = session.post(login_url, params=params, data=payload)
-            print(f"Login response status: {login_response.status_code}")
-            
-            if login_response.status_code != 200:
-                print("Login request failed")
-                print(f"Error body: {login_response.text[:200]}...")
-                raise Exception("Failed to login to Garmin Connect")
-            
-            # Check if login was successful by looking for ticket in response
-            if "ticket" not in login_response.text:
-                print("No ticket found in response, login likely failed")
-                print(f"Response excerpt: {login_response.text[:200]}...")
-                raise Exception("Login authentication failed - no ticket found")
-            
-            print("Login appears successful, found ticket in response")
-            
-            # Use the existing client but with our authenticated session
-            garmin_client = Garmin(email, password, session=session)
-            print("Created Garmin client with authenticated session")
-            
+            garmin_client = LOGIN_STRATEGIES[strategy](email, password)
+            _record_login_attempt(strategy, True, time.monotonic() - started)
+            if user_id and strategy != preferred:
+                save_login_strategy(user_id, strategy)
+            print(f"Logged into Garmin with '{strategy}' in {time.monotonic() - started:.1f}s")
             return garmin_client
-            
-        except Exception as cookie_err:
-            print(f"Cookie-based authentication failed: {str(cookie_err)}")
-            print(f"Full error: {traceback.format_exc()}")
-            print("Falling back to regular client initialization...")
-        
-        # Fall back to regular client creation
-        garmin_client = Garmin(email, password)
-        
-        print("Attempting Garmin login...")
-        try:
-            # Try to get user info first to verify credentials
-            print(f"Calling get_user_summary with date: {datetime.now().strftime('%Y-%m-%d')}")
-            garmin_client.get_user_summary(datetime.now().strftime("%Y-%m-%d"))
-            print("Successfully logged into Garmin using get_user_summary")
-        except Exception as e:
-            print(f"Failed to get user info: {str(e)}")
-            print(f"Full error from get_user_summary: {traceback.format_exc()}")
-            print("Falling back to regular login method...")
-            try:
-                # If that fails, try the regular login
-                garmin_client.login()
-                print("Successfully logged into Garmin with regular login")
-            except Exception as login_err:
-                print(f"Regular login also failed: {str(login_err)}")
-                print(f"Full error from regular login: {traceback.format_exc()}")
-                raise login_err
-        
-        return garmin_client
-        
-    except GarminConnectAuthenticationError as err:
+        except GarminConnectTooManyRequestsError as err:
+            _record_login_attempt(strategy, False, time.monotonic() - started)
+            print(f"Too many requests error for {email}")
+            print(f"Error details: {str(err)}")
+            raise Exception(f"Too many requests to Garmin API: {str(err)}")
+        except Exception as err:
+            _record_login_attempt(strategy, False, time.monotonic() - started)
+            print(f"Login strategy '{strategy}' failed: {str(err)}")
+            last_error = err
+
+    if user_id and preferred:
+        clear_login_strategy(user_id)
+
+    if isinstance(last_error, GarminConnectAuthenticationError):
         print(f"Authentication failed for {email}")
-        print(f"Error details: {str(err)}")
-        print(f"Error type: {type(err)}")
-        print(f"Full authentication error traceback: {traceback.format_exc()}")
         print(f"Please verify your Garmin credentials at https://connect.garmin.com")
         print(f"Check if your account has 2FA enabled or if you need to sign in to Garmin Connect first manually")
-        raise Exception(f"Garmin authentication failed: {str(err)}")
-    except GarminConnectTooManyRequestsError as err:
-        print(f"Too many requests error for {email}")
-        print(f"Error details: {str(err)}")
-        raise Exception(f"Too many requests to Garmin API: {str(err)}")
-    except GarminConnectConnectionError as err:
+        raise Exception(f"Garmin authentication failed: {str(last_error)}")
+    if isinstance(last_error, GarminConnectConnectionError):
         print(f"Connection error for {email}")
-        print(f"Error details: {str(err)}")
-        raise Exception(f"Garmin connection error: {str(err)}")
-    except Exception as err:
-        print(f"Unknown error during Garmin login: {str(err)}")
-        print(f"Full error: {traceback.format_exc()}")
-        raise Exception(f"Error logging into Garmin: {str(err)}")
+        raise Exception(f"Garmin connection error: {str(last_error)}")
+    raise Exception(f"Error logging into Garmin: {str(last_error)}")
+
+# Days synced when no start date is given and the user has no watermark yet
+DEFAULT_SYNC_DAYS = 15
+# Completed days are written in batches of this many
+SYNC_FLUSH_DAYS = int(os.getenv('SYNC_FLUSH_DAYS', '7'))
+# Garmin sorts the list by GMT start but days are local, so an activity recorded
+# across time zones can be listed after a later local day; days this close to the
+# newest listed activity are not flushed yet
+SYNC_FLUSH_MARGIN_DAYS = 1
+ACTIVITY_PAGE_SIZE = 20
+
+def iter_activity_pages(client, start_date_str, end_date_str, page_size=ACTIVITY_PAGE_SIZE):
+    """
+    Yield pages of the activity list oldest first.
+
+    The next page is only requested once the previous one has been consumed, so
+    detail fetches for a page start while the rest of the list is still unknown.
+    """
+    start = 0
+    while True:
+        page = client.connectapi(client.garmin_connect_activities, params={
+            'startDate': start_date_str,
+            'endDate': end_date_str,
+            'start': str(start),
+            'limit': str(page_size),
+            'sortOrder': 'asc'
+        })
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        start += page_size
+
+def fetch_activity_trimp(client, activity):
+    """TRIMP of one activity from the Connect IQ developer field 4"""
+    activity_name = activity.get('activityName', 'Unknown')
+    activity_details = client.get_activity(activity['activityId'])
+    trimp = 0
+    if 'connectIQMeasurements' in activity_details:
+        for item in activity_details['connectIQMeasurements']:
+            if item['developerFieldNumber'] == 4:
+                trimp = round(float(item['value']), 1)
+
+    # Apply multiplier for Strength Training (both English and Polish names)
+    if activity_name in ['Strength Training', 'Siła']:
+        print(f"Applying 2x multiplier for strength training: {trimp} -> {trimp * 2}")
+        trimp = trimp * 2
+    return trimp
+
+def iter_activity_trimps(client, pages, watermark, seen_days=None):
+    """
+    Yield (activity, trimp) in list order for activities not yet imported.
+
+    Details are fetched by SYNC_DETAIL_WORKERS threads as soon as their list page
+    arrives; at most twice that many activities are in flight at once. trimp is
+    None when the details could not be fetched. Days of listed activities the
+    watermark skips are added to seen_days.
+    """
+    with ThreadPoolExecutor(max_workers=SYNC_DETAIL_WORKERS) as executor:
+        pending = deque()
+
+        def next_result():
+            activity, future = pending.popleft()
+            try:
+                return activity, future.result()
+            except Exception as e:
+                print(f"Error processing activity: {e}")
+                return activity, None
+
+        for page in pages:
+            new_activities = filter_new_activities(page, watermark)
+            if seen_days is not None:
+                new_ids = {id(activity) for activity in new_activities}
+                seen_days.update(
+                    (activity.get('startTimeLocal') or activity.get('startTimeGMT') or '').split(' ')[0]
+                    for activity in page if id(activity) not in new_ids
+                )
+            for activity in new_activities:
+                pending.append((activity, executor.submit(fetch_activity_trimp, client, activity)))
+                while len(pending) >= SYNC_DETAIL_WORKERS * 2:
+                    yield next_result()
+        while pending:
+            yield next_result()
+
+def previous_day_metrics(seed_row, date):
+    """ATL/CTL of the day before date from the latest row before it, 50/50 when that is not the day before"""
+    if seed_row and to_day(seed_row['date']) == to_day(date) - timedelta(days=1):
+        prev_atl = float(seed_row['atl']) if seed_row.get('atl') is not None else 50.0
+        prev_ctl = float(seed_row['ctl']) if seed_row.get('ctl') is not None else 50.0
+        return prev_atl, prev_ctl
+    return 50.0, 50.0
+
+def flush_days(user_id, window, first, stop, prev_metrics, activities=(), complete_days=()):
+    """
+    Record synced activities, then compute metrics for and write a batch of
+    consecutive completed days from their daily activity totals.
+
+    The recompute_training_metrics database function writes the batch in one
+    call; without it the totals (Garmin and manual activities) of the whole
+    batch are read with one query and written with one upsert.
+
+    Args:
+        user_id (str): The user's ID
+        window (DailySeries): Synced activities of the whole sync range
+        first (int): Offset of the first day of the batch
+        stop (int): Offset after the last day of the batch
+        prev_metrics (tuple): (ATL, CTL) of the day before the batch
+        activities (list): activities rows not recorded yet (activity_store.garmin_activity_row)
+        complete_days (list): Days whose Garmin activities were all fetched
+
+    Returns:
+        tuple: ((ATL, CTL) of the last day, list of processed ISO dates)
+    """
+    record_activities(user_id, activities, complete_days)
+    dates = [window.date(offset).isoformat() for offset in range(first, stop)]
+
+    if DB_METRICS_RECOMPUTE:
+        try:
+            result = recompute_daily_metrics(user_id, window.date_str(first), window.date_str(stop - 1),
+                                             seed=prev_metrics, decimals=1)
+            print(f"Saved {result['days_written']} days {window.date_str(first)}..{window.date_str(stop - 1)} in the database")
+            return (result['atl'], result['ctl']), dates
+        except Exception as e:
+            print(f"Database recompute failed, computing metrics in Python: {e}")
+
+    totals = get_daily_totals(user_id, window.date_str(first), window.date_str(stop - 1))
+
+    prev_atl, prev_ctl = prev_metrics
+    entries = []
+    for offset in range(first, stop):
+        date_str = window.date_str(offset)
+        total = totals.get(date_str, {'trimp': 0.0, 'activity': 'Rest day'})
+        trimp, activity = total['trimp'], total['activity']
+
+        # Calculate new metrics
+        atl = prev_atl + (trimp - prev_atl) / 7
+        ctl = prev_ctl + (trimp - prev_ctl) / 42
+        tsb = prev_ctl - prev_atl
+
+        # Create complete entry with both activity and metrics
+        entries.append({
+            'user_id': user_id,
+            'date': window.date(offset).isoformat(),
+            'trimp': trimp,
+            'activity': activity,
+            'atl': round(atl, 1),
+            'ctl': round(ctl, 1),
+            'tsb': round(tsb, 1)
+        })
+        print(f"{date_str}: TRIMP {trimp} ({activity}), ATL={round(atl, 1)}, CTL={round(ctl, 1)}, TSB={round(tsb, 1)}")
+
+        # The next day continues from the stored (rounded) values
+        prev_atl, prev_ctl = round(atl, 1), round(ctl, 1)
+
+    supabase.table('garmin_data')\
+        .upsert(entries, on_conflict='user_id,date')\
+        .execute()
+    save_month_end_checkpoints(user_id, entries)
+    print(f"Saved {len(entries)} days {window.date_str(first)}..{window.date_str(stop - 1)}")
+
+    return (prev_atl, prev_ctl), dates
 
 def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
     try:
         # Check for existing sync
         lock_key = f"sync_lock_{user_id}"
         lock_data = supabase.table('sync_locks')\
-            .select('*')\
+            .select('user_id')\
             .eq('user_id', user_id)\
             .execute()
 
@@ -251,6 +360,7 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
             print(f"Sync already in progress for user {user_id}")
             return {
                 'success': True,
+                'skipped': True,
                 'message': 'Sync already in progress'
             }
 
@@ -276,7 +386,7 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                 
             # Initialize client with new method
             try:
-                client = initialize_garmin_client(email, password)
+                client = initialize_garmin_client(email, password, user_id)
                 print("Successfully initialized Garmin client")
             except Exception as auth_err:
                 print(f"Failed to initialize Garmin client: {str(auth_err)}")
@@ -284,81 +394,32 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                 raise auth_err
             
             # Get activities and save them
+            watermark = get_watermark(user_id)
             if isinstance(start_date, str):
                 start_date = datetime.fromisoformat(start_date.replace('Z', ''))
+            elif start_date is None:
+                if watermark and not is_first_sync:
+                    # Routine sync: only ask for activities newer than the last one seen
+                    start_date = sync_start(watermark).replace(hour=0, minute=0, second=0, microsecond=0)
+                    print(f"Syncing from watermark {watermark['last_activity_start']}, starting {start_date.date()}")
+                else:
+                    start_date = datetime.now() - timedelta(days=DEFAULT_SYNC_DAYS)
 
-            # Get activities from Garmin
-            activities = client.get_activities_by_date(
-                start_date.strftime("%Y-%m-%d"),
-                datetime.now().strftime("%Y-%m-%d")
-            )
-
-            print(f"Found {len(activities)} activities")
-
-            # Create a complete date range
+            # One slot per day from start_date up to now
             end_date = datetime.now()
-            date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-            daily_data = {date.strftime("%Y-%m-%d"): {
-                'date': date,
-                'trimp': 0,
-                'activities': ['Rest day']
-            } for date in date_range}
-
-            # Process activities
-            for activity in activities:
-                try:
-                    activity_id = activity['activityId']
-                    activity_name = activity.get('activityName', 'Unknown')
-
-                    activity_details = client.get_activity(activity_id)
-                    trimp = 0
-                    if 'connectIQMeasurements' in activity_details:
-                        for item in activity_details['connectIQMeasurements']:
-                            if item['developerFieldNumber'] == 4:
-                                trimp = round(float(item['value']), 1)
-
-                    # Apply multiplier for Strength Training (both English and Polish names)
-                    if activity_name in ['Strength Training', 'Siła']:
-                        print(f"Applying 2x multiplier for strength training: {trimp} -> {trimp * 2}")
-                        trimp = trimp * 2
-                    
-                    date = datetime.strptime(activity['startTimeLocal'], "%Y-%m-%d %H:%M:%S")
-                    date_str = date.strftime("%Y-%m-%d")
+            window = DailySeries(start_date, (end_date - start_date) // timedelta(days=1) + 1)
 
-                    if daily_data[date_str]['activities'] == ['Rest day']:
-                        daily_data[date_str]['activities'] = []
-                    
-                    daily_data[date_str]['trimp'] += trimp
-                    # Add each activity individually, without deduplication
-                    daily_data[date_str]['activities'].append(activity_name)
-                    print(f"Saved activity data for {date_str}")
-
-                except Exception as e:
-                    print(f"Error processing activity: {e}")
-                    continue
-
-            # Save activity data with metrics in a single operation
             print("\nSaving data for all days:")
             processed_dates = []
             
-            # Get all previous data to initialize metrics calculation
-            all_data = supabase.table('garmin_data')\
-                .select('*')\
-                .eq('user_id', user_id)\
-                .order('date')\
-                .execute()
-                
-            # Convert to DataFrame for metrics calculation
-            if all_data.data:
-                df = pd.DataFrame(all_data.data)
-                df['date'] = pd.to_datetime(df['date'], format='ISO8601').dt.tz_localize(None)
-                # Sort by date
-                df = df.sort_values('date')
-            else:
-                df = pd.DataFrame(columns=['date', 'user_id', 'trimp', 'activity', 'atl', 'ctl', 'tsb'])
+            # Metrics continue from the last stored row before the window, and
+            # the window's days come from the daily totals, so no other history
+            # is read; the oldest row only tells whether metrics were ever set
+            first_row = fetch_first_row(user_id, 'date, atl')
+            seed_row = fetch_latest_row(user_id, 'date, atl, ctl', window.date_str(0))
             
             # Determine if we need to set initial metrics (for first sync or missing metrics)
-            need_initial_metrics = is_first_sync or len(df) == 0 or df.iloc[0]['atl'] is None
+            need_initial_metrics = is_first_sync or first_row is None or first_row.get('atl') is None
             
             # Add day before start date if needed for metrics calculation
             day_before_start = start_date - timedelta(days=1)
@@ -368,9 +429,7 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
             if need_initial_metrics:
                 print(f"Setting initial metrics for day before start: {day_before_str}")
                 # Check if we already have this day
-                day_before_entry = df[df['date'] == pd.Timestamp(day_before_start)]
-                
-                if len(day_before_entry) == 0:
+                if not (seed_row and to_day(seed_row['date']) == day_before_start.date()):
                     # Create entry for day before
                     initial_entry = {
                         'user_id': user_id,
@@ -387,177 +446,106 @@ def sync_garmin_data(user_id, start_date=None, is_first_sync=False):
                         .upsert(initial_entry, on_conflict='user_id,date')\
                         .execute()
                         
-                    # Add to DataFrame for metrics calculation
-                    day_before_row = pd.DataFrame([{
-                        'date': pd.Timestamp(day_before_start),
-                        'user_id': user_id,
-                        'trimp': 0,
-                        'activity': 'Rest day',
-                        'atl': 50.0,
-                        'ctl': 50.0,
-                        'tsb': 0.0
-                    }])
-                    df = pd.concat([day_before_row, df], ignore_index=True)
-                    df = df.sort_values('date')
                 else:
                     # Update existing day before
-                    idx = df[df['date'] == pd.Timestamp(day_before_start)].index[0]
-                    df.at[idx, 'atl'] = 50.0
-                    df.at[idx, 'ctl'] = 50.0
-                    df.at[idx, 'tsb'] = 0.0
-                    
-                    # Update in database
                     supabase.table('garmin_data')\
                         .update({'atl': 50.0, 'ctl': 50.0, 'tsb': 0.0})\
                         .eq('user_id', user_id)\
                         .eq('date', day_before_str)\
                         .execute()
+
+                # The window starts from the initial metrics
+                seed_row = {'date': day_before_str, 'atl': 50.0, 'ctl': 50.0}
             
-            # Now process each day, calculate and save both activity and metrics in one go
-            for date_str, data in daily_data.items():
-                print(f"\nProcessing date {date_str}:")
-                print(f"- TRIMP: {data['trimp']}")
-                print(f"- Activities: {data['activities']}")
-                
-                # Get existing data for this date if any
-                existing = supabase.table('garmin_data')\
-                    .select('*')\
-                    .eq('user_id', user_id)\
-                    .eq('date', data['date'].isoformat())\
-                    .execute()
-                
-                # Get manual data for this date
-                manual_data = supabase.table('manual_data')\
-                    .select('trimp, activity_name')\
-                    .eq('user_id', user_id)\
-                    .eq('date', date_str)\
-                    .execute()
-                
-                manual_trimp = 0
-                manual_activities = []
-                
-                if manual_data.data:
-                    for entry in manual_data.data:
-                        if entry.get('trimp'):
-                            manual_trimp += float(entry['trimp'])
-                        if entry.get('activity_name'):
-                            manual_activities.append(entry['activity_name'])
-                
-                # Track this date as processed
-                processed_dates.append(data['date'].isoformat())
-                
-                # Determine activity data
-                if existing.data and len(existing.data) > 0:
-                    existing_data = existing.data[0]
-                    existing_activities = existing_data.get('activity', '')
-                    
-                    # If there's activity data to update
-                    if data['activities'] != ['Rest day'] or existing_activities == 'Rest day':
-                        if existing_activities and existing_activities != 'Rest day' and data['activities'] != ['Rest day']:
-                            # Combine activities from both entries (avoiding duplicates)
-                            existing_list = existing_activities.split(', ')
-                            existing_activity_set = set(existing_list)
-                            new_activity_set = set(data['activities'])
-                            combined_activities = list(existing_activity_set.union(new_activity_set))
-                            
-                            # Don't include 'Rest day' in the combined list
-                            if 'Rest day' in combined_activities:
-                                combined_activities.remove('Rest day')
-                            
-                            # Add manual activities
-                            combined_activities.extend(manual_activities)
-                            combined_activities = list(set(combined_activities))  # Remove duplicates
-                            
-                            activity = ', '.join(combined_activities) if combined_activities else 'Rest day'
-                            trimp = float(existing_data.get('trimp', 0)) + float(data['trimp']) + manual_trimp
-                        elif existing_activities == 'Rest day' and data['activities'] != ['Rest day']:
-                            # Replace 'Rest day' with actual activities
-                            all_activities = data['activities'] + manual_activities
-                            activity = ', '.join(all_activities) if all_activities else 'Rest day'
-                            trimp = float(data['trimp']) + manual_trimp
-                        elif data['activities'] == ['Rest day'] and existing_activities != 'Rest day':
-                            # Keep existing activities (don't replace with Rest day)
-                            all_activities = existing_activities.split(', ') + manual_activities
-                            activity = ', '.join(all_activities) if all_activities else 'Rest day'
-                            trimp = float(existing_data.get('trimp', 0)) + manual_trimp
-                        else:
-                            activity = ', '.join(manual_activities) if manual_activities else 'Rest day'
-                            trimp = float(existing_data.get('trimp', 0)) + manual_trimp
-                    else:
-                        activity = ', '.join(manual_activities) if manual_activities else 'Rest day'
-                        trimp = float(existing_data.get('trimp', 0)) + manual_trimp
-                else:
-                    # No existing data, use new activity data
-                    all_activities = data['activities'] + manual_activities
-                    activity = ', '.join(all_activities) if all_activities else 'Rest day'
-                    trimp = float(data['trimp']) + manual_trimp
-                
-                print(f"Combined data for {date_str}:")
-                print(f"- Garmin TRIMP: {data['trimp']}")
-                print(f"- Manual TRIMP: {manual_trimp}")
-                print(f"- Total TRIMP: {trimp}")
-                print(f"- Activities: {activity}")
-                
-                # Calculate metrics for this date
-                # Look for previous day's metrics in our DataFrame
-                prev_date = data['date'] - timedelta(days=1)
-                prev_date_entry = df[df['date'] == prev_date]
-                
-                if len(prev_date_entry) > 0:
-                    prev_atl = float(prev_date_entry.iloc[0]['atl']) if prev_date_entry.iloc[0]['atl'] is not None else 50.0
-                    prev_ctl = float(prev_date_entry.iloc[0]['ctl']) if prev_date_entry.iloc[0]['ctl'] is not None else 50.0
-                else:
-                    # If no previous day, use default values
-                    prev_atl = 50.0
-                    prev_ctl = 50.0
-                
-                # Calculate new metrics
-                atl = prev_atl + (trimp - prev_atl) / 7
-                ctl = prev_ctl + (trimp - prev_ctl) / 42
-                tsb = prev_ctl - prev_atl
-                
-                # Create complete entry with both activity and metrics
-                complete_entry = {
-                    'user_id': user_id,
-                    'date': data['date'].isoformat(),
-                    'trimp': trimp,
-                    'activity': activity,
-                    'atl': round(atl, 1),
-                    'ctl': round(ctl, 1),
-                    'tsb': round(tsb, 1)
-                }
-                
-                # Upsert the complete entry
-                supabase.table('garmin_data')\
-                    .upsert(complete_entry, on_conflict='user_id,date')\
-                    .execute()
-                
-                print(f"Saved data for {date_str}:")
-                print(f"- TRIMP: {trimp}, Activity: {activity}")
-                print(f"- Metrics: ATL={round(atl, 1)}, CTL={round(ctl, 1)}, TSB={round(tsb, 1)}")
-                
-                # Add this entry to our DataFrame for next day's calculations
-                df = pd.concat([df, pd.DataFrame([{
-                    'date': data['date'],
-                    'user_id': user_id,
-                    'trimp': trimp,
-                    'activity': activity,
-                    'atl': round(atl, 1),
-                    'ctl': round(ctl, 1),
-                    'tsb': round(tsb, 1)
-                }])], ignore_index=True)
-                df = df.drop_duplicates(subset=['date', 'user_id'], keep='last')
-                df = df.sort_values('date')
+            # Stream activities oldest first: details are fetched while further list
+            # pages download, and days are written as soon as a later activity shows
+            # they are complete
+            imported_activities = []
+            # activities rows waiting for the next flush, days with an activity whose details
+            # failed, and days with an activity the watermark shows was imported before
+            pending_activities = []
+            failed_days = set()
+            seen_days = set()
+            prev_metrics = previous_day_metrics(seed_row, window.start)
+            flushed = 0
+
+            pages = iter_activity_pages(
+                client,
+                start_date.strftime("%Y-%m-%d"),
+                datetime.now().strftime("%Y-%m-%d")
+            )
+            def complete_days(first, stop):
+                # Every activity of these days was listed and is in this sync's rows
+                return [window.date_str(i) for i in range(first, stop)
+                        if window.date_str(i) not in failed_days and window.date_str(i) not in seen_days]
+
+            for activity, trimp in iter_activity_trimps(client, pages, watermark, seen_days):
+                date_str = activity['startTimeLocal'].split(' ')[0]
+                if trimp is None or date_str in failed_days:
+                    # A day counts either its legacy row or all of its activities, never
+                    # part of them; it is listed again on the next sync
+                    failed_days.add(date_str)
+                    pending_activities = [row for row in pending_activities if row['activity_date'] != date_str]
+                    continue
+                try:
+                    complete = window.offset(to_day(date_str))
+                    if not 0 <= complete < len(window):
+                        print(f"Activity date {date_str} not in our date range, skipping")
+                        continue
+                    if complete < flushed:
+                        # Hold the watermark before the day so the next sync imports it again
+                        print(f"Activity {activity['activityId']} listed after {date_str} was saved, "
+                              f"leaving the day for the next sync")
+                        failed_days.add(date_str)
+                        continue
+
+                    # Add each activity individually, without deduplication
+                    window.add_activity(complete, trimp, activity.get('activityName', 'Unknown'))
+                    pending_activities.append(garmin_activity_row(activity, trimp))
+                    imported_activities.append(activity)
+                except Exception as e:
+                    print(f"Error processing activity: {e}")
+                    continue
+
+                stop = complete - SYNC_FLUSH_MARGIN_DAYS
+                if stop - flushed >= SYNC_FLUSH_DAYS:
+                    stop_str = window.date_str(stop)
+                    flush_rows = [row for row in pending_activities if row['activity_date'] < stop_str]
+                    pending_activities = [row for row in pending_activities if row['activity_date'] >= stop_str]
+                    prev_metrics, dates = flush_days(user_id, window, flushed, stop, prev_metrics,
+                                                     flush_rows, complete_days(flushed, stop))
+                    processed_dates.extend(dates)
+                    flushed = stop
+
+            # Remaining days, including every day after the last activity
+            for batch_start in range(flushed, len(window), SYNC_FLUSH_DAYS):
+                batch_stop = min(batch_start + SYNC_FLUSH_DAYS, len(window))
+                prev_metrics, dates = flush_days(user_id, window, batch_start, batch_stop, prev_metrics,
+                                                 pending_activities, complete_days(batch_start, batch_stop))
+                pending_activities = []
+                processed_dates.extend(dates)
+
+            imported_activities = [
+                activity for activity in imported_activities
+                if activity['startTimeLocal'].split(' ')[0] not in failed_days
+            ]
+            hold_before = datetime.strptime(min(failed_days), '%Y-%m-%d') if failed_days else None
+            advance_watermark(user_id, watermark, imported_activities, hold_before=hold_before)
 
             # Return the processed dates
             return {
                 'success': True,
-                'newActivities': len(daily_data),
+                'newActivities': len(imported_activities),
                 'processed_dates': processed_dates,
                 'message': 'Activities and metrics saved in a single row per date'
             }
 
         finally:
+            # Rows may have been written even if the sync failed part way;
+            # nothing before the seed row of the day before start_date changes
+            since_date = (start_date - timedelta(days=1)).strftime('%Y-%m-%d') if isinstance(start_date, datetime) else None
+            invalidate_user(user_id, since_date)
+
             # Always remove lock at the end
             try:
                 supabase.table('sync_locks')\
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Local columnar cache of each user's garmin_data history.
+
+A user's rows (date, trimp, activity, atl, ctl, tsb) are kept as an Arrow IPC
+file under HISTORY_CACHE_DIR and read back memory-mapped, so chart reads and
+recomputes skip PostgREST JSON and ISO date parsing. Writes reach the cache
+through chart_cache.invalidate_user(user_id, since_date): the next read keeps
+the cached rows before since_date and fetches only the rows from there on.
+
+With a shared chart cache tier the files are shared by every worker on the
+host. Without one, generations are per process, so each process keeps its own
+files. Files older than HISTORY_CACHE_MAX_AGE_SECONDS are reloaded in full to
+pick up writers that do not share the tier. pyarrow is optional; without it
+every read goes to garmin_data.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+from chart_cache import changes_since, shared_tier_enabled
+from garmin_data_store import fetch_garmin_series, normalize_date
+
+HISTORY_CACHE_DIR = os.getenv('HISTORY_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'dashgatherer-history')
+HISTORY_CACHE_MAX_AGE_SECONDS = int(os.getenv('HISTORY_CACHE_MAX_AGE_SECONDS', '3600'))
+# Set to 0 to always read garmin_data directly
+HISTORY_CACHE_ENABLED = os.getenv('HISTORY_CACHE_ENABLED', '1') != '0'
+
+HISTORY_COLUMNS = 'date, trimp, activity, atl, ctl, tsb'
+
+if pa is not None:
+    HISTORY_SCHEMA = pa.schema([
+        ('date', pa.date32()),
+        ('trimp', pa.float64()),
+        ('activity', pa.string()),
+        ('atl', pa.float64()),
+        ('ctl', pa.float64()),
+        ('tsb', pa.float64())
+    ])
+
+_user_locks = {}
+_user_locks_lock = threading.Lock()
+_stats = {'hits': 0, 'refreshes': 0, 'loads': 0, 'refreshed_rows': 0, 'loaded_rows': 0}
+
+def history_cache_available(user_id):
+    if pa is None or not HISTORY_CACHE_ENABLED:
+        return False
+    try:
+        # The user ID becomes a file name
+        uuid.UUID(str(user_id))
+        return True
+    except ValueError:
+        return False
+
+def _cache_path(user_id):
+    directory = HISTORY_CACHE_DIR
+    if not shared_tier_enabled():
+        directory = os.path.join(directory, f"pid-{os.getpid()}")
+    return os.path.join(directory, f"{user_id}.arrow")
+
+def _lock_for(user_id):
+    with _user_locks_lock:
+        return _user_locks.setdefault(user_id, threading.Lock())
+
+def _to_float(value):
+    return float(value) if value is not None else None
+
+def _rows_to_table(rows):
+    """Build a history table from garmin_data rows"""
+    return pa.table({
+        'date': pa.array([date.fromisoformat(normalize_date(row['date'])) for row in rows], pa.date32()),
+        'trimp': pa.array([_to_float(row.get('trimp')) for row in rows], pa.float64()),
+        'activity': pa.array([row.get('activity') for row in rows], pa.string()),
+        'atl': pa.array([_to_float(row.get('atl')) for row in rows], pa.float64()),
+        'ctl': pa.array([_to_float(row.get('ctl')) for row in rows], pa.float64()),
+        'tsb': pa.array([_to_float(row.get('tsb')) for row in rows], pa.float64())
+    }, schema=HISTORY_SCHEMA)
+
+def _read_cached(path):
+    """Memory-map a cached history file; returns (table, generation) or (None, None)"""
+    try:
+        if time.time() - os.path.getmtime(path) > HISTORY_CACHE_MAX_AGE_SECONDS:
+            return None, None
+        with pa.memory_map(path) as source:
+            table = ipc.open_file(source).read_all()
+        return table, int(table.schema.metadata[b'generation'])
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        print(f"History cache: error reading {path}: {e}")
+        return None, None
+
+def _write_cached(path, table, generation):
+    """Write a history file next to its final path and move it into place"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = table.replace_schema_metadata({'generation': str(generation)})
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"History cache: error writing {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_history(user_id):
+    """
+    Get a user's whole garmin_data history, refreshing the cached copy first.
+
+    Args:
+        user_id (str): The user's ID
+
+    Returns:
+        pyarrow.Table: Columns date, trimp, activity, atl, ctl, tsb ordered by date,
+            or None when the cache is not available (pyarrow missing or disabled)
+    """
+    if not history_cache_available(user_id):
+        return None
+
+    path = _cache_path(user_id)
+    with _lock_for(user_id):
+        table, generation = _read_cached(path)
+        # Read the generation before fetching, so writes during the fetch trigger another refresh
+        current, since = changes_since(user_id, generation)
+        if table is not None and since is None:
+            _stats['hits'] += 1
+            return table
+
+        if table is not None and since:
+            fresh = _rows_to_table(fetch_garmin_series(user_id, since, None, HISTORY_COLUMNS))
+            kept = table.filter(pc.less(table['date'], pa.scalar(date.fromisoformat(since), pa.date32())))
+            table = pa.concat_tables([kept, fresh])
+            _stats['refreshes'] += 1
+            _stats['refreshed_rows'] += fresh.num_rows
+        else:
+            table = _rows_to_table(fetch_garmin_series(user_id, None, None, HISTORY_COLUMNS))
+            _stats['loads'] += 1
+            _stats['loaded_rows'] += table.num_rows
+
+        _write_cached(path, table, current)
+        return table
+
+def slice_history(table, start_date_str=None, end_date_str=None):
+    """Rows of a history table between two dates (inclusive)"""
+    if start_date_str:
+        start = pa.scalar(date.fromisoformat(start_date_str), pa.date32())
+        table = table.filter(pc.greater_equal(table['date'], start))
+    if end_date_str:
+        end = pa.scalar(date.fromisoformat(end_date_str), pa.date32())
+        table = table.filter(pc.less_equal(table['date'], end))
+    return table
+
+def read_history_range(user_id, start_date_str=None, end_date_str=None):
+    """
+    Get a user's history between two dates (inclusive) from the cache.
+
+    Returns:
+        pyarrow.Table: Filtered history, or None when the cache is not available
+    """
+    table = read_history(user_id)
+    if table is None:
+        return None
+    return slice_history(table, start_date_str, end_date_str)
+
+def history_rows(table):
+    """garmin_data-shaped row dicts (date as YYYY-MM-DD) from a history table"""
+    return table.set_column(0, 'date', table['date'].cast(pa.string())).to_pylist()
+
+def history_series(table):
+    """Chart series rows (as built by chart_cache.get_chart_series) from a history table"""
+    return [
+        dict(row, trimp=row['trimp'] or 0.0, activity=row['activity'] or 'Rest day')
+        for row in history_rows(table)
+    ]
+
+def get_history_stats():
+    """Counters for the metrics endpoint"""
+    return dict(_stats, available=pa is not None and HISTORY_CACHE_ENABLED, directory=HISTORY_CACHE_DIR)
@@ -5,6 +5,11 @@ import traceback
 from datetime import datetime, timedelta
 import pandas as pd
 from supabase_client import supabase
+from chart_cache import invalidate_user
+from metrics_checkpoints import seed_metrics, save_month_end_checkpoints
+from garmin_data_store import fetch_garmin_series, SERIES_COLUMNS
+from activity_store import record_manual_activity, delete_manual_activity, get_daily_total, \
+    recompute_daily_metrics, DB_METRICS_RECOMPUTE
 
 def add_manual_entry(user_id, date_str, trimp_value, activity_name):
     """
@@ -19,55 +24,24 @@ def add_manual_entry(user_id, date_str, trimp_value, activity_name):
     Returns:
         dict: Result of the operation
     """
+    invalidate_since = None
     try:
         print(f"\n{'='*50}")
         print(f"ADDING MANUAL TRAINING ENTRY")
         print(f"User: {user_id}, Date: {date_str}, TRIMP: {trimp_value}, Activity: {activity_name}")
         
-        # 1. Get existing data for this date
-        existing_data = get_existing_data(user_id, date_str)
-        
-        # 2. Get all manual entries for this date
-        manual_entries = get_manual_entries(user_id, date_str)
-        
-        # 3. Get previous day's metrics for calculation
-        previous_metrics = get_previous_day_metrics(user_id, date_str)
-        print(f"Previous day metrics: {previous_metrics}")
-        
-        # 4. Calculate combined TRIMP and activities
-        existing_trimp = existing_data.get('trimp', 0) if existing_data else 0
-        existing_activity = existing_data.get('activity', 'Rest day') if existing_data else 'Rest day'
-        
-        # Calculate total TRIMP from all manual entries
-        existing_manual_trimp = sum(float(entry.get('trimp', 0)) for entry in manual_entries)
-        existing_manual_activities = [entry.get('activity_name') for entry in manual_entries if entry.get('activity_name')]
-        
-        # Add new entry values
-        combined_trimp = float(existing_trimp) + float(trimp_value)
-        
-        # Combine activities
-        combined_activities = []
-        if existing_activity != 'Rest day':
-            combined_activities.extend(existing_activity.split(', '))
-        combined_activities.append(activity_name)
-        combined_activities.extend(existing_manual_activities)
-        
-        # Remove duplicates and filter out empty strings
-        combined_activities = list(set(filter(None, combined_activities)))
-        activity_str = ', '.join(combined_activities) if combined_activities else 'Rest day'
-        
-        # 5. Calculate new metrics
-        new_metrics = calculate_new_metrics(combined_trimp, previous_metrics)
-        print(f"New metrics: {new_metrics}")
-        
-        # 6. Update the database with new metrics
-        update_garmin_data(user_id, date_str, combined_trimp, activity_str, new_metrics)
-        
-        # 7. Insert the manual entry
-        insert_manual_entry(user_id, date_str, trimp_value, activity_name)
+        # 1. Insert the manual entry and its activity
+        entry = insert_manual_entry(user_id, date_str, trimp_value, activity_name)
+        if not entry:
+            return {
+                'success': False,
+                'error': 'Failed to insert manual entry'
+            }
+        invalidate_since = date_str
+        record_manual_activity(user_id, entry['id'], date_str, activity_name, trimp_value)
         
-        # 8. Recalculate metrics for all subsequent dates
-        recalculate_metrics_from_date_onwards(user_id, date_str, new_metrics)
+        # 2. Rewrite the day from its activity total and recalculate all subsequent dates
+        recalculate_day(user_id, date_str)
         
         print(f"Manual entry added successfully")
         print(f"{'='*50}\n")
@@ -85,6 +59,11 @@ def add_manual_entry(user_id, date_str, trimp_value, activity_name):
             'error': str(e)
         }
 
+    finally:
+        # The entry may have been written even if the recalculation failed part way
+        if invalidate_since:
+            invalidate_user(user_id, invalidate_since)
+
 def update_manual_entry(entry_id, date_str, trimp_value, activity_name):
     """
     Update an existing manual training entry and recalculate metrics.
@@ -98,6 +77,7 @@ def update_manual_entry(entry_id, date_str, trimp_value, activity_name):
     Returns:
         dict: Result of the operation
     """
+    invalidate_since = None
     try:
         print(f"\n{'='*50}")
         print(f"UPDATING MANUAL TRAINING ENTRY")
@@ -113,56 +93,24 @@ def update_manual_entry(entry_id, date_str, trimp_value, activity_name):
         
         user_id = existing_entry.get('user_id')
         old_date = existing_entry.get('date')
-        old_trimp = existing_entry.get('trimp', 0)
         
-        # 2. Update the manual entry
+        # 2. Update the manual entry and its activity
         update_result = update_manual_entry_in_db(entry_id, date_str, trimp_value, activity_name)
         if not update_result:
             return {
                 'success': False,
                 'error': 'Failed to update manual entry'
             }
+        invalidate_since = min(date_str, old_date) if old_date else date_str
+        record_manual_activity(user_id, entry_id, date_str, activity_name, trimp_value)
         
         # 3. Recalculate metrics for both the old date and new date if they're different
-        dates_to_recalculate = [date_str]
-        if old_date and old_date != date_str:
-            dates_to_recalculate.append(old_date)
-        
-        for date in dates_to_recalculate:
-            # Get all data for this date
-            existing_data = get_existing_data(user_id, date)
-            manual_entries = get_manual_entries(user_id, date)
-            previous_metrics = get_previous_day_metrics(user_id, date)
-            
-            # Calculate combined TRIMP and activities
-            garmin_trimp = existing_data.get('trimp', 0) if existing_data else 0
-            garmin_activity = existing_data.get('activity', 'Rest day') if existing_data else 'Rest day'
-            
-            # Calculate total TRIMP from all manual entries
-            manual_trimp = sum(float(entry.get('trimp', 0)) for entry in manual_entries)
-            manual_activities = [entry.get('activity_name') for entry in manual_entries if entry.get('activity_name')]
-            
-            # Combine values
-            combined_trimp = float(garmin_trimp) + float(manual_trimp)
-            
-            # Combine activities
-            combined_activities = []
-            if garmin_activity != 'Rest day':
-                combined_activities.extend(garmin_activity.split(', '))
-            combined_activities.extend(manual_activities)
-            
-            # Remove duplicates and filter out empty strings
-            combined_activities = list(set(filter(None, combined_activities)))
-            activity_str = ', '.join(combined_activities) if combined_activities else 'Rest day'
-            
-            # Calculate new metrics
-            new_metrics = calculate_new_metrics(combined_trimp, previous_metrics)
-            
-            # Update the database
-            update_garmin_data(user_id, date, combined_trimp, activity_str, new_metrics)
-            
-            # Recalculate metrics for all subsequent dates
-            recalculate_metrics_from_date_onwards(user_id, date, new_metrics)
+        dates_to_recalculate = {date_str}
+        if old_date:
+            dates_to_recalculate.add(old_date)
+        
+        for date in sorted(dates_to_recalculate):
+            recalculate_day(user_id, date)
         
         print(f"Manual entry updated successfully")
         print(f"{'='*50}\n")
@@ -180,6 +128,11 @@ def update_manual_entry(entry_id, date_str, trimp_value, activity_name):
             'error': str(e)
         }
 
+    finally:
+        # The entry may have been written even if the recalculation failed part way
+        if invalidate_since:
+            invalidate_user(user_id, invalidate_since)
+
 def delete_manual_entry(entry_id):
     """
     Delete a manual training entry and recalculate metrics.
@@ -190,6 +143,7 @@ def delete_manual_entry(entry_id):
     Returns:
         dict: Result of the operation
     """
+    invalidate_since = None
     try:
         print(f"\n{'='*50}")
         print(f"DELETING MANUAL TRAINING ENTRY")
@@ -205,51 +159,19 @@ def delete_manual_entry(entry_id):
         
         user_id = existing_entry.get('user_id')
         date_str = existing_entry.get('date')
-        trimp_to_remove = existing_entry.get('trimp', 0)
         
-        # 2. Delete the manual entry
+        # 2. Delete the manual entry and its activity
         delete_result = delete_manual_entry_from_db(entry_id)
         if not delete_result:
             return {
                 'success': False,
                 'error': 'Failed to delete manual entry'
             }
+        invalidate_since = date_str
+        delete_manual_activity(user_id, entry_id)
         
-        # 3. Recalculate metrics for the date
-        # Get all data for this date
-        existing_data = get_existing_data(user_id, date_str)
-        manual_entries = get_manual_entries(user_id, date_str)
-        previous_metrics = get_previous_day_metrics(user_id, date_str)
-        
-        # Calculate combined TRIMP and activities
-        garmin_trimp = existing_data.get('trimp', 0) if existing_data else 0
-        garmin_activity = existing_data.get('activity', 'Rest day') if existing_data else 'Rest day'
-        
-        # Calculate total TRIMP from all manual entries
-        manual_trimp = sum(float(entry.get('trimp', 0)) for entry in manual_entries)
-        manual_activities = [entry.get('activity_name') for entry in manual_entries if entry.get('activity_name')]
-        
-        # Combine values
-        combined_trimp = float(garmin_trimp) + float(manual_trimp)
-        
-        # Combine activities
-        combined_activities = []
-        if garmin_activity != 'Rest day':
-            combined_activities.extend(garmin_activity.split(', '))
-        combined_activities.extend(manual_activities)
-        
-        # Remove duplicates and filter out empty strings
-        combined_activities = list(set(filter(None, combined_activities)))
-        activity_str = ', '.join(combined_activities) if combined_activities else 'Rest day'
-        
-        # Calculate new metrics
-        new_metrics = calculate_new_metrics(combined_trimp, previous_metrics)
-        
-        # Update the database
-        update_garmin_data(user_id, date_str, combined_trimp, activity_str, new_metrics)
-        
-        # Recalculate metrics for all subsequent dates
-        recalculate_metrics_from_date_onwards(user_id, date_str, new_metrics)
+        # 3. Rewrite the day from its remaining activities and recalculate all subsequent dates
+        recalculate_day(user_id, date_str)
         
         print(f"Manual entry deleted successfully")
         print(f"{'='*50}\n")
@@ -267,41 +189,16 @@ def delete_manual_entry(entry_id):
             'error': str(e)
         }
 
-def get_existing_data(user_id, date_str):
-    """Get existing garmin_data entry for a specific date"""
-    try:
-        response = supabase.table('garmin_data') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .eq('date', date_str) \
-            .execute()
-        
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error getting existing data for {date_str}: {e}")
-        return None
-
-def get_manual_entries(user_id, date_str):
-    """Get all manual entries for a specific date"""
-    try:
-        response = supabase.table('manual_data') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .eq('date', date_str) \
-            .execute()
-        
-        return response.data or []
-    except Exception as e:
-        print(f"Error getting manual entries for {date_str}: {e}")
-        return []
+    finally:
+        # The entry may have been deleted even if the recalculation failed part way
+        if invalidate_since:
+            invalidate_user(user_id, invalidate_since)
 
 def get_manual_entry_by_id(entry_id):
-    """Get a specific manual entry by ID"""
+    """Get a specific manual entry's user and date by ID"""
     try:
         response = supabase.table('manual_data') \
-            .select('*') \
+            .select('id, user_id, date') \
             .eq('id', entry_id) \
             .execute()
         
@@ -315,6 +212,11 @@ def get_manual_entry_by_id(entry_id):
 def get_previous_day_metrics(user_id, date_str):
     """Get metrics from the day before the specified date"""
     try:
+        # Nearest month-end checkpoint plus at most a month of replayed days
+        seeded = seed_metrics(user_id, date_str)
+        if seeded:
+            return seeded
+
         # Convert date_str to datetime and get previous day
         current_date = datetime.strptime(date_str, '%Y-%m-%d')
         previous_date = current_date - timedelta(days=1)
@@ -358,6 +260,28 @@ def get_previous_day_metrics(user_id, date_str):
         print(f"Error getting previous day metrics for {date_str}: {e}")
         return {'atl': 50.0, 'ctl': 50.0, 'tsb': 0.0}
 
+def recalculate_day(user_id, date_str):
+    """
+    Rewrite one day's garmin_data row from its activity total and recalculate later days.
+    
+    Args:
+        user_id (str): The user's ID
+        date_str (str): Date in YYYY-MM-DD format
+        
+    Returns:
+        dict: The day's new metrics
+    """
+    total = get_daily_total(user_id, date_str)
+    previous_metrics = get_previous_day_metrics(user_id, date_str)
+    print(f"Previous day metrics: {previous_metrics}")
+    
+    new_metrics = calculate_new_metrics(total['trimp'], previous_metrics)
+    print(f"{date_str}: TRIMP {total['trimp']} ({total['activity']}), new metrics: {new_metrics}")
+    
+    update_garmin_data(user_id, date_str, total['trimp'], total['activity'], new_metrics)
+    recalculate_metrics_from_date_onwards(user_id, date_str, new_metrics)
+    return new_metrics
+
 def calculate_new_metrics(trimp_value, previous_metrics):
     """Calculate new ATL, CTL, and TSB based on TRIMP and previous metrics"""
     trimp_value = float(trimp_value)
@@ -402,7 +326,7 @@ def update_garmin_data(user_id, date_str, trimp, activity, metrics):
         return False
 
 def insert_manual_entry(user_id, date_str, trimp, activity_name):
-    """Insert a new manual entry into the manual_data table"""
+    """Insert a new manual entry into the manual_data table; returns the inserted row or None"""
     try:
         data = {
             'user_id': user_id,
@@ -415,10 +339,10 @@ def insert_manual_entry(user_id, date_str, trimp, activity_name):
             .insert(data) \
             .execute()
             
-        return True
+        return response.data[0] if response.data else None
     except Exception as e:
         print(f"Error inserting manual entry: {e}")
-        return False
+        return None
 
 def update_manual_entry_in_db(entry_id, date_str, trimp, activity_name):
     """Update an existing manual entry in the manual_data table"""
@@ -466,6 +390,19 @@ def recalculate_metrics_from_date_onwards(user_id, start_date_str, initial_metri
     """
     try:
         print(f"Recalculating metrics from {start_date_str} onwards")
+
+        if DB_METRICS_RECOMPUTE:
+            next_date_str = (datetime.strptime(start_date_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            try:
+                result = recompute_daily_metrics(
+                    user_id,
+                    next_date_str,
+                    seed=(initial_metrics['atl'], initial_metrics['ctl'])
+                )
+                print(f"Recalculated metrics for {result['days_written']} dates in the database")
+                return True
+            except Exception as e:
+                print(f"Database recompute failed, recalculating in Python: {e}")
         
         # Get all dates after start_date
         response = supabase.table('garmin_data') \
@@ -489,6 +426,8 @@ def recalculate_metrics_from_date_onwards(user_id, start_date_str, initial_metri
             'tsb': float(initial_metrics['tsb'])
         }
         
+        computed_rows = [dict(prev_metrics, date=start_date_str)]
+
         # Process each date
         for date_item in subsequent_dates:
             date_str = date_item['date']
@@ -514,7 +453,9 @@ def recalculate_metrics_from_date_onwards(user_id, start_date_str, initial_metri
                 
             # Update prev_metrics for next iteration
             prev_metrics = metrics
+            computed_rows.append(dict(metrics, date=date_str))
             
+        save_month_end_checkpoints(user_id, computed_rows)
         print(f"Successfully recalculated metrics for {len(subsequent_dates)} dates")
         return True
         
@@ -523,34 +464,26 @@ def recalculate_metrics_from_date_onwards(user_id, start_date_str, initial_metri
         print(traceback.format_exc())
         return False
 
-def batch_fetch_garmin_data(user_id, start_date_str=None, end_date_str=None):
+def batch_fetch_garmin_data(user_id, start_date_str=None, end_date_str=None, columns=SERIES_COLUMNS):
     """
-    Fetch all garmin_data entries for a user within a date range in a single query
+    Fetch all garmin_data entries for a user within a date range, page by page
     
     Args:
         user_id (str): The user's ID
         start_date_str (str, optional): Start date in YYYY-MM-DD format
         end_date_str (str, optional): End date in YYYY-MM-DD format
+        columns (str): Columns to select
         
     Returns:
         list: List of garmin_data entries
     """
     try:
-        query = supabase.table('garmin_data').select('*').eq('user_id', user_id)
-        
-        if start_date_str:
-            query = query.gte('date', start_date_str)
-        if end_date_str:
-            query = query.lte('date', end_date_str)
-            
-        response = query.order('date').execute()
-        
-        return response.data or []
+        return fetch_garmin_series(user_id, start_date_str, end_date_str, columns)
     except Exception as e:
         print(f"Error batch fetching garmin data: {e}")
         return []
 
-def batch_fetch_manual_data(user_id, start_date_str=None, end_date_str=None):
+def batch_fetch_manual_data(user_id, start_date_str=None, end_date_str=None, columns='date, trimp, activity_name'):
     """
     Fetch all manual_data entries for a user within a date range in a single query
     
@@ -558,12 +491,13 @@ def batch_fetch_manual_data(user_id, start_date_str=None, end_date_str=None):
         user_id (str): The user's ID
         start_date_str (str, optional): Start date in YYYY-MM-DD format
         end_date_str (str, optional): End date in YYYY-MM-DD format
+        columns (str): Columns to select
         
     Returns:
         list: List of manual_data entries
     """
     try:
-        query = supabase.table('manual_data').select('*').eq('user_id', user_id)
+        query = supabase.table('manual_data').select(columns).eq('user_id', user_id)
         
         if start_date_str:
             query = query.gte('date', start_date_str)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Month-end ATL/CTL/TSB checkpoints per user.
+
+Every recompute that passes the last day of a month stores that day's metrics
+in user_metrics_checkpoints. Seeding a recompute then takes one indexed lookup
+for the nearest checkpoint before the date plus a read of at most a month of
+rows to replay, instead of searching garmin_data for the latest usable day.
+
+A checkpoint is only trusted while the garmin_data row of its day still has
+the same metrics; otherwise it and every later checkpoint are dropped.
+"""
+
+import calendar
+from datetime import datetime, timedelta
+from supabase_client import supabase
+from garmin_data_store import fetch_garmin_series, normalize_date
+from training_metrics import ATL_DAYS, CTL_DAYS
+
+# Checkpoint and stored row may differ by rounding between the write paths
+CHECKPOINT_TOLERANCE = 0.01
+
+def is_month_end(date_str):
+    day = datetime.strptime(date_str, '%Y-%m-%d').date()
+    return day.day == calendar.monthrange(day.year, day.month)[1]
+
+def get_checkpoint_before(user_id, date_str):
+    """Latest checkpoint strictly before date_str, or None"""
+    response = supabase.table('user_metrics_checkpoints') \
+        .select('checkpoint_date, atl, ctl, tsb') \
+        .eq('user_id', user_id) \
+        .lt('checkpoint_date', date_str) \
+        .order('checkpoint_date', desc=True) \
+        .limit(1) \
+        .execute()
+    return response.data[0] if response.data else None
+
+def delete_checkpoints_from(user_id, date_str):
+    """Drop checkpoints on or after date_str, e.g. when they no longer match garmin_data"""
+    supabase.table('user_metrics_checkpoints') \
+        .delete() \
+        .eq('user_id', user_id) \
+        .gte('checkpoint_date', date_str) \
+        .execute()
+
+def save_month_end_checkpoints(user_id, rows):
+    """
+    Store checkpoints for the month-end days among freshly computed rows.
+
+    Args:
+        user_id (str): The user's ID
+        rows (list): Dicts with date, atl, ctl and tsb
+    """
+    checkpoints = []
+    for row in rows:
+        date_str = normalize_date(str(row['date']))
+        if row.get('atl') is None or row.get('ctl') is None or not is_month_end(date_str):
+            continue
+        checkpoints.append({
+            'user_id': user_id,
+            'checkpoint_date': date_str,
+            'atl': float(row['atl']),
+            'ctl': float(row['ctl']),
+            'tsb': float(row['tsb']) if row.get('tsb') is not None else 0.0,
+            'updated_at': datetime.now().isoformat()
+        })
+
+    if not checkpoints:
+        return
+    try:
+        supabase.table('user_metrics_checkpoints') \
+            .upsert(checkpoints, on_conflict='user_id,checkpoint_date') \
+            .execute()
+    except Exception as e:
+        print(f"Error saving metrics checkpoints for {user_id}: {e}")
+
+def seed_metrics(user_id, date_str):
+    """
+    ATL/CTL/TSB of the day before date_str, replayed from the nearest checkpoint.
+
+    Stored metrics after the checkpoint are used as they are; days without a row
+    count as rest days and days with TRIMP but no metrics follow the recurrence.
+
+    Returns:
+        dict: {'atl', 'ctl', 'tsb'}, or None when there is no valid checkpoint
+    """
+    try:
+        checkpoint = get_checkpoint_before(user_id, date_str)
+        if not checkpoint:
+            return None
+
+        checkpoint_date = checkpoint['checkpoint_date']
+        # Paged: paths that write garmin_data without saving checkpoints can leave
+        # more than one page of rows after the checkpoint
+        day_before = (datetime.strptime(date_str, '%Y-%m-%d').date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        rows = fetch_garmin_series(user_id, checkpoint_date, day_before, 'date, trimp, atl, ctl, tsb')
+
+        state = {key: float(checkpoint[key]) for key in ('atl', 'ctl', 'tsb')}
+        last_day = datetime.strptime(checkpoint_date, '%Y-%m-%d').date()
+
+        def advance(trimp):
+            return {
+                'atl': state['atl'] + (trimp - state['atl']) / ATL_DAYS,
+                'ctl': state['ctl'] + (trimp - state['ctl']) / CTL_DAYS,
+                'tsb': state['ctl'] - state['atl']
+            }
+
+        for row in rows:
+            day = datetime.strptime(normalize_date(row['date']), '%Y-%m-%d').date()
+            if day == last_day:
+                stale = row.get('atl') is None or row.get('ctl') is None or \
+                    abs(float(row['atl']) - state['atl']) > CHECKPOINT_TOLERANCE or \
+                    abs(float(row['ctl']) - state['ctl']) > CHECKPOINT_TOLERANCE
+                if stale:
+                    print(f"Metrics checkpoint {checkpoint_date} for {user_id} is stale, dropping it")
+                    delete_checkpoints_from(user_id, checkpoint_date)
+                    return None
+                continue
+            if day < last_day:
+                continue
+
+            for _ in range((day - last_day).days - 1):
+                state = advance(0.0)
+            if row.get('atl') is not None and row.get('ctl') is not None:
+                computed_tsb = state['ctl'] - state['atl']
+                state = {
+                    'atl': float(row['atl']),
+                    'ctl': float(row['ctl']),
+                    'tsb': float(row['tsb']) if row.get('tsb') is not None else computed_tsb
+                }
+            else:
+                state = advance(float(row.get('trimp') or 0))
+            last_day = day
+
+        previous_day = datetime.strptime(date_str, '%Y-%m-%d').date() - timedelta(days=1)
+        for _ in range((previous_day - last_day).days):
+            state = advance(0.0)
+
+        return state
+    except Exception as e:
+        print(f"Error seeding metrics from checkpoint for {user_id}: {e}")
+        return None
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Metrics consistency check and bulk repair.
+
+atl/ctl/tsb are written by several code paths with different rounding and
+seeds, so stored series drift from the recurrence. This job recomputes every
+user's series from stored TRIMP, compares it with the stored values and
+upserts only the rows that differ by more than REPAIR_TOLERANCE.
+
+Each user's first stored day is the anchor: its metrics are kept (or seeded
+with training_metrics.DEFAULT_SEED when missing) and every later day follows
+the recurrence, with days that have no row counted as rest days. Users are
+processed in chunks as one (user, day) matrix with training_metrics.project_load.
+
+Usage: python metrics_repair.py [--dry-run] [USER_ID ...]
+"""
+
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from supabase_client import supabase
+from chart_cache import invalidate_user
+from garmin_data_store import fetch_garmin_rows_for_users, normalize_date
+from training_metrics import DEFAULT_SEED, project_load
+
+REPAIR_CHUNK_SIZE = int(os.getenv('REPAIR_CHUNK_SIZE', '200'))
+REPAIR_WORKERS = int(os.getenv('REPAIR_WORKERS', '4'))
+# Differences from rounding in the sync paths stay below this and are left alone
+REPAIR_TOLERANCE = float(os.getenv('REPAIR_TOLERANCE', '0.5'))
+REPAIR_DECIMALS = 2
+WRITE_CHUNK_SIZE = 500
+
+def recompute_chunk(df):
+    """
+    Recompute the metrics of a chunk of users and find the rows that drifted.
+
+    Args:
+        df (DataFrame): garmin_data rows (user_id, date, trimp, activity, atl, ctl, tsb)
+
+    Returns:
+        tuple: (list of corrected rows, list of users skipped because of duplicate days)
+    """
+    df = df.copy()
+    # Day numbers since the epoch, so date gaps are plain integer differences
+    df['day'] = pd.to_datetime(df['date'], format='ISO8601').values.astype('datetime64[D]').astype(np.int64)
+    for column in ['trimp', 'atl', 'ctl', 'tsb']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df['trimp'] = df['trimp'].fillna(0.0)
+
+    # Duplicate days have no single stored value to compare; cleanup_duplicates fixes them first
+    duplicated = df.duplicated(['user_id', 'day'], keep=False)
+    skipped = sorted(df.loc[duplicated, 'user_id'].unique())
+    df = df[~df['user_id'].isin(skipped)].sort_values(['user_id', 'day'])
+    if df.empty:
+        return [], skipped
+
+    users = df['user_id'].unique()
+    user_index = pd.Series(np.arange(len(users)), index=users)
+    rows_user = user_index[df['user_id']].to_numpy()
+
+    first = df.groupby('user_id', sort=False).head(1).set_index('user_id').loc[users]
+    anchored = (first['atl'].notna() & first['ctl'].notna()).to_numpy()
+    atl0 = np.where(anchored, first['atl'].to_numpy(), DEFAULT_SEED['atl'])
+    ctl0 = np.where(anchored, first['ctl'].to_numpy(), DEFAULT_SEED['ctl'])
+
+    # Column 0 is the day after the anchor, or the first day for unanchored users
+    first_day = first['day'].to_numpy()
+    offsets = df['day'].to_numpy() - first_day[rows_user] - anchored[rows_user]
+    trimp = np.zeros((len(users), offsets.max() + 1))
+    computed = offsets >= 0
+    trimp[rows_user[computed], offsets[computed]] = df['trimp'].to_numpy()[computed]
+
+    atl, ctl, tsb = project_load(trimp, atl0, ctl0)
+
+    rows = df[computed].copy()
+    cells = (rows_user[computed], offsets[computed])
+    rows['new_atl'] = np.round(atl[cells], REPAIR_DECIMALS)
+    rows['new_ctl'] = np.round(ctl[cells], REPAIR_DECIMALS)
+    rows['new_tsb'] = np.round(tsb[cells], REPAIR_DECIMALS)
+
+    drifted = np.zeros(len(rows), dtype=bool)
+    for column in ['atl', 'ctl', 'tsb']:
+        difference = (rows[column] - rows[f'new_{column}']).abs()
+        drifted |= (difference > REPAIR_TOLERANCE).to_numpy() | rows[column].isna().to_numpy()
+    rows = rows[drifted]
+
+    # trimp and activity are NOT NULL, so the upsert carries them unchanged
+    return [
+        {
+            'user_id': row.user_id,
+            'date': row.date,
+            'trimp': float(row.trimp),
+            'activity': row.activity,
+            'atl': float(row.new_atl),
+            'ctl': float(row.new_ctl),
+            'tsb': float(row.new_tsb)
+        }
+        for row in rows.itertuples(index=False)
+    ], skipped
+
+def repair_chunk(user_ids, dry_run=False):
+    """Check and repair one chunk of users; returns its counters"""
+    stored = fetch_garmin_rows_for_users(user_ids, columns='user_id, date, trimp, activity, atl, ctl, tsb')
+    if not stored:
+        return {'users': len(user_ids), 'rows': 0, 'repaired_rows': 0, 'repaired_users': 0, 'skipped_users': []}
+
+    repairs, skipped = recompute_chunk(pd.DataFrame(stored))
+
+    if repairs and not dry_run:
+        for i in range(0, len(repairs), WRITE_CHUNK_SIZE):
+            supabase.table('garmin_data') \
+                .upsert(repairs[i:i + WRITE_CHUNK_SIZE], on_conflict='user_id,date') \
+                .execute()
+
+    first_repaired = {}
+    for row in repairs:
+        date_str = normalize_date(row['date'])
+        first_repaired[row['user_id']] = min(date_str, first_repaired.get(row['user_id'], date_str))
+    repaired_users = set(first_repaired)
+    if not dry_run:
+        for user_id, date_str in first_repaired.items():
+            invalidate_user(user_id, date_str)
+
+    return {
+        'users': len(user_ids),
+        'rows': len(stored),
+        'repaired_rows': len(repairs),
+        'repaired_users': len(repaired_users),
+        'skipped_users': skipped
+    }
+
+def repair_metrics(user_ids=None, dry_run=False, workers=REPAIR_WORKERS):
+    """
+    Recompute stored metrics for many users and fix the rows that drifted.
+
+    Args:
+        user_ids (list, optional): Users to check (default: all users)
+        dry_run (bool): Only count the rows that would change
+        workers (int): Chunks processed in parallel
+
+    Returns:
+        dict: Counters for the run
+    """
+    from cleanup_duplicates import fetch_all_profile_user_ids
+
+    print(f"\n{'='*50}")
+    print(f"Starting metrics repair at {datetime.now().isoformat()}{' (dry run)' if dry_run else ''}")
+
+    user_ids = user_ids or fetch_all_profile_user_ids()
+    chunks = [user_ids[i:i + REPAIR_CHUNK_SIZE] for i in range(0, len(user_ids), REPAIR_CHUNK_SIZE)]
+    totals = {'users': 0, 'rows': 0, 'repaired_rows': 0, 'repaired_users': 0, 'skipped_users': [], 'failed_chunks': 0}
+    started = time.monotonic()
+
+    def run(chunk):
+        try:
+            return repair_chunk(chunk, dry_run)
+        except Exception as e:
+            print(f"Error repairing chunk starting at {chunk[0]}: {e}")
+            print(traceback.format_exc())
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run, chunks):
+            if result is None:
+                totals['failed_chunks'] += 1
+                continue
+            for key in ['users', 'rows', 'repaired_rows', 'repaired_users']:
+                totals[key] += result[key]
+            totals['skipped_users'].extend(result['skipped_users'])
+
+    elapsed = time.monotonic() - started
+    totals['elapsed_seconds'] = round(elapsed, 1)
+    totals['users_per_minute'] = round(totals['users'] / elapsed * 60) if elapsed > 0 else 0
+
+    print(f"Checked {totals['rows']} rows of {totals['users']} users in {totals['elapsed_seconds']}s "
+          f"({totals['users_per_minute']} users/min)")
+    print(f"{'Would repair' if dry_run else 'Repaired'} {totals['repaired_rows']} rows of {totals['repaired_users']} users; "
+          f"{len(totals['skipped_users'])} users skipped for duplicate days")
+    return totals
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    repair_metrics(args or None, dry_run='--dry-run' in sys.argv)
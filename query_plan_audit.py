@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Query plan audit for the tables the sync, chart and manual entry paths read.
+
+Runs EXPLAIN ANALYZE for each query shape the Python modules send through
+PostgREST against the Postgres database at DATABASE_URL, and fails when any
+of them reads an audited table with a sequential scan. With --seed the
+database is first filled with AUDIT_SEED_USERS synthetic users of
+AUDIT_SEED_DAYS days each, so plans are checked at realistic table sizes.
+
+Run it against a local database with the migrations applied. Everything,
+including the seed data and the audited writes, runs in one transaction that
+is rolled back. psycopg is optional and only needed here
+(pip install "psycopg[binary]").
+
+Usage: python query_plan_audit.py [--seed]
+"""
+
+import os
+import sys
+import time
+import traceback
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+AUDIT_SEED_USERS = int(os.getenv('AUDIT_SEED_USERS', '300'))
+AUDIT_SEED_DAYS = int(os.getenv('AUDIT_SEED_DAYS', '1095'))
+# Below this many garmin_data rows the planner may rightly prefer sequential scans
+AUDIT_MIN_ROWS = 50000
+
+AUDITED_TABLES = {'garmin_data', 'manual_data', 'activities', 'activity_daily_totals', 'user_metrics_checkpoints'}
+
+# (name, call sites, SQL) - the statements PostgREST builds for the Python queries
+QUERY_SHAPES = [
+    ('garmin_data range page', 'garmin_data_store.fetch_garmin_series, history_store',
+     "SELECT date, trimp, activity, atl, ctl, tsb FROM public.garmin_data "
+     "WHERE user_id = %(user_id)s AND date >= %(start)s AND date <= %(end)s AND date > %(day)s "
+     "ORDER BY date LIMIT 1000"),
+    ('garmin_data range page, many users', 'garmin_data_store.fetch_garmin_rows_for_users, metrics_repair',
+     "SELECT user_id, date, trimp, atl, ctl, tsb FROM public.garmin_data "
+     "WHERE user_id = ANY(%(user_ids)s) AND date >= %(start)s "
+     "AND (user_id > %(user_id)s OR (user_id = %(user_id)s AND date > %(day)s)) "
+     "ORDER BY user_id, date LIMIT 1000"),
+    ('garmin_data first row', 'garmin_data_store.fetch_first_row, garmin_sync',
+     "SELECT date, atl FROM public.garmin_data WHERE user_id = %(user_id)s ORDER BY date LIMIT 1"),
+    ('garmin_data latest before date', 'garmin_data_store.fetch_latest_row, get_previous_day_metrics',
+     "SELECT date, atl, ctl, tsb FROM public.garmin_data "
+     "WHERE user_id = %(user_id)s AND date < %(day)s ORDER BY date DESC LIMIT 1"),
+    ('garmin_data latest before date, many users', 'garmin_data_store.fetch_latest_rows_before, coach_metrics',
+     "SELECT * FROM public.garmin_data_latest_rows_before(%(user_ids)s, %(day)s)"),
+    ('garmin_data latest row', 'chart_updater.find_last_existing_date',
+     "SELECT date, atl, ctl, tsb, trimp FROM public.garmin_data "
+     "WHERE user_id = %(user_id)s ORDER BY date DESC LIMIT 1"),
+    ('garmin_data single day', 'get_previous_day_metrics, chart_updater.get_existing_data',
+     "SELECT trimp, atl, ctl, tsb FROM public.garmin_data WHERE user_id = %(user_id)s AND date = %(day)s"),
+    ('garmin_data after date', 'recalculate_metrics_from_date_onwards',
+     "SELECT date, trimp FROM public.garmin_data WHERE user_id = %(user_id)s AND date > %(day)s ORDER BY date"),
+    ('garmin_data update day', 'recalculate_metrics_from_date_onwards, garmin_sync',
+     "UPDATE public.garmin_data SET atl = 50, ctl = 50, tsb = 0 WHERE user_id = %(user_id)s AND date = %(day)s"),
+    ('garmin_data upsert day', 'garmin_sync.flush_days, update_garmin_data',
+     "INSERT INTO public.garmin_data (user_id, date, trimp, activity, atl, ctl, tsb) "
+     "VALUES (%(user_id)s, %(day)s, 0, 'Rest day', 50, 50, 0) "
+     "ON CONFLICT (user_id, date) DO UPDATE SET trimp = EXCLUDED.trimp, activity = EXCLUDED.activity, "
+     "atl = EXCLUDED.atl, ctl = EXCLUDED.ctl, tsb = EXCLUDED.tsb"),
+    ('manual_data by id', 'get_manual_entry_by_id, api',
+     "SELECT * FROM public.manual_data WHERE id = %(entry_id)s"),
+    ('manual_data range', 'batch_fetch_manual_data',
+     "SELECT * FROM public.manual_data "
+     "WHERE user_id = %(user_id)s AND date >= %(start)s AND date <= %(end)s ORDER BY date"),
+    ('manual_data many users', 'cleanup_duplicates',
+     "SELECT user_id, date, trimp FROM public.manual_data "
+     "WHERE user_id = ANY(%(user_ids)s) ORDER BY user_id, date LIMIT 1000 OFFSET 0"),
+    ('activity_daily_totals range', 'activity_store.get_daily_totals',
+     "SELECT activity_date, trimp, activities FROM public.activity_daily_totals "
+     "WHERE user_id = %(user_id)s AND activity_date >= %(start)s AND activity_date <= %(end)s "
+     "ORDER BY activity_date LIMIT 1000 OFFSET 0"),
+    ('activities legacy delete', 'activity_store.record_activities',
+     "DELETE FROM public.activities "
+     "WHERE user_id = %(user_id)s AND source = 'legacy' AND source_id = ANY(%(days)s)"),
+    ('user_metrics_checkpoints before date', 'metrics_checkpoints.get_checkpoint_before',
+     "SELECT checkpoint_date, atl, ctl, tsb FROM public.user_metrics_checkpoints "
+     "WHERE user_id = %(user_id)s AND checkpoint_date < %(day)s ORDER BY checkpoint_date DESC LIMIT 1")
+]
+
+SEED_STATEMENTS = [
+    "CREATE TEMP TABLE audit_users ON COMMIT DROP AS "
+    "SELECT gen_random_uuid() AS id FROM generate_series(1, %(users)s)",
+    "INSERT INTO auth.users (id) SELECT id FROM audit_users",
+    "INSERT INTO public.garmin_data (user_id, date, trimp, activity, atl, ctl, tsb) "
+    "SELECT u.id, d, round((random() * 150)::numeric, 1), 'Run', 50, 50, 0 "
+    "FROM audit_users u CROSS JOIN generate_series(CURRENT_DATE - %(days)s, CURRENT_DATE - 1, INTERVAL '1 day') d",
+    "INSERT INTO public.manual_data (user_id, date, trimp, activity_name) "
+    "SELECT u.id, d::date, 40, 'Yoga' "
+    "FROM audit_users u CROSS JOIN generate_series(CURRENT_DATE - %(days)s, CURRENT_DATE - 1, INTERVAL '7 days') d",
+    "INSERT INTO public.activities (user_id, activity_date, source, source_id, name, trimp) "
+    "SELECT u.id, d::date, 'garmin', u.id::text || d::date, 'Run', round((random() * 150)::numeric, 1) "
+    "FROM audit_users u CROSS JOIN generate_series(CURRENT_DATE - %(days)s, CURRENT_DATE - 1, INTERVAL '1 day') d",
+    "INSERT INTO public.user_metrics_checkpoints (user_id, checkpoint_date, atl, ctl, tsb) "
+    "SELECT u.id, (date_trunc('month', d) - INTERVAL '1 day')::date, 50, 50, 0 "
+    "FROM audit_users u CROSS JOIN generate_series(CURRENT_DATE - %(days)s, CURRENT_DATE, INTERVAL '1 month') d "
+    "ON CONFLICT DO NOTHING"
+]
+
+def seed_tables(cur, users=AUDIT_SEED_USERS, days=AUDIT_SEED_DAYS):
+    """Insert synthetic users with daily history and refresh planner statistics"""
+    started = time.monotonic()
+    for statement in SEED_STATEMENTS:
+        cur.execute(statement, {'users': users, 'days': days})
+    for table in sorted(AUDITED_TABLES):
+        cur.execute(f"ANALYZE public.{table}")
+    print(f"Seeded {users} users x {days} days in {time.monotonic() - started:.1f}s")
+
+def sample_params(cur):
+    """Query parameters from the user with the most garmin_data rows"""
+    cur.execute(
+        "SELECT user_id, MIN(date)::date, MAX(date)::date FROM public.garmin_data "
+        "GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 5"
+    )
+    users = cur.fetchall()
+    if not users:
+        raise Exception("garmin_data is empty, run with --seed")
+    user_id, first_day, last_day = users[0]
+    day = first_day + (last_day - first_day) / 2
+
+    cur.execute("SELECT id FROM public.manual_data ORDER BY id LIMIT 1")
+    entry = cur.fetchone()
+    return {
+        'user_id': user_id,
+        'user_ids': [row[0] for row in users],
+        'start': day,
+        'end': last_day,
+        'day': day,
+        'days': [str(day), str(last_day)],
+        'entry_id': entry[0] if entry else 0
+    }
+
+def sequential_scans(plan):
+    """Audited tables read by Seq Scan nodes anywhere in a JSON plan"""
+    tables = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in AUDITED_TABLES:
+        tables.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        tables.extend(sequential_scans(child))
+    return tables
+
+def scan_nodes(plan):
+    """Scan node summaries such as 'Index Only Scan on garmin_data' for the report"""
+    nodes = []
+    if plan.get('Relation Name'):
+        nodes.append(f"{plan['Node Type']} on {plan['Relation Name']}"
+                     + (f" using {plan['Index Name']}" if plan.get('Index Name') else ''))
+    for child in plan.get('Plans', []):
+        nodes.extend(scan_nodes(child))
+    return nodes
+
+def audit_query_plans(seed=False):
+    """
+    EXPLAIN ANALYZE every query shape and check for sequential scans.
+
+    Args:
+        seed (bool): Fill the database with synthetic users first
+
+    Returns:
+        dict: Result of the operation with one entry per query shape
+    """
+    if psycopg is None:
+        return {'success': False, 'error': 'psycopg is not installed (pip install "psycopg[binary]")'}
+    if not DATABASE_URL:
+        return {'success': False, 'error': 'DATABASE_URL is not set'}
+
+    try:
+        with psycopg.connect(DATABASE_URL) as conn:
+            try:
+                with conn.cursor() as cur:
+                    if seed:
+                        seed_tables(cur)
+
+                    cur.execute("SELECT COUNT(*) FROM public.garmin_data")
+                    row_count = cur.fetchone()[0]
+                    if row_count < AUDIT_MIN_ROWS:
+                        print(f"Warning: garmin_data has only {row_count} rows; plans may differ at production sizes")
+
+                    params = sample_params(cur)
+                    results = []
+                    for name, call_sites, sql in QUERY_SHAPES:
+                        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+                        explained = cur.fetchone()[0][0]
+                        plan = explained['Plan']
+                        results.append({
+                            'name': name,
+                            'call_sites': call_sites,
+                            'sequential_scans': sequential_scans(plan),
+                            'scans': scan_nodes(plan),
+                            'execution_ms': round(explained['Execution Time'], 3)
+                        })
+            finally:
+                conn.rollback()
+
+        failures = [result for result in results if result['sequential_scans']]
+        for result in results:
+            status = 'FAIL' if result['sequential_scans'] else 'ok'
+            print(f"[{status}] {result['name']} ({result['call_sites']}): {result['execution_ms']} ms")
+            for scan in result['scans']:
+                print(f"    {scan}")
+
+        print(f"\n{len(results) - len(failures)}/{len(results)} query shapes use indexes on {row_count} garmin_data rows")
+        return {
+            'success': not failures,
+            'rows': row_count,
+            'queries': results,
+            'error': f"Sequential scans in: {', '.join(result['name'] for result in failures)}" if failures else None
+        }
+
+    except Exception as e:
+        print(f"Error auditing query plans: {e}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+if __name__ == "__main__":
+    result = audit_query_plans(seed='--seed' in sys.argv)
+    if not result['success']:
+        print(result['error'])
+        sys.exit(1)
@@ -0,0 +1,21 @@
+-- Create sync_backfill_cursors table to resume long Garmin history imports
+CREATE TABLE IF NOT EXISTS public.sync_backfill_cursors (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    range_start DATE NOT NULL,
+    range_end DATE NOT NULL,
+    window_days INTEGER NOT NULL,
+    completed_through DATE,
+    windows_total INTEGER NOT NULL DEFAULT 0,
+    windows_done INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'running',
+    error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Enable RLS
+ALTER TABLE public.sync_backfill_cursors ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own backfill cursor"
+  ON public.sync_backfill_cursors FOR SELECT
+  USING (auth.uid() = user_id);
@@ -0,0 +1,17 @@
+-- Create sync_watermarks table holding the newest Garmin activity seen per user
+CREATE TABLE IF NOT EXISTS public.sync_watermarks (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    last_activity_start TIMESTAMP NOT NULL,
+    last_activity_id BIGINT NOT NULL,
+    -- Activities inside the overlap window: [{"id": ..., "start": "YYYY-MM-DD HH:MM:SS"}]
+    recent_activities JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Enable RLS
+ALTER TABLE public.sync_watermarks ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own sync watermark"
+  ON public.sync_watermarks FOR SELECT
+  USING (auth.uid() = user_id);
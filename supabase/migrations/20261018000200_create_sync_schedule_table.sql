@@ -0,0 +1,16 @@
+-- Create sync_schedule table tracking scheduled Garmin syncs per user
+CREATE TABLE IF NOT EXISTS public.sync_schedule (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    last_synced_at TIMESTAMPTZ,
+    last_status TEXT,
+    last_error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Enable RLS
+ALTER TABLE public.sync_schedule ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own sync schedule"
+  ON public.sync_schedule FOR SELECT
+  USING (auth.uid() = user_id);
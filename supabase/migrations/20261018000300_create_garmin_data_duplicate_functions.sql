@@ -0,0 +1,43 @@
+-- Create functions that find duplicate garmin_data days without loading the table
+-- Rows are duplicates when they share a user and calendar day (dates may carry a time of day)
+
+-- Users with duplicate days, in user_id order, for keyset paging
+CREATE OR REPLACE FUNCTION public.garmin_data_duplicate_users(after_user UUID DEFAULT NULL, max_users INTEGER DEFAULT 500)
+RETURNS TABLE (user_id UUID, duplicate_days BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT d.user_id, COUNT(*) AS duplicate_days
+    FROM (
+        SELECT g.user_id, g.date::date AS day
+        FROM public.garmin_data g
+        WHERE after_user IS NULL OR g.user_id > after_user
+        GROUP BY g.user_id, g.date::date
+        HAVING COUNT(*) > 1
+    ) d
+    GROUP BY d.user_id
+    ORDER BY d.user_id
+    LIMIT max_users;
+$$;
+
+-- Every row belonging to a duplicate day of the given users
+CREATE OR REPLACE FUNCTION public.garmin_data_duplicate_rows(user_ids UUID[])
+RETURNS SETOF public.garmin_data
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT g.*
+    FROM public.garmin_data g
+    JOIN (
+        SELECT user_id, date::date AS day
+        FROM public.garmin_data
+        WHERE user_id = ANY(user_ids)
+        GROUP BY user_id, date::date
+        HAVING COUNT(*) > 1
+    ) d ON d.user_id = g.user_id AND d.day = g.date::date
+    ORDER BY g.user_id, g.date;
+$$;
+
+-- Only the service role runs maintenance jobs
+REVOKE EXECUTE ON FUNCTION public.garmin_data_duplicate_users(UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.garmin_data_duplicate_rows(UUID[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,19 @@
+-- Create user_metrics_checkpoints table with month-end ATL/CTL/TSB per user
+-- Recomputes seed from the nearest checkpoint instead of searching garmin_data
+CREATE TABLE IF NOT EXISTS public.user_metrics_checkpoints (
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    checkpoint_date DATE NOT NULL,
+    atl DOUBLE PRECISION NOT NULL,
+    ctl DOUBLE PRECISION NOT NULL,
+    tsb DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, checkpoint_date)
+);
+
+-- Enable RLS
+ALTER TABLE public.user_metrics_checkpoints ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own metrics checkpoints"
+  ON public.user_metrics_checkpoints FOR SELECT
+  USING (auth.uid() = user_id);
@@ -0,0 +1,153 @@
+-- Create activities table with one row per Garmin activity or manual entry
+CREATE TABLE IF NOT EXISTS public.activities (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    activity_date DATE NOT NULL,
+    -- 'garmin', 'manual', or 'legacy' for the Garmin part of a day stored before this table existed
+    source TEXT NOT NULL CHECK (source IN ('garmin', 'manual', 'legacy')),
+    -- Garmin activity ID, manual_data ID, or the day (YYYY-MM-DD) for legacy rows
+    source_id TEXT NOT NULL,
+    name TEXT,
+    trimp DOUBLE PRECISION NOT NULL DEFAULT 0,
+    started_at TIMESTAMP,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE (user_id, source, source_id)
+);
+
+CREATE INDEX IF NOT EXISTS activities_user_date_idx ON public.activities (user_id, activity_date);
+
+-- Create activity_daily_totals table, the per-day aggregate of activities kept up to date by triggers
+CREATE TABLE IF NOT EXISTS public.activity_daily_totals (
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    activity_date DATE NOT NULL,
+    trimp DOUBLE PRECISION NOT NULL,
+    activity_count INTEGER NOT NULL,
+    -- Names joined with ', ' (legacy, then Garmin by start time, then manual), repeats kept; 'Rest day' when none are named
+    activities TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, activity_date)
+);
+
+-- Enable RLS
+ALTER TABLE public.activities ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.activity_daily_totals ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own activities"
+  ON public.activities FOR SELECT
+  USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can view own activity daily totals"
+  ON public.activity_daily_totals FOR SELECT
+  USING (auth.uid() = user_id);
+
+-- Recompute the totals of the given (user, day) pairs with one grouped query
+CREATE OR REPLACE FUNCTION public.refresh_activity_daily_totals(user_ids UUID[], days DATE[])
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO public.activity_daily_totals (user_id, activity_date, trimp, activity_count, activities, updated_at)
+    SELECT a.user_id, a.activity_date, SUM(a.trimp), COUNT(*),
+           COALESCE(string_agg(a.name, ', ' ORDER BY a.source = 'manual', a.started_at NULLS FIRST, a.id), 'Rest day'),
+           NOW()
+    FROM public.activities a
+    JOIN (SELECT DISTINCT * FROM unnest(user_ids, days) AS d(user_id, activity_date)) d
+      ON d.user_id = a.user_id AND d.activity_date = a.activity_date
+    GROUP BY a.user_id, a.activity_date
+    ON CONFLICT (user_id, activity_date) DO UPDATE
+    SET trimp = EXCLUDED.trimp,
+        activity_count = EXCLUDED.activity_count,
+        activities = EXCLUDED.activities,
+        updated_at = EXCLUDED.updated_at;
+
+    -- Days whose last activity was removed
+    DELETE FROM public.activity_daily_totals t
+    USING unnest(user_ids, days) AS d(user_id, activity_date)
+    WHERE t.user_id = d.user_id AND t.activity_date = d.activity_date
+      AND NOT EXISTS (
+          SELECT 1 FROM public.activities a
+          WHERE a.user_id = t.user_id AND a.activity_date = t.activity_date
+      );
+END;
+$$;
+
+-- Statement-level trigger: each statement refreshes every day it touched once
+CREATE OR REPLACE FUNCTION public.activities_refresh_daily_totals()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    user_ids UUID[];
+    days DATE[];
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT array_agg(user_id), array_agg(activity_date) INTO user_ids, days
+        FROM (SELECT DISTINCT user_id, activity_date FROM old_rows) o;
+        IF user_ids IS NOT NULL THEN
+            PERFORM public.refresh_activity_daily_totals(user_ids, days);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT array_agg(user_id), array_agg(activity_date) INTO user_ids, days
+        FROM (SELECT DISTINCT user_id, activity_date FROM new_rows) n;
+        IF user_ids IS NOT NULL THEN
+            PERFORM public.refresh_activity_daily_totals(user_ids, days);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER activities_daily_totals_insert
+    AFTER INSERT ON public.activities
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.activities_refresh_daily_totals();
+
+CREATE TRIGGER activities_daily_totals_update
+    AFTER UPDATE ON public.activities
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.activities_refresh_daily_totals();
+
+CREATE TRIGGER activities_daily_totals_delete
+    AFTER DELETE ON public.activities
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.activities_refresh_daily_totals();
+
+-- Only the service role maintains the aggregate
+REVOKE EXECUTE ON FUNCTION public.refresh_activity_daily_totals(UUID[], DATE[]) FROM PUBLIC, anon, authenticated;
+
+-- Import existing manual entries
+INSERT INTO public.activities (user_id, activity_date, source, source_id, name, trimp)
+SELECT m.user_id, m.date::date, 'manual', m.id::text, m.activity_name, COALESCE(m.trimp, 0)
+FROM public.manual_data m
+ON CONFLICT (user_id, source, source_id) DO NOTHING;
+
+-- Import the Garmin part of every stored day as one legacy row: the day's total
+-- minus its manual entries, named after the activities that are not manual entries
+INSERT INTO public.activities (user_id, activity_date, source, source_id, name, trimp)
+SELECT l.user_id, l.day, 'legacy', l.day::text, l.name, l.trimp
+FROM (
+    SELECT g.user_id, g.day,
+           NULLIF(array_to_string(ARRAY(
+               SELECT a.name
+               FROM unnest(string_to_array(g.activity, ', ')) WITH ORDINALITY AS a(name, position)
+               WHERE a.name <> 'Rest day' AND a.name <> ALL(COALESCE(m.names, '{}'))
+               ORDER BY a.position
+           ), ', '), '') AS name,
+           GREATEST(COALESCE(g.trimp, 0) - COALESCE(m.trimp, 0), 0) AS trimp
+    FROM (
+        -- Duplicate rows of a day: the one with the highest TRIMP, as cleanup_duplicates keeps
+        SELECT DISTINCT ON (user_id, date::date) user_id, date::date AS day, trimp, activity
+        FROM public.garmin_data
+        ORDER BY user_id, date::date, trimp DESC NULLS LAST
+    ) g
+    LEFT JOIN (
+        SELECT user_id, date::date AS day, SUM(trimp) AS trimp,
+               array_remove(array_agg(activity_name), NULL) AS names
+        FROM public.manual_data
+        GROUP BY user_id, date::date
+    ) m ON m.user_id = g.user_id AND m.day = g.day
+) l
+WHERE l.trimp > 0 OR l.name IS NOT NULL
+ON CONFLICT (user_id, source, source_id) DO NOTHING;
@@ -0,0 +1,100 @@
+-- Create function that recomputes a user's garmin_data from activity_daily_totals in one statement
+-- Every day from start_day to end_day (default: the last day with a garmin_data row or an activity)
+-- gets its TRIMP and activities from the daily totals (rest day when it has none) and ATL/CTL/TSB from
+-- the recurrence, rounded to decimals after every day as the Python write paths do. Month-end days
+-- are stored in user_metrics_checkpoints.
+-- Without seed_atl/seed_ctl the latest garmin_data row before start_day seeds the recurrence,
+-- decayed over any gap, or 50/50 when there is none.
+CREATE OR REPLACE FUNCTION public.recompute_training_metrics(
+    target_user UUID,
+    start_day DATE,
+    end_day DATE DEFAULT NULL,
+    seed_atl DOUBLE PRECISION DEFAULT NULL,
+    seed_ctl DOUBLE PRECISION DEFAULT NULL,
+    decimals INTEGER DEFAULT 2
+)
+RETURNS TABLE (days_written INTEGER, last_day DATE, atl DOUBLE PRECISION, ctl DOUBLE PRECISION, tsb DOUBLE PRECISION)
+LANGUAGE sql
+AS $$
+    WITH RECURSIVE bounds AS (
+        SELECT COALESCE(end_day, GREATEST(
+            (SELECT MAX(g.date)::date FROM public.garmin_data g WHERE g.user_id = target_user),
+            (SELECT MAX(t.activity_date) FROM public.activity_daily_totals t WHERE t.user_id = target_user)
+        )) AS final_day
+    ),
+    -- One array slot per day, so each step of the recurrence is a subscript instead of a join
+    daily AS (
+        SELECT COUNT(*)::INTEGER AS days,
+               array_agg(COALESCE(t.trimp, 0) ORDER BY d.day) AS trimp,
+               array_agg(COALESCE(t.activities, 'Rest day') ORDER BY d.day) AS activities
+        FROM bounds b
+        CROSS JOIN LATERAL generate_series(start_day, b.final_day, INTERVAL '1 day') AS d(day)
+        LEFT JOIN public.activity_daily_totals t
+          ON t.user_id = target_user AND t.activity_date = d.day::date
+    ),
+    seed AS (
+        SELECT COALESCE(seed_atl, s.atl * power(1 - 1.0 / 7, s.gap), 50)::DOUBLE PRECISION AS atl,
+               COALESCE(seed_ctl, s.ctl * power(1 - 1.0 / 42, s.gap), 50)::DOUBLE PRECISION AS ctl
+        FROM (SELECT 1) one
+        LEFT JOIN LATERAL (
+            SELECT g.atl, g.ctl, start_day - g.date::date - 1 AS gap
+            FROM public.garmin_data g
+            WHERE g.user_id = target_user AND g.date < start_day
+              AND g.atl IS NOT NULL AND g.ctl IS NOT NULL
+            ORDER BY g.date DESC
+            LIMIT 1
+        ) s ON TRUE
+    ),
+    metrics (n, atl, ctl, tsb) AS (
+        SELECT 0, s.atl, s.ctl, NULL::DOUBLE PRECISION
+        FROM seed s
+        UNION ALL
+        SELECT m.n + 1,
+               round((m.atl + (d.trimp[m.n + 1] - m.atl) / 7)::NUMERIC, decimals)::DOUBLE PRECISION,
+               round((m.ctl + (d.trimp[m.n + 1] - m.ctl) / 42)::NUMERIC, decimals)::DOUBLE PRECISION,
+               round((m.ctl - m.atl)::NUMERIC, decimals)::DOUBLE PRECISION
+        FROM metrics m
+        CROSS JOIN daily d
+        WHERE m.n < d.days
+    ),
+    computed AS (
+        SELECT start_day + m.n - 1 AS day, d.trimp[m.n] AS trimp, d.activities[m.n] AS activity,
+               m.atl, m.ctl, m.tsb
+        FROM metrics m
+        CROSS JOIN daily d
+        WHERE m.n > 0
+    ),
+    -- Stored dates may carry a time of day, so existing rows are matched by calendar day
+    updated AS (
+        UPDATE public.garmin_data g
+        SET trimp = c.trimp, activity = c.activity, atl = c.atl, ctl = c.ctl, tsb = c.tsb
+        FROM computed c
+        WHERE g.user_id = target_user AND g.date >= start_day AND g.date::date = c.day
+        RETURNING g.date::date AS day
+    ),
+    inserted AS (
+        INSERT INTO public.garmin_data (user_id, date, trimp, activity, atl, ctl, tsb)
+        SELECT target_user, c.day, c.trimp, c.activity, c.atl, c.ctl, c.tsb
+        FROM computed c
+        WHERE NOT EXISTS (SELECT 1 FROM updated u WHERE u.day = c.day)
+        RETURNING 1
+    ),
+    checkpoints AS (
+        INSERT INTO public.user_metrics_checkpoints (user_id, checkpoint_date, atl, ctl, tsb, updated_at)
+        SELECT target_user, c.day, c.atl, c.ctl, c.tsb, NOW()
+        FROM computed c
+        WHERE c.day = (date_trunc('month', c.day) + INTERVAL '1 month - 1 day')::date
+        ON CONFLICT (user_id, checkpoint_date) DO UPDATE
+        SET atl = EXCLUDED.atl,
+            ctl = EXCLUDED.ctl,
+            tsb = EXCLUDED.tsb,
+            updated_at = EXCLUDED.updated_at
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM computed)::INTEGER, l.day, l.atl, l.ctl, l.tsb
+    FROM (SELECT 1) one
+    LEFT JOIN (SELECT * FROM computed ORDER BY day DESC LIMIT 1) l ON TRUE;
+$$;
+
+-- Only the service role rewrites metrics
+REVOKE EXECUTE ON FUNCTION public.recompute_training_metrics(UUID, DATE, DATE, DOUBLE PRECISION, DOUBLE PRECISION, INTEGER) FROM PUBLIC, anon, authenticated;
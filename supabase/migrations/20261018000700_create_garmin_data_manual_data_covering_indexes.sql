@@ -0,0 +1,12 @@
+-- Create covering indexes for the garmin_data and manual_data reads of the Python modules
+-- query_plan_audit.py checks every query shape against them
+
+-- Per-user date ranges, the latest row before a date (order by date desc limit 1) and single
+-- days; the metric columns are included so seed lookups and series reads are index-only scans
+CREATE INDEX IF NOT EXISTS garmin_data_user_date_metrics_idx
+    ON public.garmin_data (user_id, date) INCLUDE (trimp, atl, ctl, tsb);
+
+-- Manual entries of one or many users by date (batch_fetch_manual_data, cleanup_duplicates);
+-- lookups by id use the primary key
+CREATE INDEX IF NOT EXISTS manual_data_user_date_idx
+    ON public.manual_data (user_id, date) INCLUDE (trimp);
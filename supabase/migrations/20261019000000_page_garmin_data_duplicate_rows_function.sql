@@ -0,0 +1,33 @@
+-- Page garmin_data_duplicate_rows with a keyset cursor
+-- PostgREST caps RPC results at max-rows like table reads, so a page of users with many
+-- duplicate rows was cut off silently. Rows now come in (user_id, date, id) order after the
+-- cursor, at most max_rows at a time; id breaks ties between rows stored with the same date.
+DROP FUNCTION IF EXISTS public.garmin_data_duplicate_rows(UUID[]);
+
+CREATE OR REPLACE FUNCTION public.garmin_data_duplicate_rows(
+    user_ids UUID[],
+    after_user UUID DEFAULT NULL,
+    after_date public.garmin_data.date%TYPE DEFAULT NULL,
+    after_id public.garmin_data.id%TYPE DEFAULT NULL,
+    max_rows INTEGER DEFAULT 1000
+)
+RETURNS SETOF public.garmin_data
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT g.*
+    FROM public.garmin_data g
+    JOIN (
+        SELECT user_id, date::date AS day
+        FROM public.garmin_data
+        WHERE user_id = ANY(user_ids)
+        GROUP BY user_id, date::date
+        HAVING COUNT(*) > 1
+    ) d ON d.user_id = g.user_id AND d.day = g.date::date
+    WHERE after_user IS NULL OR (g.user_id, g.date, g.id) > (after_user, after_date, after_id)
+    ORDER BY g.user_id, g.date, g.id
+    LIMIT max_rows;
+$$;
+
+-- Only the service role runs maintenance jobs
+REVOKE EXECUTE ON FUNCTION public.garmin_data_duplicate_rows(UUID[], UUID, public.garmin_data.date%TYPE, public.garmin_data.id%TYPE, INTEGER) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,22 @@
+-- Create function that returns the latest garmin_data row with metrics before a day for many users
+-- Seeds the coach metrics of athletes without rows in the requested window in one query; each
+-- user's row is one index lookup on (user_id, date) rather than a scan of their whole history
+CREATE OR REPLACE FUNCTION public.garmin_data_latest_rows_before(user_ids UUID[], before_day DATE)
+RETURNS TABLE (user_id UUID, date public.garmin_data.date%TYPE, atl public.garmin_data.atl%TYPE, ctl public.garmin_data.ctl%TYPE)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT u.user_id, g.date, g.atl, g.ctl
+    FROM unnest(user_ids) AS u(user_id)
+    CROSS JOIN LATERAL (
+        SELECT g.date, g.atl, g.ctl
+        FROM public.garmin_data g
+        WHERE g.user_id = u.user_id AND g.date < before_day
+          AND g.atl IS NOT NULL AND g.ctl IS NOT NULL
+        ORDER BY g.date DESC
+        LIMIT 1
+    ) g;
+$$;
+
+-- Only the service role reads other users' rows
+REVOKE EXECUTE ON FUNCTION public.garmin_data_latest_rows_before(UUID[], DATE) FROM PUBLIC, anon, authenticated;
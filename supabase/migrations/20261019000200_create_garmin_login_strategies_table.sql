@@ -0,0 +1,15 @@
+-- Create garmin_login_strategies table holding the Garmin login strategy that last worked per user
+CREATE TABLE IF NOT EXISTS public.garmin_login_strategies (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    -- Key of garmin_sync.LOGIN_STRATEGIES
+    strategy TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Enable RLS
+ALTER TABLE public.garmin_login_strategies ENABLE ROW LEVEL SECURITY;
+
+-- Create policies
+CREATE POLICY "Users can view own Garmin login strategy"
+  ON public.garmin_login_strategies FOR SELECT
+  USING (auth.uid() = user_id);
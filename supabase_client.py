@@ -17,7 +17,7 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def get_garmin_credentials(user_id):
     """Get Garmin credentials from Supabase for given user_id."""
-    response = supabase.table('garmin_credentials').select('*').eq('user_id', user_id).execute()
+    response = supabase.table('garmin_credentials').select('email, password').eq('user_id', user_id).execute()
     if not response.data:
         raise Exception(f"No credentials found for user_id: {user_id}")
     
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 from supabase_client import supabase
+from garmin_data_store import fetch_garmin_series
+from chart_cache import invalidate_user
 import pandas as pd
 
 # DEPRECATED: This file is kept for reference but metrics calculation is now handled in garmin_sync.py
@@ -49,13 +51,9 @@ def calculate_sync_metrics(user_id, start_date=None, is_first_sync=False, proces
         print(f"DEBUG: Number of processed dates: {len(processed_dates)}")
         
         # Get ALL historical data for this user
-        all_data = supabase.table('garmin_data')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .order('date')\
-            .execute()
+        history_rows = fetch_garmin_series(user_id)
 
-        if not all_data.data:
+        if not history_rows:
             print("No data found for user")
             # Even with no data, we'll create our own dataset with initial values
             empty_df = pd.DataFrame({
@@ -74,7 +72,7 @@ def calculate_sync_metrics(user_id, start_date=None, is_first_sync=False, proces
             df = empty_df
         else:
             # Convert to DataFrame and handle dates with ISO8601 format
-            df = pd.DataFrame(all_data.data)
+            df = pd.DataFrame(history_rows)
             df['date'] = pd.to_datetime(df['date'], format='ISO8601').dt.tz_localize(None)
             
             # Remove duplicate date entries - keep the entry with highest TRIMP
@@ -159,7 +157,7 @@ def calculate_sync_metrics(user_id, start_date=None, is_first_sync=False, proces
             # CRITICAL CHANGE: Always get the current state from the database
             # This ensures we don't overwrite activity and TRIMP data
             current_entry_response = supabase.table('garmin_data')\
-                .select('*')\
+                .select('trimp, activity')\
                 .eq('user_id', user_id)\
                 .eq('date', date_str)\
                 .execute()
@@ -196,6 +194,9 @@ def calculate_sync_metrics(user_id, start_date=None, is_first_sync=False, proces
             except Exception as e:
                 print(f"Error updating metrics for {date_str}: {e}")
 
+        if metrics_updates:
+            invalidate_user(user_id, min(metrics_updates))
+
         return {
             'success': True,
             'message': f'Updated metrics for {len(metrics_updates)} days'
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Fleet-wide scheduled Garmin sync.
+
+Each run picks the users with Garmin credentials whose data is stalest, weights
+them by subscription tier, spreads their sync start times evenly over
+SCHEDULER_WINDOW_MINUTES so they don't all hit Garmin at once, and never runs
+more than SCHEDULER_MAX_CONCURRENCY syncs at the same time.
+
+Run once (e.g. from a cron job):   python sync_scheduler.py --once
+Run as a long-lived worker:        python sync_scheduler.py
+"""
+
+import os
+import sys
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from supabase_client import supabase
+
+SCHEDULER_INTERVAL_MINUTES = int(os.getenv('SCHEDULER_INTERVAL_MINUTES', '60'))
+# Sync start times of one run are spread over this many minutes
+SCHEDULER_WINDOW_MINUTES = int(os.getenv('SCHEDULER_WINDOW_MINUTES', '45'))
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '4'))
+SCHEDULER_MAX_USERS_PER_RUN = int(os.getenv('SCHEDULER_MAX_USERS_PER_RUN', '500'))
+# Users synced more recently than this are left alone
+SCHEDULER_MIN_STALENESS_HOURS = float(os.getenv('SCHEDULER_MIN_STALENESS_HOURS', '6'))
+
+# Priority multiplier by subscription status
+TIER_WEIGHTS = {
+    'active': 2.0,
+    'trialing': 1.5
+}
+# Staleness assumed for users that were never synced by the scheduler
+NEVER_SYNCED_HOURS = 24 * 7
+
+PAGE_SIZE = 1000
+IN_FILTER_CHUNK = 200
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _fetch_all_user_ids():
+    """All user IDs with stored Garmin credentials"""
+    user_ids = []
+    offset = 0
+    while True:
+        response = supabase.table('garmin_credentials') \
+            .select('user_id') \
+            .order('user_id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        page = response.data or []
+        user_ids.extend(row['user_id'] for row in page)
+        if len(page) < PAGE_SIZE:
+            return user_ids
+        offset += PAGE_SIZE
+
+def _fetch_by_user(table, columns, user_ids):
+    """Rows of a per-user table for many users, keyed by user_id"""
+    rows = {}
+    for i in range(0, len(user_ids), IN_FILTER_CHUNK):
+        response = supabase.table(table) \
+            .select(columns) \
+            .in_('user_id', user_ids[i:i + IN_FILTER_CHUNK]) \
+            .execute()
+        for row in response.data or []:
+            rows[row['user_id']] = row
+    return rows
+
+def fetch_sync_candidates(now=None):
+    """
+    Users due for a sync, highest priority first.
+
+    Priority is hours since the last sync times the subscription tier weight.
+    Users with a sync in progress or synced within SCHEDULER_MIN_STALENESS_HOURS are skipped.
+
+    Returns:
+        list: dicts with user_id, staleness_hours, tier and priority
+    """
+    now = now or datetime.now(timezone.utc)
+    user_ids = _fetch_all_user_ids()
+    if not user_ids:
+        return []
+
+    schedule = _fetch_by_user('sync_schedule', 'user_id, last_synced_at', user_ids)
+    subscriptions = _fetch_by_user('subscriptions', 'user_id, status', user_ids)
+    locks = _fetch_by_user('sync_locks', 'user_id', user_ids)
+
+    candidates = []
+    for user_id in user_ids:
+        if user_id in locks:
+            continue
+
+        last_synced_at = (schedule.get(user_id) or {}).get('last_synced_at')
+        if last_synced_at:
+            staleness_hours = (now - _parse_timestamp(last_synced_at)).total_seconds() / 3600
+        else:
+            staleness_hours = NEVER_SYNCED_HOURS
+        if staleness_hours < SCHEDULER_MIN_STALENESS_HOURS:
+            continue
+
+        tier = (subscriptions.get(user_id) or {}).get('status') or 'free'
+        candidates.append({
+            'user_id': user_id,
+            'staleness_hours': round(staleness_hours, 1),
+            'tier': tier,
+            'priority': staleness_hours * TIER_WEIGHTS.get(tier, 1.0)
+        })
+
+    candidates.sort(key=lambda candidate: candidate['priority'], reverse=True)
+    return candidates
+
+def stagger_offsets(count, window_minutes=SCHEDULER_WINDOW_MINUTES):
+    """Start offsets in seconds spreading count syncs evenly over the window"""
+    if count == 0:
+        return []
+    step = window_minutes * 60 / count
+    return [i * step for i in range(count)]
+
+def record_sync_result(user_id, result):
+    """Store when and how a user's last sync finished"""
+    row = {
+        'user_id': user_id,
+        'last_status': 'success' if result.get('success') else 'failed',
+        'last_error': result.get('error'),
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }
+    if result.get('skipped'):
+        # Locked out by another sync: nothing was synced, so the user keeps their staleness
+        row['last_status'] = 'skipped'
+    else:
+        row['last_synced_at'] = row['updated_at']
+
+    try:
+        supabase.table('sync_schedule') \
+            .upsert(row, on_conflict='user_id') \
+            .execute()
+    except Exception as e:
+        print(f"Error recording sync result for {user_id}: {e}")
+
+def run_user_sync(user_id):
+    """Sync one user from their watermark and record the outcome"""
+    from garmin_sync import sync_garmin_data
+
+    started = time.monotonic()
+    try:
+        result = sync_garmin_data(user_id)
+    except Exception as e:
+        print(f"Scheduled sync for {user_id} crashed: {e}")
+        print(traceback.format_exc())
+        result = {'success': False, 'error': str(e)}
+
+    record_sync_result(user_id, result)
+    print(f"Scheduled sync for {user_id} finished in {time.monotonic() - started:.1f}s: "
+          f"{result.get('message') if result.get('skipped') else 'ok' if result.get('success') else result.get('error')}")
+    return result
+
+def run_scheduled_syncs(max_users=SCHEDULER_MAX_USERS_PER_RUN, window_minutes=SCHEDULER_WINDOW_MINUTES,
+                        max_concurrency=SCHEDULER_MAX_CONCURRENCY):
+    """
+    Run one scheduling round.
+
+    Returns:
+        dict: Counts of scheduled, succeeded, skipped and failed syncs
+    """
+    print(f"\n{'='*50}")
+    print(f"Scheduling Garmin syncs at {datetime.now().isoformat()}")
+
+    candidates = fetch_sync_candidates()[:max_users]
+    offsets = stagger_offsets(len(candidates), window_minutes)
+    print(f"{len(candidates)} users due, spread over {window_minutes} minutes, at most {max_concurrency} at once")
+
+    budget = threading.BoundedSemaphore(max_concurrency)
+    stats = {'scheduled': len(candidates), 'succeeded': 0, 'skipped': 0, 'failed': 0}
+    stats_lock = threading.Lock()
+
+    def finish(future):
+        budget.release()
+        try:
+            result = future.result()
+            outcome = 'skipped' if result.get('skipped') else 'succeeded' if result.get('success') else 'failed'
+        except Exception:
+            outcome = 'failed'
+        with stats_lock:
+            stats[outcome] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for candidate, offset in zip(candidates, offsets):
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # Wait for a free slot in the concurrency budget before starting the next sync
+            budget.acquire()
+            future = executor.submit(run_user_sync, candidate['user_id'])
+            future.add_done_callback(finish)
+
+    print(f"Scheduling round done in {time.monotonic() - started:.0f}s: {stats}")
+    print(f"{'='*50}\n")
+    return stats
+
+if __name__ == "__main__":
+    if '--once' in sys.argv:
+        run_scheduled_syncs()
+    else:
+        while True:
+            round_started = time.monotonic()
+            try:
+                run_scheduled_syncs()
+            except Exception as e:
+                print(f"Scheduling round failed: {e}")
+                print(traceback.format_exc())
+            time.sleep(max(0, SCHEDULER_INTERVAL_MINUTES * 60 - (time.monotonic() - round_started)))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Sharded nightly Garmin sync.
+
+Users are partitioned by a stable hash of their ID: first across machines
+(SYNC_SHARD_ID of SYNC_SHARD_TOTAL), then across SYNC_PROCESSES worker
+processes on this machine. Every worker process imports its own Supabase
+client and Garmin sessions, so nothing is shared between processes, and
+syncs its partition one user at a time with garmin_sync.sync_garmin_data.
+
+Example with two machines:
+    SYNC_SHARD_ID=0 SYNC_SHARD_TOTAL=2 python sync_shard_runner.py
+    SYNC_SHARD_ID=1 SYNC_SHARD_TOTAL=2 python sync_shard_runner.py
+"""
+
+import os
+import time
+import hashlib
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+SYNC_SHARD_ID = int(os.getenv('SYNC_SHARD_ID', '0'))
+SYNC_SHARD_TOTAL = int(os.getenv('SYNC_SHARD_TOTAL', '1'))
+SYNC_PROCESSES = int(os.getenv('SYNC_PROCESSES', str(os.cpu_count() or 2)))
+
+def user_hash(user_id):
+    """Stable hash of a user ID (Python's hash() is salted per process)"""
+    return int(hashlib.md5(str(user_id).encode()).hexdigest()[:15], 16)
+
+def shard_of(user_id, shard_total=SYNC_SHARD_TOTAL):
+    return user_hash(user_id) % shard_total
+
+def partition_users(user_ids, shard_id=SYNC_SHARD_ID, shard_total=SYNC_SHARD_TOTAL, processes=SYNC_PROCESSES):
+    """
+    Users of this shard split into one list per worker process.
+
+    Args:
+        user_ids (list): All user IDs
+        shard_id (int): This machine's shard, 0 <= shard_id < shard_total
+        shard_total (int): Number of machines
+        processes (int): Worker processes on this machine
+
+    Returns:
+        list: One list of user IDs per process
+    """
+    partitions = [[] for _ in range(processes)]
+    for user_id in user_ids:
+        hashed = user_hash(user_id)
+        if hashed % shard_total != shard_id:
+            continue
+        partitions[(hashed // shard_total) % processes].append(user_id)
+    return partitions
+
+def sync_partition(partition_index, user_ids):
+    """
+    Sync a list of users inside a worker process.
+
+    Returns:
+        dict: Throughput stats for the partition
+    """
+    # Imported here so every worker process creates its own clients
+    from garmin_sync import sync_garmin_data
+    from sync_scheduler import record_sync_result
+
+    stats = {
+        'partition': partition_index,
+        'pid': os.getpid(),
+        'users': len(user_ids),
+        'succeeded': 0,
+        'failed': 0,
+        'new_activities': 0
+    }
+    started = time.monotonic()
+
+    for user_id in user_ids:
+        try:
+            result = sync_garmin_data(user_id)
+        except Exception as e:
+            print(f"[partition {partition_index}] Sync for {user_id} crashed: {e}")
+            print(traceback.format_exc())
+            result = {'success': False, 'error': str(e)}
+
+        record_sync_result(user_id, result)
+        if result.get('success'):
+            stats['succeeded'] += 1
+            stats['new_activities'] += result.get('newActivities', 0)
+        else:
+            stats['failed'] += 1
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_seconds'] = round(elapsed, 1)
+    stats['users_per_minute'] = round(len(user_ids) / elapsed * 60, 2) if elapsed > 0 else 0.0
+    return stats
+
+def run_shard(shard_id=SYNC_SHARD_ID, shard_total=SYNC_SHARD_TOTAL, processes=SYNC_PROCESSES):
+    """
+    Sync every user of this shard with a pool of worker processes.
+
+    Returns:
+        dict: Per-partition and total throughput stats
+    """
+    from sync_scheduler import _fetch_all_user_ids
+
+    if not 0 <= shard_id < shard_total:
+        raise ValueError(f"SYNC_SHARD_ID must be between 0 and {shard_total - 1}")
+
+    print(f"\n{'='*50}")
+    print(f"Shard {shard_id}/{shard_total} starting at {datetime.now().isoformat()} with {processes} processes")
+
+    partitions = partition_users(_fetch_all_user_ids(), shard_id, shard_total, processes)
+    print(f"Partition sizes: {[len(partition) for partition in partitions]}")
+
+    started = time.monotonic()
+    # spawn, not fork: forked workers would share the parent's open HTTP connections
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [
+            executor.submit(sync_partition, index, partition)
+            for index, partition in enumerate(partitions)
+            if partition
+        ]
+        partition_stats = [future.result() for future in futures]
+
+    elapsed = time.monotonic() - started
+    total_users = sum(stats['users'] for stats in partition_stats)
+    summary = {
+        'shard_id': shard_id,
+        'shard_total': shard_total,
+        'users': total_users,
+        'succeeded': sum(stats['succeeded'] for stats in partition_stats),
+        'failed': sum(stats['failed'] for stats in partition_stats),
+        'new_activities': sum(stats['new_activities'] for stats in partition_stats),
+        'elapsed_seconds': round(elapsed, 1),
+        'users_per_minute': round(total_users / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        'partitions': partition_stats
+    }
+
+    for stats in partition_stats:
+        print(f"Partition {stats['partition']} (pid {stats['pid']}): {stats['succeeded']}/{stats['users']} ok, "
+              f"{stats['new_activities']} activities, {stats['users_per_minute']} users/min")
+    print(f"Shard {shard_id}/{shard_total} done: {summary['succeeded']}/{total_users} ok in {summary['elapsed_seconds']}s "
+          f"({summary['users_per_minute']} users/min)")
+    print(f"{'='*50}\n")
+    return summary
+
+if __name__ == "__main__":
+    run_shard()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Per-user sync watermark: the newest Garmin activity already imported.
+
+Routine syncs list activities only from the watermark minus a small overlap
+(SYNC_WATERMARK_OVERLAP_HOURS, for activities uploaded late from a device) and
+skip every activity already seen, so most runs need one small list call and no
+detail calls at all.
+"""
+
+import os
+from datetime import datetime, timedelta
+from supabase_client import supabase
+
+SYNC_WATERMARK_OVERLAP_HOURS = int(os.getenv('SYNC_WATERMARK_OVERLAP_HOURS', '24'))
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def activity_start(activity):
+    """Local start time of a Garmin activity list entry, or None"""
+    start_time = activity.get('startTimeLocal') or activity.get('startTimeGMT')
+    if not start_time:
+        return None
+    return datetime.strptime(start_time, TIME_FORMAT)
+
+def get_watermark(user_id):
+    """Get the user's watermark row, or None before the first watermarked sync"""
+    try:
+        response = supabase.table('sync_watermarks') \
+            .select('last_activity_start, last_activity_id, recent_activities') \
+            .eq('user_id', user_id) \
+            .execute()
+        if not response.data:
+            return None
+
+        watermark = response.data[0]
+        watermark['last_activity_start'] = datetime.fromisoformat(watermark['last_activity_start'])
+        return watermark
+    except Exception as e:
+        print(f"Error getting sync watermark for {user_id}: {e}")
+        return None
+
+def sync_start(watermark, overlap_hours=SYNC_WATERMARK_OVERLAP_HOURS):
+    """First moment a watermarked sync has to ask Garmin about"""
+    return watermark['last_activity_start'] - timedelta(hours=overlap_hours)
+
+def filter_new_activities(activities, watermark, overlap_hours=SYNC_WATERMARK_OVERLAP_HOURS):
+    """
+    Drop activities the watermark shows were already imported.
+
+    An activity is seen if it is listed in the overlap window or started before it.
+    """
+    if not watermark:
+        return activities
+
+    seen_ids = {entry['id'] for entry in watermark.get('recent_activities') or []}
+    seen_ids.add(watermark['last_activity_id'])
+    overlap_start = sync_start(watermark, overlap_hours)
+
+    new_activities = []
+    for activity in activities:
+        start = activity_start(activity)
+        if activity.get('activityId') in seen_ids or (start and start < overlap_start):
+            continue
+        new_activities.append(activity)
+
+    print(f"Watermark: {len(new_activities)} of {len(activities)} listed activities are new")
+    return new_activities
+
+def advance_watermark(user_id, watermark, activities, overlap_hours=SYNC_WATERMARK_OVERLAP_HOURS, hold_before=None):
+    """
+    Move the watermark past successfully imported activities.
+
+    Args:
+        user_id (str): The user's ID
+        watermark (dict): Current watermark from get_watermark(), or None
+        activities (list): Garmin activity list entries that were imported
+        hold_before (datetime, optional): Start of a day that has to be listed again;
+            activities from then on do not move the watermark
+    """
+    recent = list(watermark.get('recent_activities') or []) if watermark else []
+    if hold_before:
+        # Activities of the held day and after it count as unseen on the next sync
+        recent = [entry for entry in recent if entry['start'] < hold_before.strftime(TIME_FORMAT)]
+    for activity in activities:
+        start = activity_start(activity)
+        if hold_before and start and start >= hold_before:
+            continue
+        if activity.get('activityId') and start:
+            recent.append({'id': activity['activityId'], 'start': start.strftime(TIME_FORMAT)})
+
+    if not recent and not watermark:
+        return
+
+    latest = max(recent, key=lambda entry: (entry['start'], entry['id'])) if recent else None
+    last_start = datetime.strptime(latest['start'], TIME_FORMAT) if latest else None
+    if watermark and (last_start is None or watermark['last_activity_start'] > last_start):
+        last_start = watermark['last_activity_start']
+        latest = {'id': watermark['last_activity_id'], 'start': last_start.strftime(TIME_FORMAT)}
+
+    # Only activities that a later overlap window can list again need remembering
+    window_start = (last_start - timedelta(hours=overlap_hours)).strftime(TIME_FORMAT)
+    recent = list({entry['id']: entry for entry in recent if entry['start'] >= window_start}.values())
+
+    try:
+        supabase.table('sync_watermarks') \
+            .upsert({
+                'user_id': user_id,
+                'last_activity_start': latest['start'],
+                'last_activity_id': latest['id'],
+                'recent_activities': recent,
+                'updated_at': datetime.now().isoformat()
+            }, on_conflict='user_id') \
+            .execute()
+        print(f"Watermark for {user_id} now at {latest['start']} (activity {latest['id']})")
+    except Exception as e:
+        print(f"Error advancing sync watermark for {user_id}: {e}")
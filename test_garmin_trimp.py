@@ -210,7 +210,7 @@ def test_garmin_trimp(email, password, days_back=7):
 def get_user_credentials(user_id):
     try:
         print(f"Fetching Garmin credentials for user {user_id}")
-        response = supabase.table('garmin_credentials').select('*').eq('user_id', user_id).execute()
+        response = supabase.table('garmin_credentials').select('email, password').eq('user_id', user_id).execute()
         
         if not response.data or len(response.data) == 0:
             print("No Garmin credentials found for user")
@@ -0,0 +1,164 @@
+import os
+import sys
+
+import pytest
+
+# supabase_client creates its client on import; tests replace it with FakeSupabase
+os.environ.setdefault('SUPABASE_URL', 'https://test.supabase.co')
+os.environ.setdefault('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.test')
+# PostgREST max-rows: longer results are cut off without an error
+MAX_ROWS = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+
+class FakeQuery:
+    """The subset of the postgrest query builder the Python modules use, over lists of dicts"""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.op = 'select'
+        self.payload = None
+        self.on_conflict = None
+        self.orders = []
+        self.bounds = None
+        self.max_rows = None
+
+    def select(self, columns='*', **kwargs):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) > str(value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) >= str(value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) < str(value))
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: str(row.get(column))[:len(str(value))] <= str(value))
+        return self
+
+    def in_(self, column, values):
+        values = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def upsert(self, payload, on_conflict=None):
+        self.op, self.payload, self.on_conflict = 'upsert', payload, on_conflict
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def delete(self):
+        self.op = 'delete'
+        return self
+
+    def execute(self):
+        rows = self.db.setdefault(self.table, [])
+        matched = [row for row in rows if all(check(row) for check in self.filters)]
+
+        if self.op == 'select':
+            for column, desc in reversed(self.orders):
+                matched.sort(key=lambda row: str(row.get(column)), reverse=desc)
+            if self.bounds:
+                matched = matched[self.bounds[0]:self.bounds[1] + 1]
+            if self.max_rows:
+                matched = matched[:self.max_rows]
+            return FakeResponse([dict(row) for row in matched[:MAX_ROWS]])
+
+        if self.op == 'delete':
+            self.db[self.table] = [row for row in rows if row not in matched]
+        elif self.op == 'update':
+            for row in matched:
+                row.update(self.payload)
+        else:
+            keys = [key.strip() for key in self.on_conflict.split(',')] if self.on_conflict else []
+            for item in self.payload if isinstance(self.payload, list) else [self.payload]:
+                existing = [row for row in rows if keys and all(str(row.get(key)) == str(item.get(key)) for key in keys)]
+                if existing:
+                    existing[0].update(item)
+                else:
+                    rows.append(dict(item))
+
+        if self.table == 'activities':
+            refresh_daily_totals(self.db)
+        return FakeResponse(matched)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase client; RPCs are not available"""
+
+    def __init__(self):
+        self.db = {}
+
+    def table(self, name):
+        return FakeQuery(self.db, name)
+
+    def rpc(self, name, params):
+        raise NotImplementedError(name)
+
+
+def refresh_daily_totals(db):
+    """What the activities triggers keep in activity_daily_totals"""
+    totals = {}
+    for row in sorted(db.get('activities', []), key=lambda row: str(row.get('started_at') or '')):
+        key = (row['user_id'], str(row['activity_date']))
+        total = totals.setdefault(key, {'trimp': 0.0, 'names': []})
+        total['trimp'] += float(row['trimp'])
+        if row.get('name'):
+            total['names'].append(row['name'])
+    db['activity_daily_totals'] = [
+        {
+            'user_id': user_id,
+            'activity_date': day,
+            'trimp': total['trimp'],
+            'activities': ', '.join(total['names']) or 'Rest day'
+        }
+        for (user_id, day), total in totals.items()
+    ]
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    """Route the supabase client of every imported repo module to one FakeSupabase"""
+    fake = FakeSupabase()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == ROOT and hasattr(module, 'supabase'):
+            monkeypatch.setattr(module, 'supabase', fake)
+    return fake
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+import garmin_backfill
+import garmin_data_store
+import garmin_sync
+
+USER_ID = 'user-1'
+TODAY = datetime.now().date()
+LEGACY_DAY = str(TODAY - timedelta(days=5))
+NEXT_DAY = str(TODAY - timedelta(days=4))
+
+ACTIVITIES = [
+    {'activityId': 1, 'activityName': 'Run', 'startTimeLocal': f"{LEGACY_DAY} 07:00:00"},
+    {'activityId': 2, 'activityName': 'Ride', 'startTimeLocal': f"{LEGACY_DAY} 18:00:00"},
+    {'activityId': 3, 'activityName': 'Swim', 'startTimeLocal': f"{NEXT_DAY} 07:00:00"}
+]
+TRIMPS = {1: 30.0, 2: 70.0, 3: 20.0}
+
+
+class FakeGarmin:
+    garmin_connect_activities = '/activitylist-service/activities/search/activities'
+
+    def __init__(self, failing_ids=()):
+        self.failing_ids = set(failing_ids)
+
+    def connectapi(self, url, params=None):
+        start = int(params['start'])
+        return ACTIVITIES[start:start + int(params['limit'])]
+
+    def get_activity(self, activity_id):
+        if activity_id in self.failing_ids:
+            raise Exception(f"details of {activity_id} unavailable")
+        return {'connectIQMeasurements': [{'developerFieldNumber': 4, 'value': TRIMPS[activity_id]}]}
+
+
+def seed_legacy_day(fake_supabase):
+    fake_supabase.db['garmin_credentials'] = [{'user_id': USER_ID, 'email': 'athlete@example.com', 'password': 'pw'}]
+    fake_supabase.db['garmin_data'] = [{
+        'user_id': USER_ID, 'date': f"{LEGACY_DAY}T00:00:00", 'trimp': 100.0, 'activity': 'Run, Ride',
+        'atl': 50.0, 'ctl': 50.0, 'tsb': 0.0
+    }]
+    fake_supabase.table('activities').upsert({
+        'user_id': USER_ID, 'activity_date': LEGACY_DAY, 'source': 'legacy', 'source_id': LEGACY_DAY,
+        'name': 'Run, Ride', 'trimp': 100.0, 'started_at': None
+    }, on_conflict='user_id,source,source_id').execute()
+
+
+def daily_total(fake_supabase, day):
+    return [row['trimp'] for row in fake_supabase.db['activity_daily_totals'] if row['activity_date'] == day]
+
+
+def run_sync(monkeypatch, failing_ids=()):
+    monkeypatch.setattr(garmin_sync, 'DB_METRICS_RECOMPUTE', False)
+    monkeypatch.setattr(garmin_sync, 'initialize_garmin_client', lambda email, password, user_id=None: FakeGarmin(failing_ids))
+    start_date = datetime.combine(TODAY - timedelta(days=7), datetime.min.time())
+    return garmin_sync.sync_garmin_data(USER_ID, start_date=start_date)
+
+
+def test_partly_failed_legacy_day_keeps_its_old_total(fake_supabase, monkeypatch):
+    seed_legacy_day(fake_supabase)
+
+    result = run_sync(monkeypatch, failing_ids={2})
+
+    assert result['success']
+    assert result['newActivities'] == 1
+    sources = {(row['source'], row['source_id']) for row in fake_supabase.db['activities']}
+    assert ('legacy', LEGACY_DAY) in sources
+    assert ('garmin', '1') not in sources
+    assert daily_total(fake_supabase, LEGACY_DAY) == [100.0]
+    assert daily_total(fake_supabase, NEXT_DAY) == [20.0]
+    stored = [row for row in fake_supabase.db['garmin_data'] if str(row['date']).startswith(LEGACY_DAY)]
+    assert [row['trimp'] for row in stored] == [100.0]
+    # The failed day is listed again by the next sync
+    assert not fake_supabase.db.get('sync_watermarks')
+
+
+def test_retried_legacy_day_is_replaced_by_its_activities(fake_supabase, monkeypatch):
+    seed_legacy_day(fake_supabase)
+    run_sync(monkeypatch, failing_ids={2})
+
+    result = run_sync(monkeypatch)
+
+    assert result['success']
+    sources = {(row['source'], row['source_id']) for row in fake_supabase.db['activities']}
+    assert ('legacy', LEGACY_DAY) not in sources
+    assert daily_total(fake_supabase, LEGACY_DAY) == [100.0]
+    assert daily_total(fake_supabase, NEXT_DAY) == [20.0]
+
+
+def test_backfill_window_drops_activities_of_skipped_days(monkeypatch):
+    class Limiter:
+        def wait(self):
+            pass
+
+    details = {1: {'connectIQMeasurements': [{'developerFieldNumber': 4, 'value': 30.0}]}, 2: None,
+               3: {'connectIQMeasurements': [{'developerFieldNumber': 4, 'value': 20.0}]}}
+    monkeypatch.setattr(garmin_backfill, 'get_activities_page', lambda session, start, end, offset, size: ACTIVITIES[offset:offset + size])
+    monkeypatch.setattr(garmin_backfill, 'get_activity_details', lambda session, activity_id: details[activity_id])
+    monkeypatch.setattr(garmin_backfill.time, 'sleep', lambda seconds: None)
+
+    rows, imported, skipped_days = garmin_backfill.fetch_window(None, Limiter(), TODAY - timedelta(days=7), TODAY)
+
+    assert skipped_days == {LEGACY_DAY}
+    assert [row['source_id'] for row in rows] == ['3']
+    assert [activity['activityId'] for activity in imported] == [3]
+
+
+def test_watermarked_sync_holds_watermark_before_failed_day(fake_supabase, monkeypatch):
+    seed_legacy_day(fake_supabase)
+    watermark_start = datetime.combine(TODAY - timedelta(days=8), datetime.min.time()) + timedelta(hours=7)
+    fake_supabase.db['sync_watermarks'] = [{
+        'user_id': USER_ID, 'last_activity_start': watermark_start.isoformat(),
+        'last_activity_id': 99, 'recent_activities': []
+    }]
+    monkeypatch.setattr(garmin_sync, 'DB_METRICS_RECOMPUTE', False)
+
+    monkeypatch.setattr(garmin_sync, 'initialize_garmin_client', lambda email, password, user_id=None: FakeGarmin({2}))
+    garmin_sync.sync_garmin_data(USER_ID)
+
+    assert fake_supabase.db['sync_watermarks'][0]['last_activity_start'] < f"{LEGACY_DAY} 00:00:00"
+    assert daily_total(fake_supabase, LEGACY_DAY) == [100.0]
+
+    monkeypatch.setattr(garmin_sync, 'initialize_garmin_client', lambda email, password, user_id=None: FakeGarmin())
+    garmin_sync.sync_garmin_data(USER_ID)
+
+    sources = {(row['source'], row['source_id']) for row in fake_supabase.db['activities']}
+    assert ('legacy', LEGACY_DAY) not in sources
+    assert daily_total(fake_supabase, LEGACY_DAY) == [100.0]
+    assert fake_supabase.db['sync_watermarks'][0]['last_activity_start'] == f"{NEXT_DAY} 07:00:00"
+
+
+def test_backfill_does_not_create_a_watermark(fake_supabase, monkeypatch):
+    class Limiter:
+        def __init__(self, rate):
+            pass
+
+        def wait(self):
+            pass
+
+    fake_supabase.db['garmin_credentials'] = [{'user_id': USER_ID, 'email': 'athlete@example.com', 'password': 'pw'}]
+    details = {activity_id: {'connectIQMeasurements': [{'developerFieldNumber': 4, 'value': trimp}]}
+               for activity_id, trimp in TRIMPS.items()}
+    monkeypatch.setattr(garmin_backfill, 'RateLimiter', Limiter)
+    monkeypatch.setattr(garmin_data_store, 'HISTORY_CSV', False)
+    monkeypatch.setattr(garmin_backfill, 'direct_garmin_login', lambda email, password, pool_size=None: None)
+    monkeypatch.setattr(garmin_backfill, 'get_activities_page', lambda session, start, end, offset, size: [
+        activity for activity in ACTIVITIES if start <= activity['startTimeLocal'][:10] <= end
+    ][offset:offset + size])
+    monkeypatch.setattr(garmin_backfill, 'get_activity_details', lambda session, activity_id: details[activity_id])
+
+    result = garmin_backfill.backfill_garmin_history(USER_ID, TODAY - timedelta(days=7), TODAY - timedelta(days=1), max_workers=1)
+
+    assert result['success'], result.get('error')
+    assert daily_total(fake_supabase, NEXT_DAY) == [20.0]
+    assert not fake_supabase.db.get('sync_watermarks')
@@ -0,0 +1,42 @@
+import pytest
+
+import garmin_sync
+
+USER_ID = 'user-1'
+
+
+def fake_strategies(monkeypatch, working):
+    tried = []
+
+    def strategy(name):
+        def login(email, password):
+            tried.append(name)
+            if name not in working:
+                raise Exception(f"{name} rejected")
+            return name
+        return login
+
+    monkeypatch.setattr(garmin_sync, 'LOGIN_STRATEGIES', {name: strategy(name) for name in garmin_sync.LOGIN_STRATEGIES})
+    return tried
+
+
+def test_working_strategy_is_stored_per_user_and_tried_first(fake_supabase, monkeypatch):
+    tried = fake_strategies(monkeypatch, {'garminconnect_encoded_password'})
+
+    assert garmin_sync.initialize_garmin_client('athlete@example.com', 'p@ss', USER_ID) == 'garminconnect_encoded_password'
+    assert tried == ['garminconnect', 'garminconnect_encoded_password']
+    assert garmin_sync.get_login_strategy(USER_ID) == 'garminconnect_encoded_password'
+
+    tried.clear()
+    garmin_sync.initialize_garmin_client('athlete@example.com', 'p@ss', USER_ID)
+    assert tried == ['garminconnect_encoded_password']
+
+
+def test_failed_login_clears_stored_strategy(fake_supabase, monkeypatch):
+    garmin_sync.save_login_strategy(USER_ID, 'garminconnect_encoded_password')
+    fake_strategies(monkeypatch, set())
+
+    with pytest.raises(Exception):
+        garmin_sync.initialize_garmin_client('athlete@example.com', 'p@ss', USER_ID)
+
+    assert garmin_sync.get_login_strategy(USER_ID) is None
@@ -0,0 +1,43 @@
+import manual_data_processor
+
+USER_ID = 'user-1'
+
+
+def failing_recalculation(monkeypatch):
+    invalidated = []
+
+    def recalculate_day(user_id, date_str):
+        raise Exception("recalculation failed")
+
+    monkeypatch.setattr(manual_data_processor, 'recalculate_day', recalculate_day)
+    monkeypatch.setattr(manual_data_processor, 'invalidate_user', lambda user_id, since: invalidated.append((user_id, since)))
+    return invalidated
+
+
+def test_failed_recalculation_still_invalidates_added_entry(fake_supabase, monkeypatch):
+    invalidated = failing_recalculation(monkeypatch)
+    monkeypatch.setattr(manual_data_processor, 'insert_manual_entry',
+                        lambda user_id, date_str, trimp, activity_name: {'id': 7, 'user_id': user_id, 'date': date_str})
+    result = manual_data_processor.add_manual_entry(USER_ID, '2026-10-01', 50.0, 'Run')
+
+    assert not result['success']
+    assert invalidated == [(USER_ID, '2026-10-01')]
+
+
+def test_failed_recalculation_still_invalidates_moved_entry(fake_supabase, monkeypatch):
+    invalidated = failing_recalculation(monkeypatch)
+    fake_supabase.db['manual_data'] = [{'id': 7, 'user_id': USER_ID, 'date': '2026-10-05', 'trimp': 50.0, 'activity_name': 'Run'}]
+
+    result = manual_data_processor.update_manual_entry(7, '2026-10-01', 60.0, 'Ride')
+
+    assert not result['success']
+    assert invalidated == [(USER_ID, '2026-10-01')]
+
+
+def test_failed_lookup_does_not_invalidate(fake_supabase, monkeypatch):
+    invalidated = failing_recalculation(monkeypatch)
+
+    result = manual_data_processor.delete_manual_entry(7)
+
+    assert not result['success']
+    assert invalidated == []
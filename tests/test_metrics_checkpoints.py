@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+import garmin_data_store
+import metrics_checkpoints
+
+USER_ID = 'user-1'
+
+
+def test_seed_replays_every_row_after_an_old_checkpoint(fake_supabase, monkeypatch):
+    monkeypatch.setattr(garmin_data_store, 'HISTORY_CSV', False)
+    checkpoint_day = date(2022, 1, 31)
+    fake_supabase.db['user_metrics_checkpoints'] = [{
+        'user_id': USER_ID, 'checkpoint_date': checkpoint_day.isoformat(), 'atl': 50.0, 'ctl': 50.0, 'tsb': 0.0
+    }]
+    # More rows after the checkpoint than one response returns, none of them checkpointed
+    days = 1500
+    fake_supabase.db['garmin_data'] = [
+        {
+            'user_id': USER_ID,
+            'date': (checkpoint_day + timedelta(days=offset)).isoformat(),
+            'trimp': 60.0,
+            'atl': 50.0 + offset * 0.01,
+            'ctl': 50.0 + offset * 0.001,
+            'tsb': 0.0
+        }
+        for offset in range(days)
+    ]
+    date_str = (checkpoint_day + timedelta(days=days)).isoformat()
+
+    seed = metrics_checkpoints.seed_metrics(USER_ID, date_str)
+
+    last = fake_supabase.db['garmin_data'][-1]
+    assert seed['atl'] == last['atl']
+    assert seed['ctl'] == last['ctl']
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import garmin_sync
+
+USER_ID = 'user-1'
+TODAY = datetime.now().date()
+
+
+def day(offset):
+    return str(TODAY - timedelta(days=offset))
+
+
+class ListedGarmin:
+    garmin_connect_activities = '/activitylist-service/activities/search/activities'
+
+    def __init__(self, activities):
+        self.activities = activities
+
+    def connectapi(self, url, params=None):
+        start = int(params['start'])
+        return self.activities[start:start + int(params['limit'])]
+
+    def get_activity(self, activity_id):
+        return {'connectIQMeasurements': [{'developerFieldNumber': 4, 'value': 10.0 * activity_id}]}
+
+
+def run_sync(fake_supabase, monkeypatch, activities):
+    fake_supabase.db['garmin_credentials'] = [{'user_id': USER_ID, 'email': 'athlete@example.com', 'password': 'pw'}]
+    monkeypatch.setattr(garmin_sync, 'DB_METRICS_RECOMPUTE', False)
+    monkeypatch.setattr(garmin_sync, 'SYNC_FLUSH_DAYS', 1)
+    monkeypatch.setattr(garmin_sync, 'initialize_garmin_client', lambda email, password, user_id=None: ListedGarmin(activities))
+    start_date = datetime.combine(TODAY - timedelta(days=10), datetime.min.time())
+    return garmin_sync.sync_garmin_data(USER_ID, start_date=start_date)
+
+
+def daily_totals(fake_supabase):
+    return {row['activity_date']: row['trimp'] for row in fake_supabase.db['activity_daily_totals']}
+
+
+def test_activity_listed_a_day_late_is_imported(fake_supabase, monkeypatch):
+    # Sorted by GMT start: the third activity's local day is earlier than the second's
+    activities = [
+        {'activityId': 1, 'activityName': 'Run', 'startTimeLocal': f"{day(8)} 07:00:00"},
+        {'activityId': 2, 'activityName': 'Run', 'startTimeLocal': f"{day(6)} 01:00:00"},
+        {'activityId': 3, 'activityName': 'Ride', 'startTimeLocal': f"{day(7)} 23:00:00"},
+        {'activityId': 4, 'activityName': 'Run', 'startTimeLocal': f"{day(2)} 07:00:00"}
+    ]
+
+    result = run_sync(fake_supabase, monkeypatch, activities)
+
+    assert result['newActivities'] == 4
+    assert daily_totals(fake_supabase) == {day(8): 10.0, day(7): 30.0, day(6): 20.0, day(2): 40.0}
+
+
+def test_activity_listed_after_its_day_was_saved_holds_the_watermark(fake_supabase, monkeypatch):
+    activities = [
+        {'activityId': 1, 'activityName': 'Run', 'startTimeLocal': f"{day(8)} 07:00:00"},
+        {'activityId': 2, 'activityName': 'Run', 'startTimeLocal': f"{day(4)} 07:00:00"},
+        {'activityId': 3, 'activityName': 'Ride', 'startTimeLocal': f"{day(7)} 07:00:00"}
+    ]
+
+    result = run_sync(fake_supabase, monkeypatch, activities)
+
+    assert result['newActivities'] == 2
+    watermark = fake_supabase.db['sync_watermarks'][0]
+    assert watermark['last_activity_id'] == 1
+    assert watermark['last_activity_start'] < f"{day(7)} 00:00:00"
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import tsb_planner
+
+TODAY = datetime.now().date()
+EVENT_DATE = str(TODAY + timedelta(days=21))
+
+
+def seed_metrics(monkeypatch):
+    monkeypatch.setattr(tsb_planner, 'get_latest_metrics', lambda user_id: {
+        'start_date': TODAY, 'atl': 60.0, 'ctl': 50.0, 'last_data_date': str(TODAY - timedelta(days=1))
+    })
+
+
+def test_reachable_target_is_planned(monkeypatch):
+    seed_metrics(monkeypatch)
+
+    result = tsb_planner.solve_tsb_plan('user-1', EVENT_DATE, 10.0)
+
+    assert result['success']
+    assert abs(result['event_day_tsb'] - 10.0) < 2
+
+
+def test_unreachable_target_is_reported(monkeypatch):
+    seed_metrics(monkeypatch)
+
+    # Three days of rest lift TSB from -10 to about 8, the most any plan that short can reach
+    result = tsb_planner.solve_tsb_plan('user-1', str(TODAY + timedelta(days=3)), 30.0)
+
+    assert not result['success']
+    assert 'cannot be reached' in result['error']
+    assert result['closest_event_day_tsb'] < 30.0
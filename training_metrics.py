@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Vectorized ATL/CTL/TSB computation.
+
+Uses the same recurrence as the per-day loops in the sync and manual entry code:
+
+    atl = prev_atl + (trimp - prev_atl) / 7
+    ctl = prev_ctl + (trimp - prev_ctl) / 42
+    tsb = prev_ctl - prev_atl
+
+Arrays are laid out as (series, day) so many athletes or candidate plans are
+computed together instead of looping per series.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+ATL_DAYS = 7
+CTL_DAYS = 42
+
+DEFAULT_SEED = {'atl': 50.0, 'ctl': 50.0, 'tsb': 0.0}
+
+# Days per block in ema(); keeps decay powers well inside float64 precision
+_BLOCK_DAYS = 64
+
+@lru_cache(maxsize=8)
+def _ema_operators(days, size):
+    """Lower-triangular kernel and carry-over powers for one block of the recurrence"""
+    alpha = 1.0 / days
+    decay = 1.0 - alpha
+    lags = np.arange(size)[None, :] - np.arange(size)[:, None]
+    kernel = np.where(lags >= 0, alpha * decay ** np.clip(lags, 0, None), 0.0)
+    carry = decay ** np.arange(1, size + 1)
+    return kernel, carry
+
+def ema(trimp, days, seed):
+    """
+    Run value = prev + (trimp - prev) / days over the last axis.
+
+    Each block of days is one matrix product: value[t] = decay^(t+1) * seed +
+    sum over k <= t of alpha * decay^(t-k) * trimp[k].
+
+    Args:
+        trimp (array): (..., days) daily TRIMP
+        days (int): Time constant (ATL_DAYS or CTL_DAYS)
+        seed (float or array): Value on the day before the first column, one per series
+
+    Returns:
+        ndarray: Values after each day, same shape as trimp
+    """
+    trimp = np.asarray(trimp, dtype=np.float64)
+    values = np.empty_like(trimp)
+    prev = np.broadcast_to(np.asarray(seed, dtype=np.float64), trimp.shape[:-1]).astype(np.float64)
+    kernel, carry = _ema_operators(days, _BLOCK_DAYS)
+
+    for start in range(0, trimp.shape[-1], _BLOCK_DAYS):
+        block = trimp[..., start:start + _BLOCK_DAYS]
+        n = block.shape[-1]
+        values[..., start:start + n] = block @ kernel[:n, :n] + prev[..., None] * carry[:n]
+        prev = values[..., start + n - 1]
+
+    return values
+
+def project_load(trimp, atl0, ctl0):
+    """
+    Project ATL/CTL/TSB for daily TRIMP starting from the previous day's ATL/CTL.
+
+    Args:
+        trimp (array): (..., days) daily TRIMP
+        atl0 (float or array): ATL on the day before the first column
+        ctl0 (float or array): CTL on the day before the first column
+
+    Returns:
+        tuple: (atl, ctl, tsb) arrays shaped like trimp; tsb uses the previous day's values
+    """
+    atl = ema(trimp, ATL_DAYS, atl0)
+    ctl = ema(trimp, CTL_DAYS, ctl0)
+
+    tsb = np.empty_like(atl)
+    tsb[..., 0] = np.asarray(ctl0, dtype=np.float64) - np.asarray(atl0, dtype=np.float64)
+    tsb[..., 1:] = ctl[..., :-1] - atl[..., :-1]
+
+    return atl, ctl, tsb
+
+def final_tsb_weights(days):
+    """
+    Linear form of the TSB after `days` days of training: for trimp x,
+    (ctl - atl) after the last day = ctl_weight * ctl0 - atl_weight * atl0 + weights @ x.
+
+    Returns:
+        tuple: (weights, atl_weight, ctl_weight)
+    """
+    lags = np.arange(days - 1, -1, -1)
+    atl_decay = 1 - 1 / ATL_DAYS
+    ctl_decay = 1 - 1 / CTL_DAYS
+    weights = ctl_decay ** lags / CTL_DAYS - atl_decay ** lags / ATL_DAYS
+    return weights, atl_decay ** days, ctl_decay ** days
+
+def fill_load_gaps(trimp, stored_atl, stored_ctl, stored_tsb):
+    """
+    Complete stored metric matrices, computing days that have no stored metrics
+    from the previous day with the ATL/CTL recurrence.
+
+    Stored values win where present (NaN marks a missing value). A series stays NaN
+    until its first stored day, since there is nothing to seed it from.
+
+    Args:
+        trimp (ndarray): (series, days) daily TRIMP, 0 for days without data
+        stored_atl (ndarray): (series, days) stored ATL or NaN
+        stored_ctl (ndarray): (series, days) stored CTL or NaN
+        stored_tsb (ndarray): (series, days) stored TSB or NaN
+
+    Returns:
+        tuple: (atl, ctl, tsb) float64 arrays of shape (series, days)
+    """
+    trimp = np.asarray(trimp, dtype=np.float64)
+    atl = np.empty_like(trimp)
+    ctl = np.empty_like(trimp)
+    tsb = np.empty_like(trimp)
+
+    prev_atl = np.full(trimp.shape[0], np.nan)
+    prev_ctl = np.full(trimp.shape[0], np.nan)
+
+    for day in range(trimp.shape[1]):
+        has_metrics = ~np.isnan(stored_atl[:, day]) & ~np.isnan(stored_ctl[:, day])
+
+        computed_atl = prev_atl + (trimp[:, day] - prev_atl) / ATL_DAYS
+        computed_ctl = prev_ctl + (trimp[:, day] - prev_ctl) / CTL_DAYS
+        computed_tsb = prev_ctl - prev_atl
+
+        atl[:, day] = np.where(has_metrics, stored_atl[:, day], computed_atl)
+        ctl[:, day] = np.where(has_metrics, stored_ctl[:, day], computed_ctl)
+        stored_day_tsb = np.where(np.isnan(stored_tsb[:, day]), computed_tsb, stored_tsb[:, day])
+        tsb[:, day] = np.where(has_metrics, stored_day_tsb, computed_tsb)
+
+        prev_atl = atl[:, day]
+        prev_ctl = ctl[:, day]
+
+    return atl, ctl, tsb
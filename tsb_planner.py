@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Server-side TSB planner.
+
+Solves the daily TRIMP plan that reaches a target TSB on event day, seeded from
+the user's latest stored metrics. The event-day TSB is linear in the planned
+TRIMP (see training_metrics.final_tsb_weights), so instead of the iterative
+adjustments in TSBPlanner.tsx the plan is the smallest change to a baseline
+training pattern that hits the target, found with least squares.
+"""
+
+import traceback
+from datetime import datetime, timedelta
+import numpy as np
+from garmin_data_store import fetch_latest_row, normalize_date
+from training_metrics import ATL_DAYS, CTL_DAYS, project_load, final_tsb_weights
+
+MAX_PLAN_DAYS = 366
+MAX_CANDIDATE_PLANS = 50
+# Largest event-day TSB miss of the solved plan (before rounding) still reported as reaching the target
+TSB_TARGET_TOLERANCE = 0.5
+
+def get_latest_metrics(user_id, today=None):
+    """
+    Get the ATL/CTL to seed a plan starting today (or tomorrow if today is already stored).
+
+    Missing days between the latest stored row and the plan start are treated as rest days.
+
+    Returns:
+        dict: {'start_date', 'atl', 'ctl', 'last_data_date'} or None when nothing is stored
+    """
+    today = today or datetime.now().date()
+    row = fetch_latest_row(user_id, 'date, atl, ctl')
+    if not row or row.get('atl') is None or row.get('ctl') is None:
+        return None
+
+    last_date = datetime.strptime(normalize_date(row['date']), '%Y-%m-%d').date()
+    start_date = max(today, last_date + timedelta(days=1))
+    rest_days = (start_date - last_date).days - 1
+
+    return {
+        'start_date': start_date,
+        'atl': float(row['atl']) * (1 - 1 / ATL_DAYS) ** rest_days,
+        'ctl': float(row['ctl']) * (1 - 1 / CTL_DAYS) ** rest_days,
+        'last_data_date': last_date.strftime('%Y-%m-%d')
+    }
+
+def baseline_plan(days, ctl):
+    """Maintenance load (current CTL) with the same sinusoidal build/ease pattern as TSBPlanner.tsx"""
+    day_factor = np.sin(np.arange(days) / days * np.pi)
+    return np.maximum(0.0, ctl * (0.8 + day_factor * 0.4))
+
+def solve_trimp_plan(atl0, ctl0, days, target_tsb, fixed=None):
+    """
+    Find daily TRIMP for `days` days so that TSB on the following (event) day equals target_tsb.
+
+    Minimizes the squared change to baseline_plan() subject to hitting the target
+    and TRIMP >= 0, keeping fixed days unchanged. Days clipped at zero are frozen
+    and the rest re-solved until the plan is non-negative.
+
+    Args:
+        atl0 (float): ATL on the day before the plan
+        ctl0 (float): CTL on the day before the plan
+        days (int): Number of training days before the event
+        target_tsb (float): Desired TSB on event day
+        fixed (dict, optional): {day_index: trimp} values that must not change
+
+    Returns:
+        ndarray: Daily TRIMP
+    """
+    fixed = fixed or {}
+    weights, atl_weight, ctl_weight = final_tsb_weights(days)
+    plan = baseline_plan(days, ctl0)
+
+    free = np.ones(days, dtype=bool)
+    for day, trimp in fixed.items():
+        plan[day] = trimp
+        free[day] = False
+
+    for _ in range(days):
+        if not free.any():
+            break
+
+        # TSB still missing with the free days at their current values
+        residual = target_tsb - (ctl_weight * ctl0 - atl_weight * atl0 + weights @ plan)
+
+        # Minimum-norm change to the free days: weights[free] @ delta = residual
+        delta = np.linalg.lstsq(weights[free][None, :], np.array([residual]), rcond=None)[0]
+        plan[free] += delta
+
+        negative = free & (plan < 0)
+        if not negative.any():
+            break
+        plan[negative] = 0.0
+        free &= ~negative
+
+    return plan
+
+def solve_tsb_plan(user_id, event_date, target_tsb, custom_days=None):
+    """
+    Build a daily training plan that reaches target_tsb on event_date.
+
+    Args:
+        user_id (str): The user's ID
+        event_date (str): Event date in YYYY-MM-DD format
+        target_tsb (float): Desired TSB on event day
+        custom_days (dict, optional): {YYYY-MM-DD: trimp} days the user set by hand
+
+    Returns:
+        dict: Result of the operation
+    """
+    try:
+        seed = get_latest_metrics(user_id)
+        if not seed:
+            return {'success': False, 'error': 'No stored ATL/CTL to plan from'}
+
+        event = datetime.strptime(event_date, '%Y-%m-%d').date()
+        days = (event - seed['start_date']).days
+        if days <= 0:
+            return {'success': False, 'error': 'Event date must be in the future'}
+        if days > MAX_PLAN_DAYS:
+            return {'success': False, 'error': f'Plans are limited to {MAX_PLAN_DAYS} days'}
+
+        dates = [seed['start_date'] + timedelta(days=i) for i in range(days)]
+        day_index = {date.strftime('%Y-%m-%d'): i for i, date in enumerate(dates)}
+        fixed = {}
+        for date_str, trimp in (custom_days or {}).items():
+            if date_str in day_index:
+                fixed[day_index[date_str]] = max(0.0, float(trimp))
+
+        plan = solve_trimp_plan(seed['atl'], seed['ctl'], days, float(target_tsb), fixed)
+
+        # Too high a target clips every free day to 0 (and all-custom plans cannot move at all)
+        exact_atl, exact_ctl, _ = project_load(plan, seed['atl'], seed['ctl'])
+        closest_tsb = float(exact_ctl[-1] - exact_atl[-1])
+        if abs(closest_tsb - float(target_tsb)) > TSB_TARGET_TOLERANCE:
+            return {
+                'success': False,
+                'error': f'Target TSB {float(target_tsb):g} cannot be reached by {event_date}; '
+                         f'the closest plan reaches {closest_tsb:.1f}',
+                'closest_event_day_tsb': round(closest_tsb, 2)
+            }
+
+        # Whole TRIMP values like the client planner; custom values are kept as entered
+        rounded = np.round(plan)
+        for day, trimp in fixed.items():
+            rounded[day] = trimp
+
+        atl, ctl, tsb = project_load(rounded, seed['atl'], seed['ctl'])
+
+        return {
+            'success': True,
+            'seed': {
+                'atl': round(seed['atl'], 2),
+                'ctl': round(seed['ctl'], 2),
+                'last_data_date': seed['last_data_date']
+            },
+            'plan': [
+                {
+                    'date': dates[i].strftime('%Y-%m-%d'),
+                    'trimp': float(rounded[i]),
+                    'projected_tsb': round(float(tsb[i]), 2),
+                    'projected_atl': round(float(atl[i]), 2),
+                    'projected_ctl': round(float(ctl[i]), 2),
+                    'is_custom': i in fixed
+                }
+                for i in range(days)
+            ],
+            'event_day_tsb': round(float(ctl[-1] - atl[-1]), 2)
+        }
+
+    except Exception as e:
+        print(f"Error solving TSB plan: {str(e)}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def project_candidate_plans(user_id, plans):
+    """
+    Project ATL/CTL/TSB for several candidate plans at once.
+
+    All plans start on the same day (see get_latest_metrics) and are computed as one
+    (plan, day) matrix; shorter plans are padded with rest days, which are cut off
+    again before each plan's series and summary are reported.
+
+    Args:
+        user_id (str): The user's ID
+        plans (list): Lists of daily TRIMP, one per candidate plan
+
+    Returns:
+        dict: Result of the operation
+    """
+    try:
+        if not plans:
+            return {'success': False, 'error': 'No plans given'}
+        if len(plans) > MAX_CANDIDATE_PLANS:
+            return {'success': False, 'error': f'At most {MAX_CANDIDATE_PLANS} plans per request'}
+
+        lengths = [len(plan) for plan in plans]
+        days = max(lengths)
+        if min(lengths) == 0:
+            return {'success': False, 'error': 'Plans must contain at least one day'}
+        if days > MAX_PLAN_DAYS:
+            return {'success': False, 'error': f'Plans are limited to {MAX_PLAN_DAYS} days'}
+
+        seed = get_latest_metrics(user_id)
+        if not seed:
+            return {'success': False, 'error': 'No stored ATL/CTL to project from'}
+
+        matrix = np.zeros((len(plans), days))
+        for i, plan in enumerate(plans):
+            matrix[i, :len(plan)] = plan
+        if not np.isfinite(matrix).all():
+            return {'success': False, 'error': 'TRIMP values must be finite numbers'}
+        if (matrix < 0).any():
+            return {'success': False, 'error': 'TRIMP values must be positive'}
+
+        atl, ctl, tsb = project_load(matrix, seed['atl'], seed['ctl'])
+        dates = [(seed['start_date'] + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+
+        return {
+            'success': True,
+            'seed': {
+                'atl': round(seed['atl'], 2),
+                'ctl': round(seed['ctl'], 2),
+                'last_data_date': seed['last_data_date']
+            },
+            'dates': dates,
+            'projections': [
+                {
+                    'days': n,
+                    'atl': np.round(atl[i, :n], 2).tolist(),
+                    'ctl': np.round(ctl[i, :n], 2).tolist(),
+                    'tsb': np.round(tsb[i, :n], 2).tolist(),
+                    'final_tsb': round(float(ctl[i, n - 1] - atl[i, n - 1]), 2),
+                    'min_tsb': round(float(tsb[i, :n].min()), 2),
+                    'peak_atl': round(float(atl[i, :n].max()), 2)
+                }
+                for i, n in enumerate(lengths)
+            ]
+        }
+
+    except Exception as e:
+        print(f"Error projecting candidate plans: {str(e)}")
+        print(traceback.format_exc())
+        return {
+            'success': False,
+            'error': str(e)
+        }